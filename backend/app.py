@@ -1,24 +1,43 @@
 import json
 import logging
 import os
-from datetime import datetime
+import threading
 
 from dotenv import load_dotenv
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
-
-from db.db import Client, SessionLocal, UserProfile, WhatsAppMessage, init_db
-from utils.ai.detector_audio import transcribir_audio
-from utils.ai.detector_image import detectar_auto
-from utils.gcp import upload_image_to_gcp
-from utils.whatsapp import (
-    build_whatsapp_reply,
-    download_whatsapp_media,
-    send_whatsapp_message,
+from sqlalchemy import text
+
+from db.db import (
+    Client,
+    SessionLocal,
+    UserProfile,
+    WhatsAppMessage,
+    engine,
+    init_db,
+)
+from db.session import db_session, unit_of_work
+from services.client_registration import (
+    RowError,
+    bulk_register,
+    iter_csv_rows,
+    profile_values,
+)
+from services.conversation_history import (
+    iter_json_array,
+    iter_messages,
+    iter_ndjson,
+    message_page,
 )
+from services.warmup import READY, warm_up
+from services.whatsapp_pipeline import build_worker_pool, enqueue_webhook_messages
+from utils.conversation_stats import record_messages
+from utils.jobs import QUEUE_DEPTH, SQLJobStore
+from utils.metrics import render_prometheus, start_metrics_flusher
+from utils.profile_cache import PROFILE_CACHE
+from utils.whatsapp import WhatsAppTurn
 
 load_dotenv()
-init_db()
 
 logging.basicConfig(level=logging.INFO)
 
@@ -26,14 +45,84 @@ app = Flask(__name__)
 CORS(app)
 
 
+@app.cli.command("init-db")
+def init_db_command():
+    """Aplica las migraciones pendientes (``flask --app app init-db``)."""
+    init_db()
+
+
+# Cola durable de mensajes del webhook. Los workers pueden correr dentro de
+# este proceso (WHATSAPP_WORKERS > 0) o aparte con `python worker.py`.
+WHATSAPP_WORKERS = int(os.getenv("WHATSAPP_WORKERS", "2"))
+job_store = SQLJobStore()
+worker_pool = build_worker_pool(job_store, WHATSAPP_WORKERS)
+
+
+def start_background_workers() -> None:
+    """Inicia los workers de la cola dentro de este proceso, si están habilitados."""
+    if WHATSAPP_WORKERS > 0:
+        worker_pool.start()
+
+
+def start_serving_process() -> None:
+    """
+    Arranca los hilos de un proceso que atiende tráfico: workers de la cola,
+    calentamiento de clientes y volcado de métricas (con METRICS_MULTIPROC_DIR).
+
+    Importar la app no arranca nada (``flask --app app init-db`` corre sobre
+    un esquema sin migrar); lo llaman los puntos de entrada: ``python app.py``
+    y el hook ``post_fork`` de gunicorn en cada worker.
+    """
+    start_background_workers()
+    start_metrics_flusher()
+    threading.Thread(target=warm_up, name="warmup", daemon=True).start()
+
+
+@app.teardown_appcontext
+def remove_db_session(exc=None) -> None:
+    """
+    Descarta la sesión de ``SessionLocal`` del hilo al terminar la petición.
+
+    La cola (``SQLJobStore``), el alta masiva, la exportación del historial y
+    las cuotas de Gemini usan ``SessionLocal()``: sin esto la sesión quedaría
+    registrada en el hilo de gunicorn y pasaría a la siguiente petición.
+    """
+    SessionLocal.remove()
+
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    """Liveness: el proceso responde."""
+    return jsonify({"status": "ok"}), 200
+
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    """
+    Readiness: el worker terminó de calentar y la base de datos responde.
+
+    Devuelve 503 mientras el calentamiento no termina o si la BD no está
+    disponible, para que el balanceador no envíe tráfico a este worker.
+    """
+    if not READY.is_set():
+        return jsonify({"status": "warming_up"}), 503
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    except Exception as e:
+        logging.warning("[READYZ] Base de datos no disponible: %s", e)
+        return jsonify({"status": "db_unavailable"}), 503
+    return jsonify({"status": "ready"}), 200
+
+
 @app.route("/api/whatsapp/webhook", methods=["GET", "POST"])
 def whatsapp_webhook():
     """
     Endpoint básico para recibir eventos/mensajes de WhatsApp.
 
     - Espera un cuerpo JSON (por ejemplo, el webhook de Twilio o de la API de WhatsApp).
-    - De momento solo registra/inspecciona el payload y responde 200.
-    - Aquí puedes agregar la lógica para responder mensajes, llamar a modelos, etc.
+    - Persiste cada mensaje como trabajo en la cola durable y responde 200 de inmediato.
+    - El procesamiento (media, LLM, envío y guardado) lo hacen los workers.
     """
     # 1) Verificación de webhook (estilo Meta WhatsApp Cloud API) vía GET
     if request.method == "GET":
@@ -60,141 +149,39 @@ def whatsapp_webhook():
         json.dumps(payload, ensure_ascii=False),
     )
 
-    # Intentar extraer el mensaje, número y posible media (imagen/audio) siguiendo la
-    # estructura típica de WhatsApp Cloud API. Si no coincide, se devuelve el
-    # payload completo para facilitar el debug.
-    user_message = None
-    phone = None
-    media_url = None
-    media_id = None
-    media_type = None
-
+    # Solo se extraen los mensajes y se persisten como trabajos; media, LLM,
+    # envío y guardado corren en los workers para responder a Meta en
+    # milisegundos. Una entrega puede traer varios mensajes y varios usuarios.
     try:
-        entry = (payload.get("entry") or [])[0]
-        changes = (entry.get("changes") or [])[0]
-        value = changes.get("value") or {}
-        messages = value.get("messages") or []
-        if messages:
-            msg = messages[0]
-            phone = msg.get("from")
-            msg_type = msg.get("type")
-            if msg_type == "text":
-                text_obj = msg.get("text") or {}
-                user_message = text_obj.get("body")
-            elif msg_type == "image":
-                image_obj = msg.get("image") or {}
-                media_id = image_obj.get("id")
-                caption = image_obj.get("caption")
-
-                # Si hay caption, úsalo como mensaje del usuario; si no, un texto por defecto
-                user_message = caption or "Imagen enviada por el usuario"
-
-                if media_id:
-                    img_bytes = download_whatsapp_media(media_id)
-                    if img_bytes:
-                        # Nombre de archivo: phone_timestamp_mediaid.jpg (aprox)
-                        ts = datetime.utcnow().strftime("%Y%m%dT%H%M%S%fZ")
-                        fname = f"whatsapp/{phone}_{ts}_{media_id}.jpg"
-                        media_url = upload_image_to_gcp(img_bytes, fname)
-
-                        # 1. Ejecutar modelo Gemini para detectar alimentos
-                        result_json = detectar_auto(img_bytes)
-                        # 2. Si hubo error en el modelo
-                        if '"error"' in result_json:
-                            reply_text = "⚠️ Ocurrió un error analizando la imagen, intenta nuevamente."
-                        else:
-                            reply_text = result_json  # JSON crudo devuelto por Gemini
-
-            elif msg_type == "audio":
-                audio_obj = msg.get("audio") or {}
-                media_id = audio_obj.get("id")
-
-                # Para audios usamos un mensaje genérico
-                user_message = "Audio enviado por el usuario"
-
-                if media_id:
-                    audio_bytes = download_whatsapp_media(media_id)
-                    if audio_bytes:
-                        # Nombre de archivo: phone_timestamp_mediaid.ogg (aprox)
-                        ts = datetime.utcnow().strftime("%Y%m%dT%H%M%S%fZ")
-                        fname = f"whatsapp/{phone}_{ts}_{media_id}.ogg"
-                        media_url = upload_image_to_gcp(audio_bytes, fname)
-
-                        transcripcion = transcribir_audio(audio_bytes)
-
-                        user_message = (
-                            transcripcion
-                            if transcripcion
-                            else "No se pudo transcribir el audio."
-                        )
-                        media_type = "audio"  # Initialize media_type variable here
-
+        job_ids = enqueue_webhook_messages(job_store, payload)
     except Exception:
-        # Si algo falla en el parseo, se mantiene user_message = None
-        logging.exception(
-            "[WHATSAPP WEBHOOK] Error extrayendo mensaje/phone del payload"
-        )
+        # Sin trabajos persistidos respondemos 500 para que Meta reintente
+        logging.exception("[WHATSAPP WEBHOOK] Error encolando mensajes del payload")
+        return jsonify({"error": "No se pudieron encolar los mensajes"}), 500
 
-    user_message = reply_text if "reply_text" in locals() else user_message
+    if job_ids:
+        return jsonify({"status": "queued", "job_ids": job_ids}), 200
 
-    if user_message:
-        logging.info(
-            "[WHATSAPP WEBHOOK] Mensaje de usuario detectado. from=%s body=%s",
-            phone,
-            user_message,
-        )
-        reply_text = build_whatsapp_reply(user_message, phone)
-        db = SessionLocal()
-
-        # Guardar mensaje entrante (incluyendo media_url si existe)
-        if phone:
-            incoming = WhatsAppMessage(
-                phone=phone,
-                message=user_message,
-                direction="in",
-                media_url=media_url,
-                media_id=media_id,
-                media_type=media_type,
-            )
-            db.add(incoming)
-
-        send_result = None
-        if phone:
-            send_result = send_whatsapp_message(phone, reply_text)
-            logging.info("[WHATSAPP WEBHOOK] Resultado envío WhatsApp: %s", send_result)
+    # Caso genérico: devolver el payload completo para debug
+    return jsonify({"status": "ok", "received": payload}), 200
 
-            # Guardar mensaje saliente
-            outgoing = WhatsAppMessage(phone=phone, message=reply_text, direction="out")
-            db.add(outgoing)
 
-        try:
-            db.commit()
-        except Exception as e:
-            db.rollback()
-            logging.exception(
-                "[WHATSAPP WEBHOOK] Error guardando mensajes en BD: %s", e
-            )
-        finally:
-            db.close()
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Métricas en formato de texto de Prometheus.
 
-        if not phone:
-            logging.warning(
-                "[WHATSAPP WEBHOOK] No se encontró número de teléfono en el payload"
-            )
+    Incluye histogramas y contadores por etapa (BD, Gemini, Speech-to-Text,
+    GCS, Graph API) y por tipo de mensaje, además de la profundidad de la cola.
+    """
+    try:
+        counts = job_store.counts()
+        for status in ("pending", "running", "dead"):
+            QUEUE_DEPTH.set(counts.get(status, 0), status=status)
+    except Exception:
+        logging.exception("[METRICS] Error consultando profundidad de la cola")
 
-        return jsonify(
-            {
-                "status": "ok",
-                "from": phone,
-                "user_message": user_message,
-                "reply": reply_text,
-                "send_result": send_result,
-                "media_url": media_url,
-            }
-        ), 200
-
-    # Caso genérico: devolver el payload completo para debug
-    return jsonify({"status": "ok", "received": payload}), 200
+    return Response(render_prometheus(), mimetype="text/plain; version=0.0.4")
 
 
 @app.route("/api/whatsapp/message", methods=["POST"])
@@ -218,27 +205,33 @@ def whatsapp_message():
 
     phone = data.get("phone")
 
-    # Lógica de respuesta reutilizando la misma función que el webhook
-    reply_text = build_whatsapp_reply(user_message, phone)
+    # Mismo turno que el webhook: lecturas en una unidad corta, Gemini fuera
+    # de ella (no retiene una conexión) y escrituras en otra al final.
+    turn = WhatsAppTurn(phone)
+    with unit_of_work("whatsapp_message_load"):
+        turn.load()
+    reply_text = turn.reply(user_message)
 
-    # Guardar mensajes en BD (si hay teléfono)
+    # Guardar mensajes, contadores y estado de conversación (si hay teléfono)
+    # en una transacción
     if phone:
-        db = SessionLocal()
         try:
-            incoming = WhatsAppMessage(
-                phone=phone, message=user_message, direction="in"
-            )
-            outgoing = WhatsAppMessage(phone=phone, message=reply_text, direction="out")
-            db.add(incoming)
-            db.add(outgoing)
-            db.commit()
+            with unit_of_work("whatsapp_message") as db:
+                incoming = WhatsAppMessage(
+                    phone=phone, message=user_message, direction="in"
+                )
+                outgoing = WhatsAppMessage(
+                    phone=phone, message=reply_text, direction="out"
+                )
+                db.add(incoming)
+                db.add(outgoing)
+                record_messages(db, [incoming, outgoing])
+                turn.save()
         except Exception as e:
-            db.rollback()
             logging.exception(
                 "[WHATSAPP MESSAGE] Error guardando mensajes en BD: %s", e
             )
-        finally:
-            db.close()
+        turn.summarize()
 
     response = {
         "to": phone,
@@ -249,24 +242,57 @@ def whatsapp_message():
     return jsonify(response), 200
 
 
+def _int_arg(name: str) -> int | None:
+    value = request.args.get(name)
+    if value in (None, ""):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"'{name}' debe ser un entero") from None
+
+
 @app.route("/api/whatsapp/messages/<phone>", methods=["GET"])
 def get_whatsapp_messages(phone: str):
-    db = SessionLocal()
+    """
+    Historial de mensajes de un teléfono.
+
+    - ``?limit=N&before_id=X`` / ``?after_id=X``: una página por cursor,
+      ``{"messages": [...], "has_more", "next_before_id", "next_after_id"}``.
+    - ``?format=ndjson``: exportación completa en streaming, un mensaje por línea.
+    - Sin parámetros: la lista completa (como antes), emitida en streaming.
+    """
     try:
-        msgs = (
-            db.query(WhatsAppMessage)
-            .filter(WhatsAppMessage.phone == phone)
-            .order_by(WhatsAppMessage.created_at.asc())
-            .all()
-        )
-        return jsonify([m.to_dict() for m in msgs]), 200
+        before_id = _int_arg("before_id")
+        after_id = _int_arg("after_id")
+        limit = _int_arg("limit")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    export_format = request.args.get("format")
+    if export_format not in (None, "json", "ndjson"):
+        return jsonify({"error": "'format' debe ser 'json' o 'ndjson'"}), 400
+
+    paginated = limit is not None or before_id is not None
+    if export_format == "ndjson" or (not paginated and after_id is None):
+        messages = iter_messages(phone, after_id=after_id)
+        if export_format == "ndjson":
+            body, mimetype = iter_ndjson(messages), "application/x-ndjson"
+        else:
+            body, mimetype = iter_json_array(messages), "application/json"
+        return Response(stream_with_context(body), mimetype=mimetype)
+
+    try:
+        with db_session() as db:
+            page = message_page(
+                db, phone, before_id=before_id, after_id=after_id, limit=limit
+            )
+        return jsonify(page), 200
     except Exception as e:
         logging.exception(
             "[WHATSAPP MESSAGES] Error consultando historial para %s: %s", phone, e
         )
         return jsonify({"error": str(e)}), 500
-    finally:
-        db.close()
 
 
 @app.route("/api/client/register", methods=["POST"])
@@ -297,58 +323,84 @@ def register_client():
     if not data:
         return jsonify({"error": "Se requiere un cuerpo JSON"}), 400
 
-    profile_data = data.get("profile") or {}
+    try:
+        values = profile_values(data.get("profile") or {})
+    except RowError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        with unit_of_work("client_register") as db:
+            client = Client(
+                external_id=data.get("external_id"),
+                provider=data.get("provider"),
+            )
+            db.add(client)
+            db.flush()  # para obtener client.id
+
+            profile = UserProfile(client_id=client.id, **values)
+            db.add(profile)
+            db.flush()
+            ids = {"client_id": client.id, "profile_id": profile.id}
+    except Exception as e:
+        logging.exception("[CLIENT REGISTER] Error creando cliente/perfil: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+    PROFILE_CACHE.invalidate(values["whatsapp_number"])
+    return jsonify({**ids, "message": "Cliente y perfil creados correctamente"}), 201
 
-    full_name = profile_data.get("full_name")
-    whatsapp_number = profile_data.get("whatsapp_number")
-    accepted_terms = profile_data.get("accepted_terms", False)
 
-    if not full_name or not whatsapp_number:
-        return jsonify(
-            {"error": "Faltan 'full_name' o 'whatsapp_number' en el perfil"}
-        ), 400
+@app.route("/api/client/register/bulk", methods=["POST"])
+def register_clients_bulk():
+    """
+    Registra muchos clientes y perfiles en una sola petición (onboarding de
+    una clínica o un hogar geriátrico).
+
+    Acepta:
+    - JSON: un arreglo de objetos con la misma forma que ``/api/client/register``.
+    - CSV: archivo en el campo ``file`` (multipart) o cuerpo ``text/csv``, una
+      fila por paciente (ver ``services.client_registration.iter_csv_rows``).
+
+    Las filas válidas se insertan por lotes; la respuesta reporta qué se creó
+    y el error de cada fila rechazada:
+    ``{"created", "failed", "results": [{"row", "client_id", "profile_id"}],
+    "errors": [{"row", "error"}], "error"}``. Si el CSV se corta a mitad
+    (codificación o formato inválidos) responde 400 con ese mismo resumen:
+    las filas anteriores ya quedaron registradas y ``error`` dice dónde se
+    detuvo la lectura.
+    """
+    upload = request.files.get("file")
+    if upload is not None:
+        rows = iter_csv_rows(upload.stream)
+    elif request.mimetype == "text/csv":
+        rows = iter_csv_rows(request.stream)
+    else:
+        data = request.get_json(silent=True)
+        if not isinstance(data, list):
+            return jsonify(
+                {"error": "Se requiere un arreglo JSON o un archivo CSV"}
+            ), 400
+        rows = data
 
-    db = SessionLocal()
     try:
-        client = Client(
-            external_id=data.get("external_id"),
-            provider=data.get("provider"),
-        )
-        db.add(client)
-        db.flush()  # para obtener client.id
-
-        profile = UserProfile(
-            client_id=client.id,
-            profile_photo_url=profile_data.get("profile_photo_url"),
-            full_name=full_name,
-            age=profile_data.get("age"),
-            gender=profile_data.get("gender"),
-            whatsapp_number=whatsapp_number,
-            rh=profile_data.get("rh"),
-            height_cm=profile_data.get("height_cm"),
-            weight_kg=profile_data.get("weight_kg"),
-            diseases=profile_data.get("diseases") or [],
-            allergies=profile_data.get("allergies") or [],
-            accepted_terms=bool(accepted_terms),
-        )
-        db.add(profile)
-        db.commit()
-
-        return jsonify(
-            {
-                "client_id": client.id,
-                "profile_id": profile.id,
-                "message": "Cliente y perfil creados correctamente",
-            }
-        ), 201
+        summary = bulk_register(rows)
     except Exception as e:
-        db.rollback()
-        logging.exception("[CLIENT REGISTER] Error creando cliente/perfil: %s", e)
+        logging.exception("[CLIENT BULK] Error en registro masivo: %s", e)
         return jsonify({"error": str(e)}), 500
-    finally:
-        db.close()
+
+    if summary["error"]:
+        status = 400
+    elif summary["created"] and not summary["failed"]:
+        status = 201
+    else:
+        status = 200
+    return jsonify(summary), status
 
 
 if __name__ == "__main__":
-    # Cambia host y puerto si lo necesitas (por ejemplo, host="0.0.0.0")
-    app.run(debug=True)
+    # Servidor de desarrollo. En producción: gunicorn -c gunicorn.conf.py app:app
+    init_db()
+    debug = os.getenv("FLASK_DEBUG", "1") == "1"
+    # Con el recargador solo el proceso hijo (WERKZEUG_RUN_MAIN) atiende tráfico
+    if not debug or os.getenv("WERKZEUG_RUN_MAIN") == "true":
+        start_serving_process()
+    app.run(debug=debug)
@@ -0,0 +1,277 @@
+"""
+Dobles deterministas de Gemini, Graph API, Speech-to-Text y Cloud Storage.
+
+Cada servicio duerme una latencia muestreada de una distribución
+configurable (``Latency``) con una semilla fija y devuelve una respuesta
+fija, así que dos corridas con la misma configuración hacen el mismo
+trabajo. Gemini se reemplaza en la clase ``ChatGoogleGenerativeAI`` para que
+la cadena de LangChain, la memoria y el prompt reales sigan en el camino.
+"""
+
+import asyncio
+import json
+import math
+import random
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from typing import Any
+from unittest import mock
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+# Latencias por defecto (segundos), del orden de las observadas en producción
+DEFAULT_LATENCIES = {
+    "gemini": "lognormal:0.9:0.35",
+    "gemini_image": "lognormal:2.0:0.3",
+    "speech": "lognormal:1.5:0.3",
+    "gcs": "lognormal:0.3:0.4",
+    "graph_download": "lognormal:0.25:0.4",
+    "graph_send": "lognormal:0.2:0.3",
+}
+
+CHAT_REPLY = (
+    "¡Qué bien que me cuentas! Para tu almuerzo prueba media porción de arroz "
+    "integral con verduras. ¿Cómo te sentiste de energía esta mañana?"
+)
+SUMMARY_REPLY = "El usuario conversa sobre sus comidas del día y su energía."
+PERSONALITY_REPLY = json.dumps(
+    {
+        "food_preferences": {
+            "likes": ["arepa", "fruta"],
+            "dislikes": ["hígado"],
+            "emotional_eating_triggers": ["estrés"],
+        },
+        "activity": {"level": "moderado", "hobbies": ["caminar"]},
+        "content": {"platforms": ["YouTube"], "tone": "cercano"},
+        "mood_baseline": "tranquilo",
+    },
+    ensure_ascii=False,
+)
+DETECTION_REPLY = json.dumps(
+    {"alimentos": [{"nombre": "arepa", "porcion": "1 unidad", "calorias": 180}]},
+    ensure_ascii=False,
+)
+TRANSCRIPT = "Hoy desayuné huevos con arepa y un café con leche, ¿está bien?"
+
+
+@dataclass(frozen=True)
+class Latency:
+    """
+    Distribución de latencia en segundos.
+
+    ``"const:0.2"``, ``"uniform:0.1:0.5"``, ``"normal:media:desvío"`` o
+    ``"lognormal:mediana:sigma"`` (cola larga, como una API remota).
+    """
+
+    kind: str = "const"
+    a: float = 0.0
+    b: float = 0.0
+
+    @classmethod
+    def parse(cls, spec: str) -> "Latency":
+        kind, *params = spec.split(":")
+        if kind not in ("const", "uniform", "normal", "lognormal"):
+            raise ValueError(f"Distribución de latencia desconocida: {spec}")
+        values = [float(p) for p in params] + [0.0, 0.0]
+        return cls(kind, values[0], values[1])
+
+    def scaled(self, factor: float) -> "Latency":
+        # sigma de la lognormal es adimensional
+        b = self.b if self.kind == "lognormal" else self.b * factor
+        return Latency(self.kind, self.a * factor, b)
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "uniform":
+            value = rng.uniform(self.a, self.b)
+        elif self.kind == "normal":
+            value = rng.gauss(self.a, self.b)
+        elif self.kind == "lognormal":
+            value = self.a * math.exp(rng.gauss(0, self.b)) if self.a else 0.0
+        else:
+            value = self.a
+        return max(value, 0.0)
+
+
+@dataclass
+class FakeService:
+    """Un servicio remoto falso: latencia con semilla propia y contador de llamadas."""
+
+    name: str
+    latency: Latency
+    seed: int = 0
+    calls: int = 0
+    _rng: random.Random = field(init=False, repr=False)
+    _lock: threading.Lock = field(
+        init=False, repr=False, default_factory=threading.Lock
+    )
+
+    def __post_init__(self) -> None:
+        """Deriva la semilla del servicio de la semilla global y su nombre."""
+        self._rng = random.Random(self.seed ^ zlib.crc32(self.name.encode()))
+
+    def _delay(self) -> float:
+        with self._lock:
+            self.calls += 1
+            return self.latency.sample(self._rng)
+
+    def wait(self) -> None:
+        time.sleep(self._delay())
+
+    async def wait_async(self) -> None:
+        await asyncio.sleep(self._delay())
+
+
+class FakeGemini(BaseChatModel):
+    """Chat model de LangChain que responde según el tipo de petición."""
+
+    model: str = "fake-gemini"
+    chat: Any = None
+    image: Any = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-gemini"
+
+    def _route(self, messages):
+        content = messages[-1].content
+        if isinstance(content, list):
+            return self.image, DETECTION_REPLY
+        if "responde SOLO el JSON" in content:
+            return self.chat, PERSONALITY_REPLY
+        if "summary" in content.lower():
+            return self.chat, SUMMARY_REPLY
+        return self.chat, CHAT_REPLY
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        service, text = self._route(messages)
+        service.wait()
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        service, text = self._route(messages)
+        await service.wait_async()
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def get_num_tokens(self, text: str) -> int:
+        return len(text) // 4
+
+
+class FakeBackends:
+    """
+    Instala los dobles sobre los módulos de la app mientras dura el bloque ``with``.
+
+    ``on_send`` recibe ``(phone, texto)`` por cada respuesta enviada: es la
+    señal con que el generador de carga mide la latencia de punta a punta.
+    """
+
+    def __init__(
+        self,
+        latencies: dict[str, str] | None = None,
+        seed: int = 0,
+        scale: float = 1.0,
+        media_bytes: int = 200 * 1024,
+        on_send=None,
+    ) -> None:
+        """Configura latencias (``DEFAULT_LATENCIES`` más ``latencies``) y tamaños."""
+        specs = {**DEFAULT_LATENCIES, **(latencies or {})}
+        self.services = {
+            name: FakeService(name, Latency.parse(spec).scaled(scale), seed)
+            for name, spec in specs.items()
+        }
+        self.media_bytes = media_bytes
+        self.on_send = on_send or (lambda phone, text: None)
+        self._stack = ExitStack()
+
+    def _gemini_factory(self, **kwargs):
+        return FakeGemini(
+            model=kwargs.get("model", "fake-gemini"),
+            chat=self.services["gemini"],
+            image=self.services["gemini_image"],
+        )
+
+    def _media(self, media_id: str):
+        fileobj = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+        fileobj.write(random.Random(media_id).randbytes(self.media_bytes))
+        fileobj.seek(0)
+        return fileobj, self.media_bytes
+
+    def download(self, media_id: str):
+        self.services["graph_download"].wait()
+        return self._media(media_id)
+
+    async def download_async(self, media_id: str):
+        await self.services["graph_download"].wait_async()
+        return self._media(media_id)
+
+    def upload(self, fileobj, fname, size=None, content_type=None):
+        # Se lee por bloques como la subida reanudable real
+        while fileobj.read(256 * 1024):
+            pass
+        self.services["gcs"].wait()
+        return f"https://storage.googleapis.com/bench/{fname}"
+
+    async def upload_async(self, fileobj, fname, size=None, content_type=None):
+        while fileobj.read(256 * 1024):
+            pass
+        await self.services["gcs"].wait_async()
+        return f"https://storage.googleapis.com/bench/{fname}"
+
+    def transcribe(self, audio_bytes, mime_type="audio/ogg"):
+        self.services["speech"].wait()
+        return TRANSCRIPT
+
+    async def transcribe_async(self, audio_bytes, mime_type="audio/ogg"):
+        await self.services["speech"].wait_async()
+        return TRANSCRIPT
+
+    def send(self, phone: str, text: str) -> dict:
+        self.services["graph_send"].wait()
+        self.on_send(phone, text)
+        return {"messages": [{"id": f"wamid.bench.{phone}"}]}
+
+    async def send_async(self, phone: str, text: str) -> dict:
+        await self.services["graph_send"].wait_async()
+        self.on_send(phone, text)
+        return {"messages": [{"id": f"wamid.bench.{phone}"}]}
+
+    def __enter__(self) -> "FakeBackends":
+        """Reemplaza Gemini, Graph API, Speech-to-Text y GCS en los módulos."""
+        import services.whatsapp_pipeline as pipeline_mod
+        import utils.ai.detector_image as image_mod
+        import utils.langchain as lc_mod
+        from utils.llm import clear_chat_models
+
+        patches = [
+            (lc_mod, "ChatGoogleGenerativeAI", self._gemini_factory),
+            (image_mod, "ChatGoogleGenerativeAI", self._gemini_factory),
+            (pipeline_mod, "download_whatsapp_media_stream", self.download),
+            (pipeline_mod, "download_whatsapp_media_stream_async", self.download_async),
+            (pipeline_mod, "upload_file_to_gcp", self.upload),
+            (pipeline_mod, "upload_file_to_gcp_async", self.upload_async),
+            (pipeline_mod, "transcribir_audio", self.transcribe),
+            (pipeline_mod, "transcribir_audio_async", self.transcribe_async),
+            (pipeline_mod, "send_whatsapp_message", self.send),
+            (pipeline_mod, "send_whatsapp_message_async", self.send_async),
+        ]
+        lc_mod._load()
+        image_mod._load()
+        for module, name, fake in patches:
+            self._stack.enter_context(mock.patch.object(module, name, fake))
+        self._stack.enter_context(
+            mock.patch.dict("os.environ", {"GEMINI_API_KEY": "bench"})
+        )
+        # Sesiones y clientes creados con los dobles no sobreviven al bloque
+        for reset in (clear_chat_models, lc_mod.USER_SESSIONS.clear):
+            reset()
+            self._stack.callback(reset)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        """Restaura los módulos originales."""
+        self._stack.close()
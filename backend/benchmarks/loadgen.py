@@ -0,0 +1,391 @@
+"""
+Generador de carga del camino completo de ``/api/whatsapp/webhook``.
+
+Simula N usuarios concurrentes que envían texto, imágenes y audios al
+webhook real (cliente de pruebas de Flask), los workers de la cola procesan
+cada mensaje con el pipeline real y los dobles de ``benchmarks.fakes``
+reemplazan Gemini, Graph API, Speech-to-Text y GCS. Cada usuario espera la
+respuesta antes de mandar el siguiente mensaje.
+
+Uso::
+
+    python -m benchmarks.loadgen --users 20 --messages 5 --json base.json
+    python -m benchmarks.loadgen --users 20 --messages 5 --compare base.json
+
+Reporta p50/p95/p99 de la latencia de punta a punta (POST -> envío de la
+respuesta) y del propio webhook, throughput y RSS del proceso.
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import ExitStack
+from unittest import mock
+
+from benchmarks.fakes import DEFAULT_LATENCIES, FakeBackends
+
+TEXT_MESSAGES = (
+    "¿Qué puedo desayunar si tengo diabetes?",
+    "Hoy almorcé arroz con pollo y ensalada",
+    "Me siento con poca energía en las tardes",
+    "¿Es bueno comer fruta en la noche?",
+    "Anoche cené pan con queso y chocolate",
+    "gracias",
+)
+DEFAULT_MIX = "text=6,image=2,audio=2"
+
+
+def parse_mix(spec: str) -> dict[str, float]:
+    mix = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        kind, _, weight = item.partition("=")
+        if kind not in ("text", "image", "audio"):
+            raise ValueError(f"Tipo de mensaje desconocido: {kind}")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def webhook_payload(phone: str, kind: str, rng: random.Random) -> dict:
+    msg = {
+        "from": phone,
+        "id": f"wamid.{uuid.UUID(int=rng.getrandbits(128))}",
+        "timestamp": str(int(time.time())),
+        "type": kind,
+    }
+    if kind == "text":
+        msg["text"] = {"body": rng.choice(TEXT_MESSAGES)}
+    else:
+        msg[kind] = {"id": f"media-{rng.getrandbits(48)}"}
+    return {"entry": [{"changes": [{"value": {"messages": [msg]}}]}]}
+
+
+def percentiles(values: list[float]) -> dict[str, float]:
+    """p50/p95/p99 (rango más cercano), media y máximo en milisegundos."""
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def rank(q: float) -> float:
+        return ordered[max(0, min(len(ordered) - 1, round(q * len(ordered)) - 1))]
+
+    return {
+        "p50": round(rank(0.50) * 1000, 1),
+        "p95": round(rank(0.95) * 1000, 1),
+        "p99": round(rank(0.99) * 1000, 1),
+        "mean": round(sum(ordered) / len(ordered) * 1000, 1),
+        "max": round(ordered[-1] * 1000, 1),
+    }
+
+
+def current_rss_mb() -> float | None:
+    try:
+        with open("/proc/self/statm") as statm:
+            pages = int(statm.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return round(pages * os.sysconf("SC_PAGE_SIZE") / 2**20, 1)
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reporta KiB; macOS, bytes
+    return round(peak / (2**20 if sys.platform == "darwin" else 2**10), 1)
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _use_database(url: str | None, stack: ExitStack) -> None:
+    """Enlaza ``SessionLocal`` a una base de datos migrada para la corrida."""
+    from sqlalchemy import create_engine
+
+    from db.db import SessionLocal
+    from db.migrations import migrate
+    from utils.profile_cache import PROFILE_CACHE
+
+    if url is None:
+        tmpdir = stack.enter_context(tempfile.TemporaryDirectory())
+        url = f"sqlite:///{tmpdir}/bench.db"
+    connect_args = {"check_same_thread": False, "timeout": 30}
+    engine = create_engine(
+        url, connect_args=connect_args if url.startswith("sqlite") else {}
+    )
+    migrate(engine)
+
+    previous = SessionLocal.session_factory.kw.get("bind")
+    SessionLocal.remove()
+    SessionLocal.configure(bind=engine)
+    # Los perfiles en caché son de la base anterior
+    PROFILE_CACHE.clear()
+
+    def restore():
+        SessionLocal.remove()
+        SessionLocal.configure(bind=previous)
+        PROFILE_CACHE.clear()
+        engine.dispose()
+
+    stack.callback(restore)
+
+
+class _Replies:
+    """Última respuesta enviada a cada teléfono (la escribe el doble de envío)."""
+
+    def __init__(self) -> None:
+        """Sin respuestas todavía."""
+        self._cond = threading.Condition()
+        self._sent: dict[str, int] = {}
+
+    def record(self, phone: str, text: str) -> None:
+        with self._cond:
+            self._sent[phone] = self._sent.get(phone, 0) + 1
+            self._cond.notify_all()
+
+    def wait(self, phone: str, count: int, timeout: float) -> bool:
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: self._sent.get(phone, 0) >= count, timeout
+            )
+
+
+def run_load(
+    users: int = 10,
+    messages: int = 5,
+    mix: dict[str, float] | None = None,
+    latencies: dict[str, str] | None = None,
+    scale: float = 1.0,
+    workers: int = 4,
+    use_async: bool = False,
+    think: float = 0.0,
+    timeout: float = 60.0,
+    poll_interval: float | None = None,
+    media_bytes: int = 200 * 1024,
+    database_url: str | None = None,
+    seed: int = 0,
+) -> dict:
+    """
+    Ejecuta una corrida de carga y devuelve el reporte como dict.
+
+    ``latencies`` sobrescribe entradas de ``DEFAULT_LATENCIES`` y ``scale``
+    las multiplica todas (``0.1`` para una corrida rápida). Con
+    ``database_url=None`` se usa una base SQLite temporal.
+    """
+    import app as app_mod
+    import services.whatsapp_pipeline as pipeline_mod
+    from db.session import UNIT_CHECKOUTS
+    from services.whatsapp_pipeline import build_worker_pool
+    from utils.jobs import SQLJobStore
+
+    mix = mix or parse_mix(DEFAULT_MIX)
+    replies = _Replies()
+    latencies_by_type: dict[str, list[float]] = {kind: [] for kind in mix}
+    webhook_latencies: list[float] = []
+    errors: list[str] = []
+    lock = threading.Lock()
+
+    def user(index: int) -> None:
+        rng = random.Random(seed * 1_000_003 + index)
+        phone = f"57300{index:07d}"
+        client = app_mod.app.test_client()
+        kinds, weights = zip(*mix.items(), strict=True)
+        for sent in range(1, messages + 1):
+            kind = rng.choices(kinds, weights)[0]
+            started = time.perf_counter()
+            response = client.post(
+                "/api/whatsapp/webhook", json=webhook_payload(phone, kind, rng)
+            )
+            posted = time.perf_counter()
+            if response.status_code != 200:
+                with lock:
+                    errors.append(f"webhook {response.status_code}")
+                continue
+            if not replies.wait(phone, sent, timeout):
+                with lock:
+                    errors.append(f"timeout {kind}")
+                return
+            with lock:
+                webhook_latencies.append(posted - started)
+                latencies_by_type[kind].append(time.perf_counter() - started)
+            if think:
+                time.sleep(think)
+
+    rss_start = current_rss_mb()
+    units_before = (
+        UNIT_CHECKOUTS.count(unit="whatsapp_pipeline"),
+        UNIT_CHECKOUTS.sum(unit="whatsapp_pipeline"),
+    )
+    with ExitStack() as stack:
+        _use_database(database_url, stack)
+        stack.enter_context(
+            FakeBackends(latencies, seed, scale, media_bytes, on_send=replies.record)
+        )
+        # Sin ventana de debounce: cada usuario espera su respuesta
+        stack.enter_context(
+            mock.patch.object(pipeline_mod, "WHATSAPP_DEBOUNCE_SECONDS", 0.0)
+        )
+        pool = build_worker_pool(SQLJobStore(), workers, use_async=use_async)
+        if poll_interval is not None:
+            pool.poll_interval = poll_interval
+        pool.start()
+        stack.callback(pool.stop, 10)
+
+        started = time.perf_counter()
+        threads = [
+            threading.Thread(target=user, args=(i,), name=f"bench-user-{i}")
+            for i in range(users)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+    completed = [v for values in latencies_by_type.values() for v in values]
+    # Conexiones del pool por lote del pipeline (síncrono o asíncrono)
+    units = UNIT_CHECKOUTS.count(unit="whatsapp_pipeline") - units_before[0]
+    unit_checkouts = UNIT_CHECKOUTS.sum(unit="whatsapp_pipeline") - units_before[1]
+    return {
+        "commit": git_commit(),
+        "config": {
+            "users": users,
+            "messages": messages,
+            "mix": mix,
+            "latencies": {**DEFAULT_LATENCIES, **(latencies or {})},
+            "scale": scale,
+            "workers": workers,
+            "async": use_async,
+            "think": think,
+            "media_bytes": media_bytes,
+            "seed": seed,
+        },
+        "completed": len(completed),
+        "errors": len(errors),
+        "error_samples": errors[:10],
+        "duration_s": round(elapsed, 3),
+        "throughput_msg_s": round(len(completed) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "all": percentiles(completed),
+            **{kind: percentiles(v) for kind, v in latencies_by_type.items() if v},
+        },
+        "webhook_ms": percentiles(webhook_latencies),
+        "db_checkouts_per_batch": round(unit_checkouts / units, 2) if units else None,
+        "rss_mb": {
+            "start": rss_start,
+            "end": current_rss_mb(),
+            "peak": peak_rss_mb(),
+        },
+    }
+
+
+def format_report(report: dict, baseline: dict | None = None) -> str:
+    """Tabla legible del reporte; con ``baseline`` agrega la variación en %."""
+
+    def delta(path: tuple) -> str:
+        if baseline is None:
+            return ""
+        old, new = baseline, report
+        for key in path:
+            old, new = (old or {}).get(key), (new or {}).get(key)
+        if not old or new is None:
+            return ""
+        return f"  ({(new - old) / old * 100:+.1f}%)"
+
+    lines = [
+        f"commit {report['commit'] or '?'}: {report['completed']} mensajes, "
+        f"{report['errors']} errores en {report['duration_s']} s",
+        f"throughput      {report['throughput_msg_s']} msg/s"
+        + delta(("throughput_msg_s",)),
+    ]
+    for kind, stats in [*report["latency_ms"].items(), ("webhook", None)]:
+        if kind == "webhook":
+            stats, path = report["webhook_ms"], ("webhook_ms",)
+        else:
+            path = ("latency_ms", kind)
+        for q in ("p50", "p95", "p99"):
+            if q in stats:
+                lines.append(f"{kind:<8}{q:<8}{stats[q]:>10.1f} ms" + delta((*path, q)))
+    if report.get("db_checkouts_per_batch") is not None:
+        lines.append(
+            f"db checkouts    {report['db_checkouts_per_batch']} por lote"
+            + delta(("db_checkouts_per_batch",))
+        )
+    rss = report["rss_mb"]
+    lines.append(f"rss peak        {rss['peak']} MB" + delta(("rss_mb", "peak")))
+    return "\n".join(lines)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=5, help="mensajes por usuario")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="p. ej. text=6,image=2")
+    parser.add_argument(
+        "--latency",
+        action="append",
+        default=[],
+        metavar="SERVICIO=DIST",
+        help="p. ej. gemini=lognormal:0.9:0.35 (servicios: "
+        + ", ".join(DEFAULT_LATENCIES)
+        + ")",
+    )
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--async", dest="use_async", action="store_true")
+    parser.add_argument("--think", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--poll-interval", type=float, default=None)
+    parser.add_argument("--media-bytes", type=int, default=200 * 1024)
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="guarda el reporte en este archivo")
+    parser.add_argument("--compare", help="reporte JSON de referencia")
+    args = parser.parse_args(argv)
+
+    latencies = dict(item.split("=", 1) for item in args.latency)
+    report = run_load(
+        users=args.users,
+        messages=args.messages,
+        mix=parse_mix(args.mix),
+        latencies=latencies,
+        scale=args.scale,
+        workers=args.workers,
+        use_async=args.use_async,
+        think=args.think,
+        timeout=args.timeout,
+        poll_interval=args.poll_interval,
+        media_bytes=args.media_bytes,
+        database_url=args.database_url,
+        seed=args.seed,
+    )
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print(format_report(report, baseline))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    # Antes de importar la app: BD de la corrida
+    os.environ.setdefault("DATABASE_URL", "sqlite://")
+    sys.exit(main())
@@ -2,7 +2,18 @@ import os
 from datetime import datetime
 
 from dotenv import load_dotenv
-from sqlalchemy import Boolean, DateTime, ForeignKey, Integer, String, create_engine
+from sqlalchemy import (
+    JSON,
+    Boolean,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    Text,
+    create_engine,
+)
 from sqlalchemy.dialects.postgresql import ARRAY, JSONB
 from sqlalchemy.orm import (
     Mapped,
@@ -69,8 +80,12 @@ class UserProfile(Base):
     height_cm: Mapped[int | None] = mapped_column(Integer, nullable=True)
     weight_kg: Mapped[float | None] = mapped_column(Integer, nullable=True)
 
-    diseases: Mapped[list[str] | None] = mapped_column(ARRAY(String), nullable=True)
-    allergies: Mapped[list[str] | None] = mapped_column(ARRAY(String), nullable=True)
+    diseases: Mapped[list[str] | None] = mapped_column(
+        ARRAY(String).with_variant(JSON(), "sqlite"), nullable=True
+    )
+    allergies: Mapped[list[str] | None] = mapped_column(
+        ARRAY(String).with_variant(JSON(), "sqlite"), nullable=True
+    )
 
     accepted_terms: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
     created_at: Mapped[datetime] = mapped_column(
@@ -83,18 +98,29 @@ class UserProfile(Base):
     )
 
     # Resumen estructurado de personalidad/hábitos generado por IA (JSON)
-    personality_profile: Mapped[dict | None] = mapped_column(JSONB, nullable=True)
+    personality_profile: Mapped[dict | None] = mapped_column(
+        JSONB().with_variant(JSON(), "sqlite"), nullable=True
+    )
 
     food_registers = relationship("FoodRegister", back_populates="user_profile")
 
     client: Mapped[Client] = relationship("Client", back_populates="profiles")
 
+    __table_args__ = (
+        # Búsqueda del perfil más reciente por número de WhatsApp
+        Index(
+            "ix_user_profiles_whatsapp_number_created_at",
+            "whatsapp_number",
+            "created_at",
+        ),
+    )
+
 
 class WhatsAppMessage(Base):
     __tablename__ = "whatsapp_messages"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
-    phone: Mapped[str] = mapped_column(String(32), index=True, nullable=False)
+    phone: Mapped[str] = mapped_column(String(32), nullable=False)
     message: Mapped[str] = mapped_column(String(4096), nullable=False)
     direction: Mapped[str] = mapped_column(String(8), nullable=False)  # 'in' o 'out'
     media_url: Mapped[str | None] = mapped_column(String(2048), nullable=True)
@@ -102,6 +128,11 @@ class WhatsAppMessage(Base):
     media_type: Mapped[str | None] = mapped_column(
         String(16), nullable=True
     )  # 'image', 'audio', etc.
+    # Id del mensaje en WhatsApp (messages[].id); único para no duplicar filas
+    # cuando Meta reenvía el webhook.
+    wa_message_id: Mapped[str | None] = mapped_column(
+        String(128), nullable=True, unique=True
+    )
     created_at: Mapped[datetime] = mapped_column(
         DateTime, default=datetime.utcnow, nullable=False
     )
@@ -115,9 +146,18 @@ class WhatsAppMessage(Base):
             "media_url": self.media_url,
             "media_id": self.media_id,
             "media_type": self.media_type,
+            "wa_message_id": self.wa_message_id,
             "created_at": self.created_at.isoformat() if self.created_at else None,
         }
 
+    __table_args__ = (
+        # Historial por teléfono en orden cronológico (contexto del LLM) y
+        # paginación por cursor sobre id. Ambos cubren los filtros por phone,
+        # así que reemplazan al antiguo índice simple ix_whatsapp_messages_phone.
+        Index("ix_whatsapp_messages_phone_created_at", "phone", "created_at"),
+        Index("ix_whatsapp_messages_phone_id", "phone", "id"),
+    )
+
 
 class FoodRegister(Base):
     __tablename__ = "food_register"
@@ -139,6 +179,24 @@ class FoodRegister(Base):
 
     user_profile = relationship("UserProfile", back_populates="food_registers")
 
+    __table_args__ = (
+        # Consumo de un usuario en un rango de fechas. En PostgreSQL incluye
+        # los nutrientes para que la suma diaria sea un index-only scan.
+        Index(
+            "ix_food_register_user_profile_id_timestamp",
+            "user_profile_id",
+            "timestamp",
+            postgresql_include=[
+                "calorias",
+                "carbohidratos",
+                "proteinas",
+                "grasas",
+                "azucares",
+                "sal",
+            ],
+        ),
+    )
+
     def to_dict(self):
         return {
             "id_registro": self.id_registro,
@@ -154,5 +212,140 @@ class FoodRegister(Base):
         }
 
 
+class WebhookJob(Base):
+    """
+    Trabajo pendiente de la cola durable del webhook de WhatsApp.
+
+    El webhook solo persiste el mensaje recibido aquí y responde 200; los
+    workers (ver ``utils.jobs``) reclaman cada fila y ejecutan el pipeline
+    completo (media, LLM, envío y guardado) con reintentos y dead-letter.
+    """
+
+    __tablename__ = "webhook_jobs"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    kind: Mapped[str] = mapped_column(String(64), nullable=False)
+    # Clave de orden (el teléfono): los trabajos de una misma partición se
+    # procesan estrictamente en orden; particiones distintas, en paralelo.
+    partition_key: Mapped[str | None] = mapped_column(
+        String(64), nullable=True, index=True
+    )
+    # Clave de idempotencia (el id del mensaje de WhatsApp): una re-entrega del
+    # mismo mensaje no genera un segundo trabajo.
+    dedup_key: Mapped[str | None] = mapped_column(
+        String(128), nullable=True, unique=True
+    )
+    payload: Mapped[dict] = mapped_column(
+        JSON().with_variant(JSONB, "postgresql"), nullable=False
+    )
+    # 'pending' | 'running' | 'done' | 'dead'
+    status: Mapped[str] = mapped_column(String(16), default="pending", nullable=False)
+    attempts: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    max_attempts: Mapped[int] = mapped_column(Integer, default=5, nullable=False)
+    last_error: Mapped[str | None] = mapped_column(String(2048), nullable=True)
+    available_at: Mapped[datetime] = mapped_column(
+        DateTime, default=datetime.utcnow, nullable=False
+    )
+    locked_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime, default=datetime.utcnow, nullable=False
+    )
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False
+    )
+
+    __table_args__ = (
+        Index("ix_webhook_jobs_status_available_at", "status", "available_at"),
+    )
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "partition_key": self.partition_key,
+            "payload": self.payload,
+            "status": self.status,
+            "attempts": self.attempts,
+            "max_attempts": self.max_attempts,
+            "last_error": self.last_error,
+            "available_at": self.available_at.isoformat()
+            if self.available_at
+            else None,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+        }
+
+
+class ConversationState(Base):
+    """
+    Estado de la conversación de un teléfono: resumen acumulado y últimos turnos.
+
+    Es la memoria de LangChain fuera del proceso: cualquier worker (o uno
+    recién desplegado) rehidrata la sesión con una lectura por clave
+    primaria, sin recorrer ``whatsapp_messages``. ``version`` aumenta en cada
+    guardado y permite detectar una sesión local desactualizada.
+    """
+
+    __tablename__ = "conversation_states"
+
+    phone: Mapped[str] = mapped_column(String(32), primary_key=True)
+    summary: Mapped[str] = mapped_column(Text, default="", nullable=False)
+    # [[direction, texto], ...] en orden cronológico ("in" = usuario)
+    turns: Mapped[list] = mapped_column(
+        JSON().with_variant(JSONB, "postgresql"), default=list, nullable=False
+    )
+    version: Mapped[int] = mapped_column(Integer, default=1, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime, default=datetime.utcnow, nullable=False
+    )
+
+
+class ConversationStats(Base):
+    """
+    Contadores de mensajes de un teléfono, mantenidos al escribir.
+
+    Se actualizan en la misma transacción que inserta en ``whatsapp_messages``
+    (ver ``utils.conversation_stats``), así que saber cuántos mensajes lleva
+    un usuario es una lectura por clave primaria en vez de un ``COUNT(*)``
+    sobre todo su historial.
+    """
+
+    __tablename__ = "conversation_stats"
+
+    phone: Mapped[str] = mapped_column(String(32), primary_key=True)
+    messages_in: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    messages_out: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    last_message_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    last_message_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+    @property
+    def total_messages(self) -> int:
+        return self.messages_in + self.messages_out
+
+
+class LLMRateBucket(Base):
+    """
+    Token bucket de un modelo de Gemini compartido por todos los workers.
+
+    ``tokens`` se recarga según el tiempo transcurrido desde ``updated_at``
+    (segundos epoch) en el mismo ``UPDATE`` que lo descuenta; ver
+    ``utils.ratelimit.SQLTokenBucket``.
+    """
+
+    __tablename__ = "llm_rate_buckets"
+
+    model: Mapped[str] = mapped_column(String(128), primary_key=True)
+    tokens: Mapped[float] = mapped_column(Float, nullable=False)
+    updated_at: Mapped[float] = mapped_column(Float, nullable=False)
+
+
 def init_db():
-    Base.metadata.create_all(bind=engine)
+    """
+    Lleva el esquema a la última versión aplicando las migraciones pendientes.
+
+    No se ejecuta al importar la app: es un paso explícito del despliegue
+    (``flask --app app init-db`` o ``python -m db.migrations``). Ver
+    ``db.migrations``.
+    """
+    from db.migrations import migrate
+
+    migrate(engine)
@@ -0,0 +1,296 @@
+import logging
+from collections.abc import Callable
+from dataclasses import dataclass
+from datetime import datetime
+
+from sqlalchemy import (
+    JSON,
+    Boolean,
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    inspect,
+    select,
+    text,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
+
+from db.db import (
+    ConversationState,
+    ConversationStats,
+    FoodRegister,
+    LLMRateBucket,
+    UserProfile,
+    WhatsAppMessage,
+    engine,
+)
+
+logging.basicConfig(level=logging.INFO)
+
+# Versiones aplicadas en esta base de datos
+schema_migrations = Table(
+    "schema_migrations",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String(128), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+# Clave del advisory lock de PostgreSQL: varios procesos (API, workers)
+# pueden arrancar a la vez y solo uno debe migrar.
+_PG_LOCK_KEY = 727_001
+
+
+@dataclass(frozen=True)
+class Migration:
+    """Paso versionado del esquema; ``upgrade`` recibe una conexión en transacción."""
+
+    version: int
+    name: str
+    upgrade: Callable
+
+
+MIGRATIONS: list[Migration] = []
+
+
+def migration(version: int, name: str):
+    """Registra ``fn(conn)`` como la migración ``version``."""
+
+    def register(fn):
+        MIGRATIONS.append(Migration(version, name, fn))
+        MIGRATIONS.sort(key=lambda m: m.version)
+        return fn
+
+    return register
+
+
+# --- Migraciones ---------------------------------------------------------
+#
+# Deben ser idempotentes: una base creada con ``create_all`` antes de que
+# existieran las migraciones puede tener ya parte de cada cambio.
+
+# Esquema de la versión 1, congelado: las tablas tal como las creaba
+# ``create_all`` antes de versionar el esquema. No debe seguir a los modelos;
+# un cambio en ``db.db`` va en una migración nueva.
+_baseline_schema = MetaData()
+
+Table(
+    "clients",
+    _baseline_schema,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("registered_at", DateTime, nullable=False),
+    Column("external_id", String(255), nullable=True, index=True),
+    Column("provider", String(50), nullable=True),
+)
+
+Table(
+    "user_profiles",
+    _baseline_schema,
+    Column("id", Integer, primary_key=True, index=True),
+    Column(
+        "client_id",
+        Integer,
+        ForeignKey("clients.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    ),
+    Column("profile_photo_url", String(512), nullable=True),
+    Column("full_name", String(255), nullable=False),
+    Column("age", Integer, nullable=True),
+    Column("gender", String(32), nullable=True),
+    Column("whatsapp_number", String(32), nullable=False),
+    Column("rh", String(8), nullable=True),
+    Column("height_cm", Integer, nullable=True),
+    Column("weight_kg", Integer, nullable=True),
+    Column("diseases", ARRAY(String).with_variant(JSON(), "sqlite"), nullable=True),
+    Column("allergies", ARRAY(String).with_variant(JSON(), "sqlite"), nullable=True),
+    Column("accepted_terms", Boolean, nullable=False),
+    Column("created_at", DateTime, nullable=False),
+    Column("personality_stage", String(32), nullable=False),
+    Column(
+        "personality_profile", JSONB().with_variant(JSON(), "sqlite"), nullable=True
+    ),
+)
+
+Table(
+    "whatsapp_messages",
+    _baseline_schema,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("phone", String(32), nullable=False, index=True),
+    Column("message", String(4096), nullable=False),
+    Column("direction", String(8), nullable=False),
+    Column("media_url", String(2048), nullable=True),
+    Column("media_id", String(128), nullable=True),
+    Column("media_type", String(16), nullable=True),
+    Column("created_at", DateTime, nullable=False),
+)
+
+Table(
+    "food_register",
+    _baseline_schema,
+    Column("id_registro", Integer, primary_key=True, index=True),
+    Column(
+        "user_profile_id",
+        Integer,
+        ForeignKey("user_profiles.id", ondelete="CASCADE"),
+        nullable=False,
+    ),
+    Column("timestamp", DateTime, nullable=True),
+    Column("comidas", String(1024), nullable=False),
+    Column("calorias", Integer, nullable=True),
+    Column("carbohidratos", Integer, nullable=True),
+    Column("proteinas", Integer, nullable=True),
+    Column("grasas", Integer, nullable=True),
+    Column("azucares", Integer, nullable=True),
+    Column("sal", Integer, nullable=True),
+)
+
+Table(
+    "webhook_jobs",
+    _baseline_schema,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("kind", String(64), nullable=False),
+    Column("partition_key", String(64), nullable=True, index=True),
+    Column("dedup_key", String(128), nullable=True, unique=True),
+    Column("payload", JSON().with_variant(JSONB, "postgresql"), nullable=False),
+    Column("status", String(16), nullable=False),
+    Column("attempts", Integer, nullable=False),
+    Column("max_attempts", Integer, nullable=False),
+    Column("last_error", String(2048), nullable=True),
+    Column("available_at", DateTime, nullable=False),
+    Column("locked_at", DateTime, nullable=True),
+    Column("created_at", DateTime, nullable=False),
+    Column("updated_at", DateTime, nullable=False),
+    Index("ix_webhook_jobs_status_available_at", "status", "available_at"),
+)
+
+
+@migration(1, "baseline")
+def _baseline(conn):
+    """Tablas de la versión 1 (``_baseline_schema``) que todavía no existan."""
+    _baseline_schema.create_all(bind=conn, checkfirst=True)
+
+
+@migration(2, "add_missing_nullable_columns")
+def _add_missing_columns(conn):
+    """
+    whatsapp_messages.wa_message_id (id del mensaje en WhatsApp), único.
+
+    Llegó antes de versionar el esquema: una base creada por ``create_all``
+    antes de ese cambio no la tiene, y la 1 no toca tablas que ya existen.
+    """
+    columns = {c["name"] for c in inspect(conn).get_columns("whatsapp_messages")}
+    if "wa_message_id" not in columns:
+        conn.execute(
+            text("ALTER TABLE whatsapp_messages ADD COLUMN wa_message_id VARCHAR(128)")
+        )
+    conn.execute(
+        text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS ux_whatsapp_messages_wa_message_id "
+            "ON whatsapp_messages (wa_message_id)"
+        )
+    )
+
+
+@migration(3, "hot_query_indexes")
+def _hot_query_indexes(conn):
+    """
+    Índices compuestos para las consultas más frecuentes.
+
+    - whatsapp_messages (phone, created_at) y (phone, id): historial del LLM,
+      conteo de mensajes y paginación por cursor.
+    - user_profiles (whatsapp_number, created_at): perfil más reciente.
+    - food_register (user_profile_id, timestamp) INCLUDE nutrientes: consumo
+      diario como index-only scan en PostgreSQL.
+
+    El índice simple sobre phone queda cubierto por los compuestos y se borra.
+    """
+    for model in (WhatsAppMessage, UserProfile, FoodRegister):
+        for index in model.__table__.indexes:
+            index.create(bind=conn, checkfirst=True)
+    conn.execute(text("DROP INDEX IF EXISTS ix_whatsapp_messages_phone"))
+
+
+@migration(4, "conversation_states")
+def _conversation_states(conn):
+    """Memoria de conversación compartida entre workers (ver utils.conversation_state)."""
+    ConversationState.__table__.create(bind=conn, checkfirst=True)
+
+
+@migration(5, "llm_rate_buckets")
+def _llm_rate_buckets(conn):
+    """Cuotas de Gemini compartidas entre workers (ver utils.ratelimit)."""
+    LLMRateBucket.__table__.create(bind=conn, checkfirst=True)
+
+
+@migration(6, "conversation_stats")
+def _conversation_stats(conn):
+    """
+    Contadores por teléfono (ver utils.conversation_stats), calculados una
+    vez desde el historial existente; desde aquí se mantienen al escribir.
+    """
+    ConversationStats.__table__.create(bind=conn, checkfirst=True)
+    conn.execute(
+        text(
+            "INSERT INTO conversation_stats "
+            "(phone, messages_in, messages_out, last_message_id, last_message_at) "
+            "SELECT s.phone, s.messages_in, s.messages_out, s.last_id, l.created_at "
+            "FROM (SELECT phone, "
+            "SUM(CASE WHEN direction = 'in' THEN 1 ELSE 0 END) AS messages_in, "
+            "SUM(CASE WHEN direction = 'in' THEN 0 ELSE 1 END) AS messages_out, "
+            "MAX(id) AS last_id "
+            "FROM whatsapp_messages GROUP BY phone) s "
+            "JOIN whatsapp_messages l ON l.id = s.last_id "
+            "WHERE s.phone NOT IN (SELECT phone FROM conversation_stats)"
+        )
+    )
+
+
+# --- Ejecución -----------------------------------------------------------
+
+
+def applied_versions(conn) -> set[int]:
+    schema_migrations.create(bind=conn, checkfirst=True)
+    return set(conn.execute(select(schema_migrations.c.version)).scalars())
+
+
+def migrate(bind=engine, target: int | None = None) -> list[int]:
+    """
+    Aplica en orden las migraciones pendientes (hasta ``target``, si se indica).
+
+    Cada migración corre en su propia transacción junto con su registro en
+    ``schema_migrations``, así que un fallo deja la base en la última versión
+    completa. Devuelve las versiones aplicadas en esta llamada.
+    """
+    applied = []
+    for step in MIGRATIONS:
+        if target is not None and step.version > target:
+            break
+        with bind.begin() as conn:
+            if conn.dialect.name == "postgresql":
+                conn.execute(
+                    text("SELECT pg_advisory_xact_lock(:key)"), {"key": _PG_LOCK_KEY}
+                )
+            if step.version in applied_versions(conn):
+                continue
+            logging.info("[DB MIGRATIONS] Aplicando %s_%s", step.version, step.name)
+            step.upgrade(conn)
+            conn.execute(
+                schema_migrations.insert().values(
+                    version=step.version,
+                    name=step.name,
+                    applied_at=datetime.utcnow(),
+                )
+            )
+        applied.append(step.version)
+    return applied
+
+
+if __name__ == "__main__":
+    versions = migrate()
+    print(f"Migraciones aplicadas: {versions or 'ninguna (esquema al día)'}")
@@ -0,0 +1,198 @@
+"""
+Unidad de trabajo: una sesión y una transacción para todo un mensaje.
+
+``unit_of_work()`` abre una sesión y la publica en un ``ContextVar``; dentro
+del bloque, ``db_session()`` devuelve esa misma sesión en vez de abrir otra,
+así que los pasos del pipeline (deduplicación, perfil, conteo, memoria y
+guardado) comparten una conexión del pool y una transacción. Fuera de una
+unidad, ``db_session()`` abre una sesión propia, hace commit al salir y la
+cierra.
+
+Una unidad no debe envolver llamadas externas (Gemini, Graph API, GCS): su
+conexión y su transacción siguen abiertas mientras espera. El pipeline de
+WhatsApp usa una unidad corta antes de esas llamadas y otra después.
+
+Los checkouts del pool se cuentan en ``victoria_db_pool_checkouts_total`` y,
+por unidad o por ``count_checkouts(nombre)``, en el histograma
+``victoria_db_unit_checkouts``.
+"""
+
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, scoped_session
+from sqlalchemy.pool import Pool
+
+from db.db import SessionLocal
+from utils.metrics import REGISTRY
+
+DB_CHECKOUTS = REGISTRY.counter(
+    "victoria_db_pool_checkouts_total",
+    "Conexiones tomadas del pool de SQLAlchemy.",
+)
+UNIT_CHECKOUTS = REGISTRY.histogram(
+    "victoria_db_unit_checkouts",
+    "Checkouts del pool durante cada unidad de trabajo.",
+    ("unit",),
+    buckets=(0, 1, 2, 3, 4, 6, 8, 12, 16),
+)
+
+
+# Clave en ``Session.info`` de las funciones pendientes de ``after_commit``
+_AFTER_COMMIT = "victoria_after_commit"
+
+
+@dataclass
+class _Unit:
+    session: Session
+
+
+@dataclass
+class _CheckoutScope:
+    checkouts: int = 0
+
+
+_current_unit: ContextVar[_Unit | None] = ContextVar("db_unit_of_work", default=None)
+_checkout_scopes: ContextVar[tuple[_CheckoutScope, ...]] = ContextVar(
+    "db_checkout_scopes", default=()
+)
+
+
+@event.listens_for(Pool, "checkout")
+def _count_checkout(dbapi_connection, connection_record, connection_proxy) -> None:
+    DB_CHECKOUTS.inc()
+    for scope in _checkout_scopes.get():
+        scope.checkouts += 1
+
+
+@contextmanager
+def count_checkouts(name: str):
+    """
+    Cuenta los checkouts del pool hechos dentro del bloque (también en hilos
+    lanzados con el contexto copiado) y los observa en
+    ``victoria_db_unit_checkouts{unit=name}`` al salir.
+    """
+    scope = _CheckoutScope()
+    token = _checkout_scopes.set(_checkout_scopes.get() + (scope,))
+    try:
+        yield scope
+    finally:
+        _checkout_scopes.reset(token)
+        UNIT_CHECKOUTS.observe(scope.checkouts, unit=name)
+
+
+def _new_session(session_factory=None) -> Session:
+    factory = session_factory or SessionLocal
+    # Siempre una sesión nueva, no la del hilo: en el event loop conviven
+    # varios mensajes en el mismo hilo.
+    if isinstance(factory, scoped_session):
+        factory = factory.session_factory
+    return factory()
+
+
+def after_commit(db: Session, callback) -> None:
+    """
+    Llama a ``callback()`` cuando se confirme la transacción de ``db``.
+
+    Dentro de una unidad es al salir de ella, no al terminar el paso, así
+    que p. ej. una invalidación de caché no deja que otro hilo vuelva a
+    leer la fila vieja antes del commit. Si la transacción (o el SAVEPOINT
+    del paso que lo registró) se deshace, no se llama.
+    """
+    db.info.setdefault(_AFTER_COMMIT, []).append(callback)
+
+
+def _commit(db: Session) -> None:
+    db.commit()
+    for callback in db.info.pop(_AFTER_COMMIT, ()):
+        try:
+            callback()
+        except Exception:
+            logging.exception("[DB] Error en after_commit %r", callback)
+
+
+def _rollback(db: Session) -> None:
+    db.info.pop(_AFTER_COMMIT, None)
+    db.rollback()
+
+
+@contextmanager
+def unit_of_work(name: str, session_factory=None):
+    """
+    Comparte una sesión con todo lo que corre dentro del bloque.
+
+    Al salir hace commit (rollback si hubo una excepción) y cierra la
+    sesión. Una unidad anidada se une a la exterior. ``name`` es la
+    etiqueta de ``victoria_db_unit_checkouts``.
+    """
+    current = _current_unit.get()
+    if current is not None:
+        yield current.session
+        return
+
+    with count_checkouts(name):
+        unit = _Unit(_new_session(session_factory))
+        token = _current_unit.set(unit)
+        try:
+            yield unit.session
+            _commit(unit.session)
+        except BaseException:
+            _rollback(unit.session)
+            raise
+        finally:
+            _current_unit.reset(token)
+            unit.session.close()
+
+
+def _begin_sqlite_transaction(db: Session) -> None:
+    # pysqlite solo abre la transacción antes de un INSERT/UPDATE/DELETE: un
+    # SAVEPOINT como primera sentencia hace de BEGIN y su RELEASE confirma,
+    # así que el rollback de la unidad ya no lo desharía.
+    conn = db.connection()
+    if conn.dialect.name != "sqlite":
+        return
+    if not conn.connection.driver_connection.in_transaction:
+        conn.exec_driver_sql("BEGIN")
+
+
+@contextmanager
+def db_session(session_factory=None):
+    """
+    Sesión para un paso de acceso a la BD.
+
+    Dentro de ``unit_of_work`` es la sesión compartida y el paso corre en un
+    SAVEPOINT: al salir se libera (el commit queda para la unidad) y, si el
+    paso lanza, solo se deshace lo del paso; lo que otros pasos ya
+    escribieron en la unidad se conserva y la excepción se propaga. Fuera de
+    una unidad abre una sesión con ``session_factory``, hace commit al salir
+    (rollback si falla) y la cierra.
+    """
+    unit = _current_unit.get()
+    if unit is None:
+        db = _new_session(session_factory)
+        try:
+            yield db
+            _commit(db)
+        except BaseException:
+            _rollback(db)
+            raise
+        finally:
+            db.close()
+        return
+
+    db = unit.session
+    _begin_sqlite_transaction(db)
+    pending = len(db.info.get(_AFTER_COMMIT, ()))
+    savepoint = db.begin_nested()
+    try:
+        yield db
+        if savepoint.is_active:
+            savepoint.commit()
+    except BaseException:
+        if savepoint.is_active:
+            savepoint.rollback()
+        del db.info.get(_AFTER_COMMIT, [])[pending:]
+        raise
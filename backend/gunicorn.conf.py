@@ -0,0 +1,64 @@
+"""
+Configuración de gunicorn para producción: ``gunicorn -c gunicorn.conf.py app:app``.
+
+La app se carga una vez en el proceso maestro (``preload_app``) y los workers
+se crean con ``fork``, compartiendo el código ya importado. Lo que no puede
+compartirse entre procesos (conexiones de BD, clientes gRPC/HTTP, hilos de la
+cola) se inicializa en cada worker en ``post_fork``.
+
+Cada worker tiene su propio registro de métricas; para que ``/metrics`` no
+dependa de qué worker atiende el scrape, todos vuelcan su estado en
+``METRICS_MULTIPROC_DIR`` y el que responde suma el de todos.
+"""
+
+import multiprocessing
+import os
+import tempfile
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count() * 2 + 1)))
+# Hilos por worker: las peticiones esperan sobre todo E/S (BD, GCP, Gemini)
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+# Reciclar workers de vez en cuando acota el crecimiento de memoria
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "0"))
+preload_app = True
+accesslog = "-"
+errorlog = "-"
+
+# Antes de precargar la app: utils.metrics lee la variable al importarse
+os.environ.setdefault(
+    "METRICS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "victoria-metrics")
+)
+
+
+def on_starting(server):
+    """Descarta las métricas volcadas por una ejecución anterior."""
+    from utils.metrics import reset_multiprocess_dir
+
+    reset_multiprocess_dir(os.environ["METRICS_MULTIPROC_DIR"])
+
+
+def post_fork(server, worker):
+    """Reinicia el pool de BD heredado y calienta el worker en segundo plano."""
+    import app as victoria
+    from services.warmup import after_fork
+
+    after_fork()
+    victoria.start_serving_process()
+
+
+def worker_exit(server, worker):
+    """
+    Detiene los workers de la cola de este proceso antes de salir y deja sus
+    contadores en el directorio de métricas (sin los gauges, que ya no aplican).
+    """
+    import app as victoria
+    from utils.metrics import write_snapshot
+
+    victoria.worker_pool.stop(timeout=graceful_timeout)
+    write_snapshot(os.environ["METRICS_MULTIPROC_DIR"], gauges=False)
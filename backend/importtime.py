@@ -0,0 +1,130 @@
+"""
+Mide el tiempo de importación de la app con ``python -X importtime``.
+
+Uso: ``python importtime.py [modulo] [--top N]``. Falla (código 1) si se
+importa alguna dependencia pesada que debería cargarse en el primer uso. El
+tiempo total solo se informa, salvo que ``IMPORT_TIME_BUDGET_MS`` fije un
+presupuesto: el reloj varía según la máquina y no sirve como puerta de CI.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from dataclasses import dataclass
+
+# Presupuesto opcional de importación de ``app`` en milisegundos (p. ej. 800)
+IMPORT_TIME_BUDGET_MS = (
+    float(os.environ["IMPORT_TIME_BUDGET_MS"])
+    if os.getenv("IMPORT_TIME_BUDGET_MS")
+    else None
+)
+
+# Paquetes que no deben cargarse al importar la app (ver utils.lazy)
+HEAVY_MODULES = (
+    "langchain",
+    "langchain_core",
+    "langchain_google_genai",
+    "google.cloud.storage",
+    "google.ai.generativelanguage",
+    "PIL",
+    "chromadb",
+    "numpy",
+)
+
+
+@dataclass(frozen=True)
+class ImportRecord:
+    """Una línea de ``-X importtime`` (tiempos en microsegundos)."""
+
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def parse_importtime(output: str) -> list[ImportRecord]:
+    records = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:") :].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # cabecera
+        name = fields[2].rstrip()
+        records.append(
+            ImportRecord(
+                module=name.strip(),
+                self_us=int(fields[0]),
+                cumulative_us=int(fields[1]),
+                depth=(len(name) - len(name.lstrip()) - 1) // 2,
+            )
+        )
+    return records
+
+
+def measure(target: str = "app") -> list[ImportRecord]:
+    """
+    Importa ``target`` en un intérprete nuevo y devuelve sus registros.
+
+    Es un ``import`` simple, como el de gunicorn o ``flask --app app``:
+    importar la app no arranca hilos ni calentamiento.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {target}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return parse_importtime(result.stderr)
+
+
+def heavy_imports(records: list[ImportRecord]) -> list[str]:
+    return sorted(
+        r.module
+        for r in records
+        if any(r.module == m or r.module.startswith(m + ".") for m in HEAVY_MODULES)
+    )
+
+
+def total_ms(records: list[ImportRecord], target: str = "app") -> float:
+    return sum(r.cumulative_us for r in records if r.module == target) / 1000
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("module", nargs="?", default="app")
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args(argv)
+
+    records = measure(args.module)
+    top_level = sorted(
+        (r for r in records if r.depth <= 1),
+        key=lambda r: r.cumulative_us,
+        reverse=True,
+    )
+    print(f"{'acumulado ms':>12}  módulo")
+    for r in top_level[: args.top]:
+        print(f"{r.cumulative_us / 1000:12.1f}  {r.module}")
+
+    elapsed = total_ms(records, args.module)
+    budget = (
+        f" (presupuesto {IMPORT_TIME_BUDGET_MS:.0f} ms)"
+        if IMPORT_TIME_BUDGET_MS is not None
+        else ""
+    )
+    print(f"\nTotal {args.module}: {elapsed:.1f} ms{budget}")
+
+    heavy = heavy_imports(records)
+    if heavy:
+        print("Dependencias pesadas importadas al arrancar:", ", ".join(heavy[:10]))
+        return 1
+    if IMPORT_TIME_BUDGET_MS is not None and elapsed > IMPORT_TIME_BUDGET_MS:
+        print("Se superó el presupuesto de importación")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
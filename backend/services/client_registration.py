@@ -0,0 +1,251 @@
+import csv
+import io
+import logging
+import os
+
+from sqlalchemy import insert
+from sqlalchemy.exc import SQLAlchemyError
+
+from db.db import Client, SessionLocal, UserProfile
+from utils.metrics import span
+from utils.profile_cache import PROFILE_CACHE
+
+logging.basicConfig(level=logging.INFO)
+
+# Filas por INSERT en el registro masivo y máximo de filas por petición
+BULK_REGISTER_BATCH_SIZE = int(os.getenv("BULK_REGISTER_BATCH_SIZE", "500"))
+BULK_REGISTER_MAX_ROWS = int(os.getenv("BULK_REGISTER_MAX_ROWS", "20000"))
+
+
+class RowError(ValueError):
+    """Fila del registro que no pasa la validación."""
+
+
+def _optional_int(profile_data: dict, key: str) -> int | None:
+    value = profile_data.get(key)
+    if value in (None, ""):
+        return None
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        raise RowError(f"'{key}' debe ser numérico") from None
+
+
+def _str_list(value) -> list[str]:
+    if not value:
+        return []
+    if isinstance(value, str):
+        return [v.strip() for v in value.split(";") if v.strip()]
+    return [str(v) for v in value]
+
+
+def _truthy(value) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "si", "sí", "yes", "x")
+    return bool(value)
+
+
+def profile_values(profile_data: dict) -> dict:
+    """
+    Valida el perfil de un cliente y devuelve las columnas de ``UserProfile``.
+
+    Es la misma validación para ``/api/client/register`` y para el registro
+    masivo: los números pueden llegar como texto (``"81"``), las listas como
+    texto separado por ';' y ``accepted_terms`` como ``"sí"``/``"false"``,
+    como en un CSV. Lanza ``RowError`` con el motivo si falta algo
+    obligatorio o un valor no tiene el tipo esperado.
+    """
+    full_name = (profile_data.get("full_name") or "").strip()
+    whatsapp_number = str(profile_data.get("whatsapp_number") or "").strip()
+
+    if not full_name or not whatsapp_number:
+        raise RowError("Faltan 'full_name' o 'whatsapp_number' en el perfil")
+
+    return {
+        "profile_photo_url": profile_data.get("profile_photo_url") or None,
+        "full_name": full_name,
+        "age": _optional_int(profile_data, "age"),
+        "gender": profile_data.get("gender") or None,
+        "whatsapp_number": whatsapp_number,
+        "rh": profile_data.get("rh") or None,
+        "height_cm": _optional_int(profile_data, "height_cm"),
+        "weight_kg": _optional_int(profile_data, "weight_kg"),
+        "diseases": _str_list(profile_data.get("diseases")),
+        "allergies": _str_list(profile_data.get("allergies")),
+        "accepted_terms": _truthy(profile_data.get("accepted_terms", False)),
+    }
+
+
+def iter_csv_rows(stream):
+    """
+    Lee un CSV (binario o texto) fila a fila con el formato de ``/register``.
+
+    Columnas: ``external_id``, ``provider`` y los campos del perfil
+    (``full_name``, ``whatsapp_number``, ``age``, ``gender``, ``rh``,
+    ``height_cm``, ``weight_kg``, ``diseases``, ``allergies``,
+    ``accepted_terms``, ``profile_photo_url``); las listas van separadas por
+    ';'. Cada fila produce ``{"external_id", "provider", "profile": {...}}``
+    sin cargar el archivo completo en memoria.
+    """
+    if not isinstance(stream, io.TextIOBase):
+        stream = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    for row in csv.DictReader(stream):
+        row = {(k or "").strip(): (v or "").strip() for k, v in row.items()}
+        yield {
+            "external_id": row.pop("external_id", "") or None,
+            "provider": row.pop("provider", "") or None,
+            "profile": row,
+        }
+
+
+def bulk_register(
+    rows,
+    session_factory=SessionLocal,
+    batch_size: int | None = None,
+    max_rows: int | None = None,
+) -> dict:
+    """
+    Registra muchos clientes y perfiles con INSERT por lotes.
+
+    ``rows`` es un iterable de dicts con la forma del cuerpo de
+    ``/api/client/register``. Se valida en una sola pasada; las filas
+    válidas se insertan de ``batch_size`` en ``batch_size`` (un INSERT
+    multi-fila para ``clients`` y otro para ``user_profiles``, una
+    transacción por lote). Las filas inválidas y los números repetidos en
+    el archivo se reportan sin detener el resto. Un número ya registrado
+    recibe un perfil nuevo, como en ``/api/client/register``: la app usa
+    el más reciente.
+
+    Si la entrada se corta a mitad (un CSV con bytes que no son UTF-8 o mal
+    formado) se deja de leer: las filas anteriores se registran igual y
+    ``error`` trae el motivo, así el llamador sabe qué quedó creado.
+
+    Devuelve ``{"created", "failed", "results", "errors", "error"}``; ``row``
+    es la posición de la fila en la entrada, empezando en 1, y ``error`` es
+    ``None`` si se leyó toda la entrada.
+    """
+    batch_size = batch_size or BULK_REGISTER_BATCH_SIZE
+    max_rows = max_rows or BULK_REGISTER_MAX_ROWS
+
+    results: list[dict] = []
+    errors: list[dict] = []
+    seen_numbers: set[str] = set()
+    batch: list[tuple[int, dict, dict]] = []
+    input_error = None
+    n = 0
+
+    db = session_factory()
+    try:
+        try:
+            for n, data in enumerate(rows, start=1):
+                if n > max_rows:
+                    errors.append(
+                        {"row": n, "error": f"Se superó el máximo de {max_rows} filas"}
+                    )
+                    break
+                try:
+                    if not isinstance(data, dict):
+                        raise RowError("Cada fila debe ser un objeto JSON")
+                    profile = profile_values(data.get("profile") or {})
+                except RowError as e:
+                    errors.append({"row": n, "error": str(e)})
+                    continue
+
+                number = profile["whatsapp_number"]
+                if number in seen_numbers:
+                    errors.append(
+                        {"row": n, "error": f"whatsapp_number {number} repetido"}
+                    )
+                    continue
+                seen_numbers.add(number)
+
+                client = {
+                    "external_id": data.get("external_id"),
+                    "provider": data.get("provider"),
+                }
+                batch.append((n, client, profile))
+                if len(batch) >= batch_size:
+                    _flush_batch(db, batch, results, errors)
+                    batch = []
+        except (UnicodeDecodeError, csv.Error) as e:
+            input_error = f"CSV inválido a partir de la fila {n + 1}: {e}"
+
+        if batch:
+            _flush_batch(db, batch, results, errors)
+    finally:
+        db.close()
+
+    errors.sort(key=lambda e: e["row"])
+    return {
+        "created": len(results),
+        "failed": len(errors),
+        "results": results,
+        "errors": errors,
+        "error": input_error,
+    }
+
+
+def _flush_batch(db, batch, results: list, errors: list) -> None:
+    try:
+        with span("db_bulk_insert"):
+            # sort_by_parameter_order: los ids vuelven en el orden de las filas
+            client_ids = (
+                db.execute(
+                    insert(Client).returning(Client.id, sort_by_parameter_order=True),
+                    [client for _, client, _ in batch],
+                )
+                .scalars()
+                .all()
+            )
+            profiles = [
+                {**profile, "client_id": client_id}
+                for (_, _, profile), client_id in zip(batch, client_ids, strict=True)
+            ]
+            profile_ids = (
+                db.execute(
+                    insert(UserProfile).returning(
+                        UserProfile.id, sort_by_parameter_order=True
+                    ),
+                    profiles,
+                )
+                .scalars()
+                .all()
+            )
+            db.commit()
+        # Quita la caché negativa de quienes escribieron antes de registrarse
+        PROFILE_CACHE.invalidate(*(profile["whatsapp_number"] for profile in profiles))
+    except SQLAlchemyError:
+        # Alguna fila viola una restricción de la BD: se insertan una a una
+        # para aislarla y reportarla sin perder el resto del lote.
+        db.rollback()
+        logging.exception(
+            "[CLIENT BULK] Error en lote de %s filas, reintentando fila a fila",
+            len(batch),
+        )
+        _insert_one_by_one(db, batch, results, errors)
+    else:
+        results.extend(
+            {"row": n, "client_id": client_id, "profile_id": profile_id}
+            for (n, _, _), client_id, profile_id in zip(
+                batch, client_ids, profile_ids, strict=True
+            )
+        )
+
+
+def _insert_one_by_one(db, batch, results: list, errors: list) -> None:
+    for n, client, profile in batch:
+        try:
+            client_id = db.execute(
+                insert(Client).returning(Client.id), client
+            ).scalar_one()
+            profile_id = db.execute(
+                insert(UserProfile).returning(UserProfile.id),
+                {**profile, "client_id": client_id},
+            ).scalar_one()
+            db.commit()
+            PROFILE_CACHE.invalidate(profile["whatsapp_number"])
+        except SQLAlchemyError as e:
+            db.rollback()
+            errors.append({"row": n, "error": str(e.orig or e).splitlines()[0]})
+            continue
+        results.append({"row": n, "client_id": client_id, "profile_id": profile_id})
@@ -0,0 +1,153 @@
+import json
+import os
+
+from sqlalchemy import select
+
+from db.db import SessionLocal, WhatsAppMessage
+from utils.metrics import span
+
+# Tamaño de página por defecto y máximo de /api/whatsapp/messages/<phone>
+HISTORY_DEFAULT_LIMIT = int(os.getenv("HISTORY_DEFAULT_LIMIT", "50"))
+HISTORY_MAX_LIMIT = int(os.getenv("HISTORY_MAX_LIMIT", "500"))
+# Filas que se traen de la BD por vuelta al exportar en streaming
+HISTORY_STREAM_BATCH = int(os.getenv("HISTORY_STREAM_BATCH", "500"))
+
+# Proyección de solo columnas: evita construir objetos ORM (y el identity map)
+# por cada fila del historial.
+_MESSAGE_COLUMNS = (
+    WhatsAppMessage.id,
+    WhatsAppMessage.phone,
+    WhatsAppMessage.message,
+    WhatsAppMessage.direction,
+    WhatsAppMessage.media_url,
+    WhatsAppMessage.media_id,
+    WhatsAppMessage.media_type,
+    WhatsAppMessage.wa_message_id,
+    WhatsAppMessage.created_at,
+)
+
+
+def message_row_to_dict(row) -> dict:
+    """Mismo formato que ``WhatsAppMessage.to_dict`` a partir de una fila proyectada."""
+    data = dict(row._mapping)
+    created_at = data["created_at"]
+    data["created_at"] = created_at.isoformat() if created_at else None
+    return data
+
+
+def clamp_limit(limit: int | None) -> int:
+    if limit is None:
+        return HISTORY_DEFAULT_LIMIT
+    return max(1, min(limit, HISTORY_MAX_LIMIT))
+
+
+def message_page(
+    db,
+    phone: str,
+    before_id: int | None = None,
+    after_id: int | None = None,
+    limit: int | None = None,
+) -> dict:
+    """
+    Una página del historial de un teléfono, paginada por cursor (keyset) sobre ``id``.
+
+    - ``before_id``: mensajes anteriores a ese id (para ir hacia atrás).
+    - ``after_id``: mensajes posteriores a ese id (para traer los nuevos).
+    - Sin cursor: los ``limit`` mensajes más recientes.
+
+    Los mensajes se devuelven siempre en orden cronológico ascendente. El
+    costo no depende de cuántas páginas haya antes (no usa ``OFFSET``).
+    Devuelve ``{"messages", "limit", "has_more", "next_before_id",
+    "next_after_id"}``; ``next_before_id`` es ``None`` cuando ya no hay
+    mensajes más antiguos que pedir en esa dirección.
+    """
+    limit = clamp_limit(limit)
+    query = select(*_MESSAGE_COLUMNS).where(WhatsAppMessage.phone == phone)
+
+    if after_id is not None:
+        query = query.where(WhatsAppMessage.id > after_id).order_by(
+            WhatsAppMessage.id.asc()
+        )
+        if before_id is not None:
+            query = query.where(WhatsAppMessage.id < before_id)
+    else:
+        if before_id is not None:
+            query = query.where(WhatsAppMessage.id < before_id)
+        query = query.order_by(WhatsAppMessage.id.desc())
+
+    # Una fila de más para saber si quedan páginas sin otra consulta
+    with span("db_history_page"):
+        rows = db.execute(query.limit(limit + 1)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if after_id is None:
+        rows.reverse()
+
+    messages = [message_row_to_dict(row) for row in rows]
+    first_id = messages[0]["id"] if messages else None
+    last_id = messages[-1]["id"] if messages else after_id
+
+    if after_id is None:
+        next_before_id = first_id if has_more else None
+    else:
+        next_before_id = None
+
+    return {
+        "messages": messages,
+        "limit": limit,
+        "has_more": has_more,
+        "next_before_id": next_before_id,
+        "next_after_id": last_id,
+    }
+
+
+def iter_messages(
+    phone: str,
+    after_id: int | None = None,
+    session_factory=SessionLocal,
+    batch_size: int | None = None,
+):
+    """
+    Recorre todo el historial de un teléfono en orden ascendente, por bloques.
+
+    Abre su propia sesión y la cierra al agotarse (o al cerrarse el
+    generador), de modo que puede alimentar una respuesta en streaming. Cada
+    bloque es una consulta keyset de ``batch_size`` filas, así que la memoria
+    usada no crece con el tamaño del historial.
+    """
+    batch_size = batch_size or HISTORY_STREAM_BATCH
+    last_id = after_id
+    db = session_factory()
+    try:
+        while True:
+            query = select(*_MESSAGE_COLUMNS).where(WhatsAppMessage.phone == phone)
+            if last_id is not None:
+                query = query.where(WhatsAppMessage.id > last_id)
+            rows = db.execute(
+                query.order_by(WhatsAppMessage.id.asc()).limit(batch_size)
+            ).all()
+            if not rows:
+                return
+            for row in rows:
+                yield message_row_to_dict(row)
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1].id
+    finally:
+        db.close()
+
+
+def iter_ndjson(messages):
+    """Un objeto JSON por línea (``application/x-ndjson``)."""
+    for message in messages:
+        yield json.dumps(message, ensure_ascii=False) + "\n"
+
+
+def iter_json_array(messages):
+    """Un arreglo JSON emitido elemento a elemento, sin materializar la lista."""
+    yield "["
+    first = True
+    for message in messages:
+        yield ("" if first else ",") + json.dumps(message, ensure_ascii=False)
+        first = False
+    yield "]"
@@ -1,6 +1,7 @@
 from datetime import datetime
 
 from recomendaciones import REGLAS_POR_ENFERMEDAD
+from sqlalchemy import func
 
 from db.db import FoodRegister, UserProfile
 
@@ -9,34 +10,22 @@ def obtener_consumo_diario(session, user_id: int):
     """Suma los nutrientes del día para un usuario."""
     hoy = datetime.utcnow().date()
 
-    registros = (
-        session.query(FoodRegister)
+    nutrientes = ("calorias", "carbohidratos", "proteinas", "grasas", "azucares", "sal")
+
+    # Sumamos nutrientes en la BD: solo se leen las columnas sumadas, que el
+    # índice (user_profile_id, timestamp) incluye en PostgreSQL.
+    fila = (
+        session.query(
+            *(func.coalesce(func.sum(getattr(FoodRegister, n)), 0) for n in nutrientes)
+        )
         .filter(
             FoodRegister.user_profile_id == user_id,
             FoodRegister.timestamp >= datetime(hoy.year, hoy.month, hoy.day),
         )
-        .all()
+        .one()
     )
 
-    # Sumamos nutrientes
-    totales = {
-        "calorias": 0,
-        "carbohidratos": 0,
-        "proteinas": 0,
-        "grasas": 0,
-        "azucares": 0,
-        "sal": 0,
-    }
-
-    for r in registros:
-        totales["calorias"] += r.calorias or 0
-        totales["carbohidratos"] += r.carbohidratos or 0
-        totales["proteinas"] += r.proteinas or 0
-        totales["grasas"] += r.grasas or 0
-        totales["azucares"] += r.azucares or 0
-        totales["sal"] += r.sal or 0
-
-    return totales
+    return {n: int(total) for n, total in zip(nutrientes, fila, strict=True)}
 
 
 def recomendaciones_estandar(user: UserProfile):
@@ -0,0 +1,85 @@
+import logging
+import os
+import threading
+
+from sqlalchemy import text
+
+from db.db import engine
+from utils.metrics import span
+
+logging.basicConfig(level=logging.INFO)
+
+# Se activa cuando el proceso terminó de calentar sus clientes; /readyz lo usa
+# para no recibir tráfico antes de tiempo.
+READY = threading.Event()
+
+
+def _warm_db():
+    # Abre la primera conexión del pool de este proceso
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+
+def _warm_storage():
+    from utils.gcp import get_storage_client
+
+    get_storage_client()
+
+
+def _warm_llms():
+    from utils.ai.detector_image import detection_llm
+    from utils.langchain import conversation_llm
+
+    conversation_llm()
+    api_key = os.getenv("GEMINI_API_KEY")
+    if api_key:
+        detection_llm(api_key)
+
+
+# (nombre, función, obligatorio). Si un paso obligatorio falla el proceso no
+# se marca como listo; los opcionales solo se registran (p. ej. sin
+# credenciales de GCP en desarrollo el cliente se crea en la primera subida).
+WARMUP_STEPS = [
+    ("db", _warm_db, True),
+    ("storage", _warm_storage, False),
+    ("llm", _warm_llms, False),
+]
+
+
+def warm_up(steps=None) -> bool:
+    """
+    Inicializa los clientes compartidos del proceso y marca ``READY``.
+
+    Se ejecuta una vez por worker después del ``fork`` (ver
+    ``gunicorn.conf.py``), así la primera petición de cada worker no paga la
+    creación del pool de BD, del cliente de Cloud Storage ni de los modelos.
+    Devuelve ``True`` si todos los pasos obligatorios terminaron bien.
+    """
+    ok = True
+    for name, step, required in steps or WARMUP_STEPS:
+        try:
+            with span(f"warmup_{name}"):
+                step()
+        except Exception as e:
+            if required:
+                ok = False
+                logging.exception("[WARMUP] Falló el paso obligatorio '%s'", name)
+            else:
+                logging.warning("[WARMUP] Paso '%s' omitido: %s", name, e)
+
+    if ok:
+        READY.set()
+        logging.info("[WARMUP] Proceso %s listo", os.getpid())
+    return ok
+
+
+def after_fork() -> None:
+    """
+    Prepara un worker recién creado por el servidor (``post_fork``).
+
+    Las conexiones del pool de SQLAlchemy heredadas del proceso maestro no
+    se pueden compartir entre procesos: se descartan sin cerrarlas (siguen
+    siendo del maestro) y cada worker abre las suyas.
+    """
+    READY.clear()
+    engine.dispose(close=False)
@@ -0,0 +1,654 @@
+import asyncio
+import contextvars
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from db.db import SessionLocal, WhatsAppMessage
+from db.session import count_checkouts, db_session, unit_of_work
+from utils.ai.detector_audio import transcribir_audio, transcribir_audio_async
+from utils.ai.detector_image import detectar_auto, detectar_auto_async
+from utils.cache import TTLCache
+from utils.conversation_stats import record_messages
+from utils.gcp import upload_file_to_gcp, upload_file_to_gcp_async
+from utils.jobs import AsyncWorkerPool, SQLJobStore, WorkerPool
+from utils.memory_summary import schedule_summary
+from utils.metrics import REGISTRY, labels, span
+from utils.whatsapp import (
+    MEDIA_SPOOL_BYTES,
+    WhatsAppTurn,
+    download_whatsapp_media_stream,
+    download_whatsapp_media_stream_async,
+    send_whatsapp_message,
+    send_whatsapp_message_async,
+)
+
+logging.basicConfig(level=logging.INFO)
+
+# Tipo de trabajo encolado por el webhook para cada mensaje entrante
+WHATSAPP_MESSAGE_JOB = "whatsapp_message"
+
+# Buzón por teléfono: ventana de espera para fusionar ráfagas de mensajes en
+# un solo turno del modelo, tope de espera y máximo de mensajes por turno.
+WHATSAPP_DEBOUNCE_SECONDS = float(os.getenv("WHATSAPP_DEBOUNCE_SECONDS", "2.0"))
+WHATSAPP_DEBOUNCE_MAX_WAIT = float(os.getenv("WHATSAPP_DEBOUNCE_MAX_WAIT", "10.0"))
+WHATSAPP_COALESCE_MAX = int(os.getenv("WHATSAPP_COALESCE_MAX", "10"))
+
+# Pipeline asíncrono (httpx + ainvoke sobre un event loop) en lugar de un
+# hilo por conversación, y cuántos lotes mantiene en vuelo a la vez.
+WHATSAPP_ASYNC = os.getenv("WHATSAPP_ASYNC", "0").lower() in ("1", "true", "yes")
+WHATSAPP_ASYNC_CONCURRENCY = int(os.getenv("WHATSAPP_ASYNC_CONCURRENCY", "200"))
+
+# Executor compartido para las etapas de media que pueden solaparse
+# (subida a GCS mientras Gemini/Speech-to-Text analizan el archivo).
+MEDIA_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.getenv("WHATSAPP_MEDIA_THREADS", "8")),
+    thread_name_prefix="whatsapp-media",
+)
+
+# Bytes máximos que se entregan a la etapa de análisis. Gemini recibe la
+# imagen en línea y Speech-to-Text síncrono acepta ~10 MB de audio en base64.
+IMAGE_ANALYSIS_MAX_BYTES = int(
+    os.getenv("WHATSAPP_IMAGE_ANALYSIS_MAX_BYTES", str(10 * 1024 * 1024))
+)
+AUDIO_ANALYSIS_MAX_BYTES = int(
+    os.getenv("WHATSAPP_AUDIO_ANALYSIS_MAX_BYTES", str(7 * 1024 * 1024))
+)
+
+MESSAGES_TOTAL = REGISTRY.counter(
+    "victoria_messages_total",
+    "Mensajes entrantes de WhatsApp procesados por tipo.",
+    ("msg_type",),
+)
+
+# Ids de mensajes ya encolados en este proceso; evita ir a la BD en cada
+# re-entrega de Meta. La columna única de la BD cubre el resto de casos.
+SEEN_MESSAGE_IDS = TTLCache(
+    maxsize=int(os.getenv("WHATSAPP_DEDUP_CACHE_SIZE", "50000")),
+    ttl=float(os.getenv("WHATSAPP_DEDUP_TTL_SECONDS", "86400")),
+)
+
+
+def iter_webhook_messages(payload: dict):
+    """
+    Recorre TODOS los mensajes de un payload del webhook de WhatsApp Cloud API.
+
+    Meta agrupa bajo carga varios mensajes (y varios usuarios) en un mismo
+    POST: ``entry[*].changes[*].value.messages[*]``. Se devuelve cada objeto
+    de mensaje tal cual lo envía Meta (con ``from``, ``type``,
+    ``text``/``image``/``audio``, etc.), ordenado por ``timestamp`` de forma
+    estable para respetar el orden de cada remitente. Los eventos sin
+    mensajes (p. ej. notificaciones de estado) no producen nada.
+    """
+    found = []
+    for entry in payload.get("entry") or []:
+        for change in entry.get("changes") or []:
+            value = change.get("value") or {}
+            found.extend(value.get("messages") or [])
+
+    def _ts(msg: dict) -> int:
+        try:
+            return int(msg.get("timestamp") or 0)
+        except (TypeError, ValueError):
+            return 0
+
+    return sorted(found, key=_ts)
+
+
+def enqueue_webhook_messages(store: SQLJobStore, payload: dict) -> list[int]:
+    """
+    Encola un trabajo por cada mensaje del payload, particionado por teléfono.
+
+    Las re-entregas de Meta se descartan antes de cualquier trabajo costoso:
+    primero contra la caché en memoria ``SEEN_MESSAGE_IDS`` y luego contra la
+    columna única ``webhook_jobs.dedup_key`` (el ``messages[].id``). Todos los
+    trabajos nuevos de la entrega se guardan en una sola transacción.
+
+    Cada trabajo espera ``WHATSAPP_DEBOUNCE_SECONDS`` (ventana deslizante por
+    teléfono) para que una ráfaga de mensajes cortos se responda en un solo turno.
+    """
+    messages = [
+        msg
+        for msg in iter_webhook_messages(payload)
+        if not (msg.get("id") and msg.get("id") in SEEN_MESSAGE_IDS)
+    ]
+    if not messages:
+        return []
+
+    with span("db_enqueue"):
+        job_ids = store.enqueue_many(
+            WHATSAPP_MESSAGE_JOB,
+            [(msg, msg.get("from"), msg.get("id")) for msg in messages],
+            debounce_seconds=WHATSAPP_DEBOUNCE_SECONDS,
+            debounce_max_wait=WHATSAPP_DEBOUNCE_MAX_WAIT,
+        )
+    for msg in messages:
+        if msg.get("id"):
+            SEEN_MESSAGE_IDS.set(msg["id"], True)
+    return job_ids
+
+
+def _stored_message_ids(wa_message_ids: list[str]) -> set[str]:
+    """Ids de mensajes entrantes que ya quedaron guardados por un intento anterior."""
+    if not wa_message_ids:
+        return set()
+    with db_session(SessionLocal) as db, span("db_dedup_check"):
+        rows = (
+            db.query(WhatsAppMessage.wa_message_id)
+            .filter(WhatsAppMessage.wa_message_id.in_(wa_message_ids))
+            .all()
+        )
+    return {row[0] for row in rows}
+
+
+def _timed(fn, *args):
+    """Ejecuta ``fn(*args)`` y devuelve ``(resultado, segundos)``."""
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+def _store_and_analyze(
+    media_id: str,
+    fname: str,
+    content_type: str,
+    analyze,
+    analysis_limit: int,
+    timings: dict,
+    memory: dict,
+):
+    """
+    Descarga la media en streaming, la sube a GCS y la analiza al mismo tiempo.
+
+    La descarga va a un archivo temporal acotado en memoria
+    (``download_whatsapp_media_stream``) y la subida lo lee por bloques
+    (``upload_file_to_gcp``), así que el archivo completo nunca está en RAM.
+    El análisis (Gemini o Speech-to-Text) recibe como mucho
+    ``analysis_limit`` bytes; si la media es mayor no se analiza.
+
+    Ninguna etapa necesita el resultado de la otra, así que la subida corre en
+    ``MEDIA_EXECUTOR`` mientras el análisis corre en el hilo actual: la
+    latencia es la de la etapa más lenta, no la suma. Registra ``download``,
+    ``upload``, ``analysis`` y ``media_total`` en ``timings`` y los bytes
+    retenidos en ``memory``.
+
+    Devuelve ``(media_url, resultado_del_análisis)``; el resultado es ``None``
+    si la media supera ``analysis_limit``. Devuelve ``None`` si la descarga falla.
+    """
+    started = time.perf_counter()
+    media, timings["download"] = _timed(download_whatsapp_media_stream, media_id)
+    if media is None:
+        return None
+
+    fileobj, size = media
+    with fileobj:
+        data = fileobj.read(analysis_limit + 1)
+        memory["media_bytes"] = size
+        memory["peak_buffer_bytes"] = min(size, MEDIA_SPOOL_BYTES) + len(data)
+        if len(data) > analysis_limit:
+            logging.warning(
+                "[WHATSAPP PIPELINE] Media %s de %s bytes supera el límite de análisis",
+                media_id,
+                size,
+            )
+            data = None
+
+        # copy_context: los spans de la subida heredan las etiquetas (msg_type)
+        upload = MEDIA_EXECUTOR.submit(
+            contextvars.copy_context().run,
+            _timed,
+            upload_file_to_gcp,
+            fileobj,
+            fname,
+            size,
+            content_type,
+        )
+        analysis = None
+        try:
+            if data is not None:
+                analysis, timings["analysis"] = _timed(analyze, data)
+                del data
+        finally:
+            media_url, timings["upload"] = upload.result()
+
+    timings["media_total"] = time.perf_counter() - started
+    return media_url, analysis
+
+
+def prepare_incoming(msg: dict) -> dict | None:
+    """
+    Etapa de media de un mensaje: obtiene el texto del usuario y sube la media.
+
+    Para imágenes ejecuta la detección de alimentos y para audios la
+    transcripción. Devuelve un dict con ``user_message``, los datos de media
+    para guardar el mensaje entrante, ``timings`` (segundos por etapa) y
+    ``memory`` (bytes de la media y pico retenido en memoria), o ``None`` si
+    no hay nada que responder.
+    """
+    msg_type = msg.get("type") or "unknown"
+    MESSAGES_TOTAL.inc(msg_type=msg_type)
+    with labels(msg_type=msg_type), span("media_stage"):
+        return _prepare_incoming(msg)
+
+
+def _start_incoming(msg: dict):
+    """
+    Lee el texto o los datos de media de un mensaje sin hacer I/O.
+
+    Devuelve ``(item, media)``: ``item`` es el resultado parcial con el texto
+    por defecto y ``media`` es ``(media_id, fname, content_type,
+    analysis_limit)`` si hay media que descargar, o ``None``.
+    """
+    phone = msg.get("from")
+    msg_type = msg.get("type")
+    item = {
+        "user_message": None,
+        "media_url": None,
+        "media_id": None,
+        "media_type": None,
+        "wa_message_id": msg.get("id"),
+    }
+    media = None
+
+    if msg_type == "text":
+        text_obj = msg.get("text") or {}
+        item["user_message"] = text_obj.get("body")
+    elif msg_type == "image":
+        image_obj = msg.get("image") or {}
+        media_id = image_obj.get("id")
+        caption = image_obj.get("caption")
+
+        # Si hay caption, úsalo como mensaje del usuario; si no, un texto por defecto
+        item["user_message"] = caption or "Imagen enviada por el usuario"
+        item["media_type"] = "image"
+        item["media_id"] = media_id
+
+        if media_id:
+            # Nombre de archivo: phone_timestamp_mediaid.jpg (aprox)
+            ts = datetime.utcnow().strftime("%Y%m%dT%H%M%S%fZ")
+            fname = f"whatsapp/{phone}_{ts}_{media_id}.jpg"
+            media = (media_id, fname, "image/jpeg", IMAGE_ANALYSIS_MAX_BYTES)
+
+    elif msg_type == "audio":
+        audio_obj = msg.get("audio") or {}
+        media_id = audio_obj.get("id")
+
+        # Para audios usamos un mensaje genérico
+        item["user_message"] = "Audio enviado por el usuario"
+        item["media_type"] = "audio"
+        item["media_id"] = media_id
+
+        if media_id:
+            # Nombre de archivo: phone_timestamp_mediaid.ogg (aprox)
+            ts = datetime.utcnow().strftime("%Y%m%dT%H%M%S%fZ")
+            fname = f"whatsapp/{phone}_{ts}_{media_id}.ogg"
+            media = (media_id, fname, "audio/ogg", AUDIO_ANALYSIS_MAX_BYTES)
+
+    return item, media
+
+
+def _apply_media_result(item: dict, result) -> None:
+    """Convierte el resultado de ``_store_and_analyze`` en el texto del usuario."""
+    if not result:
+        return
+    item["media_url"], analysis = result
+
+    if item["media_type"] == "image":
+        if analysis is None:
+            item["user_message"] = "⚠️ La imagen es demasiado grande para analizarla."
+        elif '"error"' in analysis:
+            item["user_message"] = (
+                "⚠️ Ocurrió un error analizando la imagen, intenta nuevamente."
+            )
+        else:
+            item["user_message"] = analysis  # JSON crudo devuelto por Gemini
+    elif item["media_type"] == "audio":
+        if analysis is None:
+            item["user_message"] = "El audio es demasiado largo para transcribirlo."
+        else:
+            item["user_message"] = (
+                analysis if analysis else "No se pudo transcribir el audio."
+            )
+
+
+def _finish_incoming(
+    item: dict, msg_type: str | None, timings: dict, memory: dict
+) -> dict | None:
+    if not item["user_message"]:
+        logging.info(
+            "[WHATSAPP PIPELINE] Mensaje sin contenido procesable (type=%s)", msg_type
+        )
+        return None
+
+    if timings:
+        logging.info(
+            "[WHATSAPP PIPELINE] Media %s: tiempos (s)=%s memoria (bytes)=%s",
+            item["media_id"],
+            {k: round(v, 3) for k, v in timings.items()},
+            memory,
+        )
+
+    return {**item, "timings": timings, "memory": memory}
+
+
+def _prepare_incoming(msg: dict) -> dict | None:
+    timings: dict[str, float] = {}
+    memory: dict[str, int] = {}
+    item, media = _start_incoming(msg)
+
+    if media:
+        media_id, fname, content_type, analysis_limit = media
+        # Subida a GCS y detección de alimentos (Gemini) o transcripción en paralelo
+        analyze = detectar_auto if item["media_type"] == "image" else transcribir_audio
+        result = _store_and_analyze(
+            media_id, fname, content_type, analyze, analysis_limit, timings, memory
+        )
+        _apply_media_result(item, result)
+
+    return _finish_incoming(item, msg.get("type"), timings, memory)
+
+
+async def _timed_async(awaitable):
+    """Espera ``awaitable`` y devuelve ``(resultado, segundos)``."""
+    started = time.perf_counter()
+    result = await awaitable
+    return result, time.perf_counter() - started
+
+
+async def _store_and_analyze_async(
+    media_id: str,
+    fname: str,
+    content_type: str,
+    analyze,
+    analysis_limit: int,
+    timings: dict,
+    memory: dict,
+):
+    """
+    Versión asíncrona de ``_store_and_analyze`` (mismo contrato).
+
+    La descarga y el análisis usan httpx / ``ainvoke``; la subida a GCS y la
+    lectura del archivo (en disco si pasó de ``MEDIA_SPOOL_BYTES``) van a un
+    hilo. Subida y análisis se esperan juntos con ``asyncio.gather``.
+    """
+    started = time.perf_counter()
+    media, timings["download"] = await _timed_async(
+        download_whatsapp_media_stream_async(media_id)
+    )
+    if media is None:
+        return None
+
+    fileobj, size = media
+    with fileobj:
+        data = await asyncio.to_thread(fileobj.read, analysis_limit + 1)
+        memory["media_bytes"] = size
+        memory["peak_buffer_bytes"] = min(size, MEDIA_SPOOL_BYTES) + len(data)
+        if len(data) > analysis_limit:
+            logging.warning(
+                "[WHATSAPP PIPELINE] Media %s de %s bytes supera el límite de análisis",
+                media_id,
+                size,
+            )
+            data = None
+
+        stages = [
+            _timed_async(upload_file_to_gcp_async(fileobj, fname, size, content_type))
+        ]
+        if data is not None:
+            stages.append(_timed_async(analyze(data)))
+        # return_exceptions: el archivo no se cierra mientras la subida lo lee
+        outcomes = await asyncio.gather(*stages, return_exceptions=True)
+        for outcome in outcomes:
+            if isinstance(outcome, BaseException):
+                raise outcome
+
+    media_url, timings["upload"] = outcomes[0]
+    analysis = None
+    if len(outcomes) > 1:
+        analysis, timings["analysis"] = outcomes[1]
+
+    timings["media_total"] = time.perf_counter() - started
+    return media_url, analysis
+
+
+async def prepare_incoming_async(msg: dict) -> dict | None:
+    """Versión asíncrona de ``prepare_incoming`` (mismo resultado)."""
+    msg_type = msg.get("type") or "unknown"
+    MESSAGES_TOTAL.inc(msg_type=msg_type)
+    with labels(msg_type=msg_type), span("media_stage"):
+        timings: dict[str, float] = {}
+        memory: dict[str, int] = {}
+        item, media = _start_incoming(msg)
+
+        if media:
+            media_id, fname, content_type, analysis_limit = media
+            analyze = (
+                detectar_auto_async
+                if item["media_type"] == "image"
+                else transcribir_audio_async
+            )
+            result = await _store_and_analyze_async(
+                media_id, fname, content_type, analyze, analysis_limit, timings, memory
+            )
+            _apply_media_result(item, result)
+
+        return _finish_incoming(item, msg.get("type"), timings, memory)
+
+
+def process_whatsapp_messages(msgs: list[dict]) -> dict:
+    """
+    Pipeline completo de una ráfaga de mensajes de un mismo teléfono.
+
+    Cada mensaje pasa por su etapa de media y los textos resultantes se
+    fusionan en un único turno del modelo (``WhatsAppTurn``): una sola
+    respuesta, un solo envío y todos los entrantes guardados junto a ella.
+
+    Se ejecuta en los workers de la cola (ver ``utils.jobs``), nunca dentro
+    de la petición del webhook. Si lanza una excepción los trabajos se
+    reintentan con backoff y, agotados los intentos, quedan en dead-letter.
+
+    Todos los accesos a la BD del lote van en dos unidades de trabajo cortas
+    (``db.session.unit_of_work``), una conexión del pool cada una:
+    ``whatsapp_inbound`` antes de las llamadas externas (deduplicación,
+    perfil y versión de la sesión de conversación) y ``whatsapp_outbound``
+    después del envío (mensajes, contadores, estado de conversación y
+    conteo de perfilamiento). Ninguna conexión queda tomada durante la
+    media, Gemini o el envío. Los checkouts de todo el lote se cuentan en
+    ``victoria_db_unit_checkouts{unit="whatsapp_pipeline"}``.
+    """
+    types = {m.get("type") or "unknown" for m in msgs}
+    with labels(msg_type=types.pop() if len(types) == 1 else "mixed"):
+        with span("pipeline_total"), count_checkouts("whatsapp_pipeline"):
+            return _process_batch(msgs)
+
+
+def _load_batch(msgs: list[dict], turn: WhatsAppTurn) -> set[str]:
+    """
+    Lecturas del lote en la unidad ``whatsapp_inbound``: ids ya guardados por
+    un intento anterior (no se repite LLM ni envío) y, si queda algo que
+    responder, el perfil y la sesión de conversación del turno.
+    """
+    with unit_of_work("whatsapp_inbound", SessionLocal):
+        stored = _stored_message_ids([m["id"] for m in msgs if m.get("id")])
+        if any(m.get("id") not in stored for m in msgs):
+            turn.load()
+    return stored
+
+
+def _process_batch(msgs: list[dict]) -> dict:
+    phone = msgs[0].get("from") if msgs else None
+    turn = WhatsAppTurn(phone)
+
+    stored = _load_batch(msgs, turn)
+    if stored:
+        logging.info("[WHATSAPP PIPELINE] Mensajes ya procesados: %s", stored)
+    incoming = [
+        item
+        for item in (prepare_incoming(m) for m in msgs if m.get("id") not in stored)
+        if item
+    ]
+
+    if not incoming:
+        return {"status": "ignored", "from": phone}
+
+    user_message = _merge_user_message(phone, incoming)
+    with span("build_reply"):
+        reply_text = turn.reply(user_message)
+
+    send_result = None
+    if phone:
+        send_result = send_whatsapp_message(phone, reply_text)
+        logging.info("[WHATSAPP PIPELINE] Resultado envío WhatsApp: %s", send_result)
+    else:
+        logging.warning("[WHATSAPP PIPELINE] Mensaje sin número de teléfono")
+
+    if phone:
+        _store_batch(phone, incoming, reply_text, turn)
+        turn.summarize()
+        # El resumen de memoria, si hace falta, ya no retrasa esta respuesta
+        schedule_summary(phone)
+
+    return _batch_result(phone, user_message, reply_text, send_result, incoming)
+
+
+async def process_whatsapp_messages_async(msgs: list[dict]) -> dict:
+    """
+    Versión asíncrona de ``process_whatsapp_messages`` (mismo resultado).
+
+    Las etapas de media de la ráfaga corren concurrentemente y ninguna
+    llamada de red bloquea el event loop, así que un solo proceso puede
+    mantener cientos de conversaciones en vuelo (ver ``AsyncWorkerPool``).
+    Las dos unidades de trabajo corren cada una entera en un hilo
+    (``asyncio.to_thread``), así que un lote en vuelo no retiene conexiones
+    mientras espera.
+    """
+    types = {m.get("type") or "unknown" for m in msgs}
+    with labels(msg_type=types.pop() if len(types) == 1 else "mixed"):
+        with span("pipeline_total"), count_checkouts("whatsapp_pipeline"):
+            return await _process_batch_async(msgs)
+
+
+async def _process_batch_async(msgs: list[dict]) -> dict:
+    phone = msgs[0].get("from") if msgs else None
+    turn = WhatsAppTurn(phone)
+
+    stored = await asyncio.to_thread(_load_batch, msgs, turn)
+    if stored:
+        logging.info("[WHATSAPP PIPELINE] Mensajes ya procesados: %s", stored)
+    prepared = await asyncio.gather(
+        *(prepare_incoming_async(m) for m in msgs if m.get("id") not in stored)
+    )
+    incoming = [item for item in prepared if item]
+
+    if not incoming:
+        return {"status": "ignored", "from": phone}
+
+    user_message = _merge_user_message(phone, incoming)
+    with span("build_reply"):
+        reply_text = await turn.areply(user_message)
+
+    send_result = None
+    if phone:
+        send_result = await send_whatsapp_message_async(phone, reply_text)
+        logging.info("[WHATSAPP PIPELINE] Resultado envío WhatsApp: %s", send_result)
+    else:
+        logging.warning("[WHATSAPP PIPELINE] Mensaje sin número de teléfono")
+
+    if phone:
+        await asyncio.to_thread(_store_batch, phone, incoming, reply_text, turn)
+        await asyncio.to_thread(turn.summarize)
+        schedule_summary(phone)
+
+    return _batch_result(phone, user_message, reply_text, send_result, incoming)
+
+
+def _merge_user_message(phone: str | None, incoming: list[dict]) -> str:
+    user_message = "\n".join(item["user_message"] for item in incoming)
+    logging.info(
+        "[WHATSAPP PIPELINE] Mensaje de usuario detectado. from=%s mensajes=%s body=%s",
+        phone,
+        len(incoming),
+        user_message,
+    )
+    return user_message
+
+
+def _store_batch(
+    phone: str, incoming: list[dict], reply_text: str, turn: WhatsAppTurn
+) -> None:
+    """
+    Guarda los mensajes entrantes, la respuesta y sus contadores en una
+    transacción, junto con las escrituras del turno (``WhatsAppTurn.save``).
+
+    Es una unidad de trabajo corta que empieza después del envío. La
+    respuesta ya se envió, así que un fallo aquí (también en el commit) se
+    registra y no reintenta.
+    """
+    messages = [
+        WhatsAppMessage(
+            phone=phone,
+            message=item["user_message"],
+            direction="in",
+            media_url=item["media_url"],
+            media_id=item["media_id"],
+            media_type=item["media_type"],
+            wa_message_id=item["wa_message_id"],
+        )
+        for item in incoming
+    ]
+    messages.append(WhatsAppMessage(phone=phone, message=reply_text, direction="out"))
+    try:
+        with span("db_store"), unit_of_work("whatsapp_outbound", SessionLocal) as db:
+            db.add_all(messages)
+            record_messages(db, messages)
+            turn.save()
+    except Exception as e:
+        logging.exception("[WHATSAPP PIPELINE] Error guardando mensajes en BD: %s", e)
+
+
+def _batch_result(phone, user_message, reply_text, send_result, incoming) -> dict:
+    return {
+        "status": "ok",
+        "from": phone,
+        "user_message": user_message,
+        "reply": reply_text,
+        "send_result": send_result,
+        "media_urls": [item["media_url"] for item in incoming if item["media_url"]],
+    }
+
+
+def process_whatsapp_message(msg: dict) -> dict:
+    """Pipeline completo de un único mensaje entrante (ver ``process_whatsapp_messages``)."""
+    return process_whatsapp_messages([msg])
+
+
+def build_worker_pool(
+    store: SQLJobStore, workers: int = 2, use_async: bool | None = None
+) -> WorkerPool | AsyncWorkerPool:
+    """
+    Pool de workers con los handlers del webhook de WhatsApp registrados.
+
+    Cada worker toma mensajes de teléfonos distintos en paralelo; la cola
+    garantiza que los de un mismo teléfono se procesen de uno en uno y en orden,
+    fusionando hasta ``WHATSAPP_COALESCE_MAX`` mensajes seguidos en un turno.
+
+    Con ``WHATSAPP_ASYNC=1`` (o ``use_async=True``) se usa el pipeline
+    asíncrono: un event loop con hasta ``WHATSAPP_ASYNC_CONCURRENCY`` lotes
+    en vuelo, y ``workers`` pasa a ser el número de hilos para la BD.
+    """
+    if WHATSAPP_ASYNC if use_async is None else use_async:
+        return AsyncWorkerPool(
+            store,
+            batch_handlers={WHATSAPP_MESSAGE_JOB: process_whatsapp_messages_async},
+            batch_size=WHATSAPP_COALESCE_MAX,
+            concurrency=WHATSAPP_ASYNC_CONCURRENCY,
+            db_threads=max(workers, 1),
+        )
+    return WorkerPool(
+        store,
+        batch_handlers={WHATSAPP_MESSAGE_JOB: process_whatsapp_messages},
+        batch_size=WHATSAPP_COALESCE_MAX,
+        workers=workers,
+    )
@@ -0,0 +1,55 @@
+import random
+
+import pytest
+
+from benchmarks.fakes import Latency
+from benchmarks.loadgen import format_report, parse_mix, percentiles, run_load
+from utils.metrics import REGISTRY
+
+
+def test_latency_distributions_are_seeded():
+    spec = Latency.parse("lognormal:0.5:0.3")
+    first = [spec.sample(random.Random(7)) for _ in range(3)]
+
+    assert first == [spec.sample(random.Random(7)) for _ in range(3)]
+    assert Latency.parse("const:0.2").scaled(0.5).sample(random.Random()) == 0.1
+    assert Latency.parse("normal:0:1").sample(random.Random(1)) >= 0
+    with pytest.raises(ValueError):
+        Latency.parse("pareto:1")
+
+
+def test_percentiles_use_nearest_rank():
+    stats = percentiles([i / 1000 for i in range(1, 101)])
+
+    assert (stats["p50"], stats["p95"], stats["p99"], stats["max"]) == (
+        50.0,
+        95.0,
+        99.0,
+        100.0,
+    )
+    assert percentiles([]) == {}
+
+
+def test_load_run_covers_the_whole_webhook_path(monkeypatch, tmp_path):
+    """Webhook, cola, pipeline y envío con todos los servicios externos falsos."""
+    REGISTRY.clear()
+
+    report = run_load(
+        users=3,
+        messages=2,
+        mix=parse_mix("text=1,image=1,audio=1"),
+        scale=0,
+        workers=2,
+        poll_interval=0.01,
+        timeout=30,
+        database_url=f"sqlite:///{tmp_path}/bench.db",
+    )
+
+    assert report["errors"] == 0, report["error_samples"]
+    assert report["completed"] == 6
+    assert set(report["latency_ms"]["all"]) == {"p50", "p95", "p99", "mean", "max"}
+    assert report["throughput_msg_s"] > 0
+    assert report["rss_mb"]["peak"] > 0
+    # Una unidad de lectura y otra de escritura por lote
+    assert report["db_checkouts_per_batch"] == 2
+    assert "throughput" in format_report(report, baseline=report)
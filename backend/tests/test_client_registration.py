@@ -0,0 +1,274 @@
+import io
+import time
+
+import pytest
+from sqlalchemy import create_engine, insert
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from db.db import Client, UserProfile
+from db.migrations import migrate
+from services.client_registration import (
+    RowError,
+    bulk_register,
+    iter_csv_rows,
+    profile_values,
+)
+
+
+@pytest.fixture
+def engine():
+    """Esquema completo sobre SQLite en memoria."""
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    migrate(engine)
+    yield engine
+    engine.dispose()
+
+
+def _row(n, **profile):
+    return {
+        "external_id": f"ext-{n}",
+        "provider": "clinica",
+        "profile": {
+            "full_name": f"Paciente {n}",
+            "whatsapp_number": f"57300{n:06d}",
+            "age": 70 + n % 20,
+            **profile,
+        },
+    }
+
+
+def test_bulk_register_reports_per_row_errors(engine):
+    """Las filas inválidas o repetidas se reportan y el resto se registra."""
+    session_factory = sessionmaker(bind=engine)
+    rows = [
+        _row(1),
+        _row(2, full_name=""),
+        _row(3, age="setenta"),
+        "no soy un objeto",
+        _row(1),
+        _row(4, diseases=["Diabetes"], accepted_terms=True),
+    ]
+
+    summary = bulk_register(rows, session_factory=session_factory, batch_size=2)
+
+    assert summary["created"] == 2
+    assert summary["error"] is None
+    assert [r["row"] for r in summary["results"]] == [1, 6]
+    assert [e["row"] for e in summary["errors"]] == [2, 3, 4, 5]
+    assert "repetido" in summary["errors"][3]["error"]
+
+    db = session_factory()
+    try:
+        profile = db.query(UserProfile).filter_by(whatsapp_number="57300000004").one()
+        assert profile.diseases == ["Diabetes"]
+        assert profile.accepted_terms is True
+        assert profile.personality_stage == "profiling"
+        assert profile.client.external_id == "ext-4"
+    finally:
+        db.close()
+
+
+def test_bulk_ids_follow_row_order(engine):
+    """Cada fila recibe el cliente y el perfil que se insertaron por ella."""
+    session_factory = sessionmaker(bind=engine)
+
+    summary = bulk_register(
+        [_row(n) for n in range(1, 8)], session_factory=session_factory, batch_size=3
+    )
+
+    db = session_factory()
+    try:
+        for result in summary["results"]:
+            profile = db.get(UserProfile, result["profile_id"])
+            assert profile.client_id == result["client_id"]
+            assert profile.client.external_id == f"ext-{result['row']}"
+            assert profile.whatsapp_number == f"57300{result['row']:06d}"
+    finally:
+        db.close()
+
+
+def test_bulk_inserts_stay_batched_on_postgresql():
+    """
+    En PostgreSQL el id serial hace de centinela: ``sort_by_parameter_order``
+    no obliga a insertar fila a fila (SQLite sí, por eso se mira el compilado).
+    """
+    dialect = postgresql.psycopg2.dialect()
+    for model, keys in (
+        (Client, ["external_id", "provider"]),
+        (UserProfile, ["client_id", "full_name", "whatsapp_number"]),
+    ):
+        compiled = (
+            insert(model)
+            .returning(model.id, sort_by_parameter_order=True)
+            .compile(dialect=dialect, for_executemany=True, column_keys=keys)
+        )
+        assert compiled._insertmanyvalues.implicit_sentinel
+
+
+def test_bulk_registering_a_known_number_adds_a_newer_profile(engine):
+    """Como ``/api/client/register``: el número ya registrado usa el perfil nuevo."""
+    session_factory = sessionmaker(bind=engine)
+    bulk_register([_row(1)], session_factory=session_factory)
+
+    again = bulk_register(
+        [_row(1, full_name="Paciente Actualizado")], session_factory=session_factory
+    )
+
+    assert again["created"] == 1
+    assert again["errors"] == []
+    db = session_factory()
+    try:
+        profiles = (
+            db.query(UserProfile)
+            .filter_by(whatsapp_number="57300000001")
+            .order_by(UserProfile.id)
+            .all()
+        )
+        assert [p.full_name for p in profiles] == [
+            "Paciente 1",
+            "Paciente Actualizado",
+        ]
+    finally:
+        db.close()
+
+
+def test_broken_csv_reports_the_rows_already_registered(engine):
+    """Un CSV que deja de ser UTF-8 a mitad informa lo que alcanzó a crear."""
+    header = "full_name,whatsapp_number\n"
+    body = "".join(f"Paciente {n},57{n:08d}\n" for n in range(1_000))
+    data = (header + body).encode() + b"Paciente \xff,57999\n"
+
+    summary = bulk_register(
+        iter_csv_rows(io.BytesIO(data)),
+        session_factory=sessionmaker(bind=engine),
+        batch_size=100,
+    )
+
+    assert "CSV inválido" in summary["error"]
+    assert summary["created"] == len(summary["results"]) > 0
+    db = sessionmaker(bind=engine)()
+    try:
+        assert db.query(UserProfile).count() == summary["created"]
+    finally:
+        db.close()
+
+
+def test_csv_rows_are_parsed_into_register_payloads():
+    """El CSV usa las mismas claves que el JSON; las listas van separadas por ';'."""
+    data = (
+        "﻿full_name,whatsapp_number,age,diseases,accepted_terms,provider\n"
+        "Ana Pérez,573001,81,Hipertensión; Diabetes,sí,clinica\n"
+    ).encode()
+
+    (row,) = list(iter_csv_rows(io.BytesIO(data)))
+
+    assert row["provider"] == "clinica"
+    assert row["external_id"] is None
+    assert row["profile"]["full_name"] == "Ana Pérez"
+    assert row["profile"]["diseases"] == "Hipertensión; Diabetes"
+
+
+def test_ten_thousand_rows_register_quickly(engine):
+    """10k pacientes de un CSV se registran en pocos segundos."""
+    header = "full_name,whatsapp_number,age,allergies\n"
+    body = "".join(f"Paciente {n},57{n:08d},75,Maní\n" for n in range(10_000))
+
+    started = time.perf_counter()
+    summary = bulk_register(
+        iter_csv_rows(io.BytesIO((header + body).encode())),
+        session_factory=sessionmaker(bind=engine),
+    )
+    elapsed = time.perf_counter() - started
+
+    assert summary["created"] == 10_000
+    assert summary["failed"] == 0
+    assert elapsed < 10
+
+
+def test_profile_values_accepts_json_and_csv_shapes():
+    """La validación compartida con ``/register`` normaliza tipos de CSV o JSON."""
+    from_csv = profile_values(
+        {
+            "full_name": " Ana Pérez ",
+            "whatsapp_number": 573001,
+            "age": "81",
+            "height_cm": "160.5",
+            "diseases": "Hipertensión; Diabetes",
+            "accepted_terms": "false",
+        }
+    )
+    from_json = profile_values(
+        {
+            "full_name": "Ana Pérez",
+            "whatsapp_number": "573001",
+            "age": 81,
+            "diseases": ["Hipertensión"],
+            "accepted_terms": True,
+        }
+    )
+
+    assert from_csv["full_name"] == "Ana Pérez"
+    assert from_csv["whatsapp_number"] == "573001"
+    assert (from_csv["age"], from_csv["height_cm"], from_csv["weight_kg"]) == (
+        81,
+        160,
+        None,
+    )
+    assert from_csv["diseases"] == ["Hipertensión", "Diabetes"]
+    assert from_csv["accepted_terms"] is False
+    assert from_json["diseases"] == ["Hipertensión"]
+    assert from_json["allergies"] == []
+    assert from_json["accepted_terms"] is True
+    with pytest.raises(RowError, match="'age' debe ser numérico"):
+        profile_values({"full_name": "Ana", "whatsapp_number": "1", "age": "setenta"})
+
+
+def test_register_endpoint_rejects_invalid_profiles():
+    """``/register`` responde 400 con el motivo de ``profile_values``."""
+    import app as app_mod
+
+    client = app_mod.app.test_client()
+    missing = client.post("/api/client/register", json=_row(1, full_name=""))
+    bad_age = client.post("/api/client/register", json=_row(1, age="setenta"))
+
+    assert missing.status_code == 400
+    assert "full_name" in missing.get_json()["error"]
+    assert bad_age.status_code == 400
+    assert "numérico" in bad_age.get_json()["error"]
+
+
+def test_register_endpoint_commits_one_unit_and_refreshes_the_cache(engine):
+    """El alta individual se confirma en una unidad y luego limpia la caché."""
+    import app as app_mod
+    from db.db import SessionLocal
+    from utils.profile_cache import PROFILE_CACHE
+
+    previous = SessionLocal.session_factory.kw.get("bind")
+    SessionLocal.configure(bind=engine)
+    phone = _row(9)["profile"]["whatsapp_number"]
+    # Caché negativa de antes del registro
+    assert PROFILE_CACHE.get_or_load(phone, lambda p: None) is None
+    try:
+        resp = app_mod.app.test_client().post(
+            "/api/client/register", json=_row(9, full_name="Ana Pérez")
+        )
+    finally:
+        SessionLocal.configure(bind=previous)
+
+    assert resp.status_code == 201
+    body = resp.get_json()
+    db = sessionmaker(bind=engine)()
+    try:
+        profile = db.get(UserProfile, body["profile_id"])
+        assert profile.client_id == body["client_id"]
+        assert profile.full_name == "Ana Pérez"
+    finally:
+        db.close()
+    assert PROFILE_CACHE.get_or_load(phone, lambda p: "recargado") == "recargado"
+    PROFILE_CACHE.invalidate(phone)
@@ -0,0 +1,106 @@
+import json
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from db.db import WhatsAppMessage
+from services.conversation_history import (
+    HISTORY_MAX_LIMIT,
+    iter_json_array,
+    iter_messages,
+    iter_ndjson,
+    message_page,
+)
+
+
+@pytest.fixture
+def session_factory():
+    """Tabla ``whatsapp_messages`` con 120 mensajes de A intercalados con 30 de B."""
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    WhatsAppMessage.__table__.create(engine)
+    factory = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+
+    db = factory()
+    for n in range(120):
+        db.add(WhatsAppMessage(phone="A", message=f"a{n}", direction="in"))
+        if n % 4 == 0:
+            db.add(WhatsAppMessage(phone="B", message=f"b{n}", direction="out"))
+    db.commit()
+    db.close()
+
+    yield factory
+    engine.dispose()
+
+
+def _all_for(session_factory, phone):
+    db = session_factory()
+    try:
+        return [
+            m.to_dict()
+            for m in db.query(WhatsAppMessage)
+            .filter(WhatsAppMessage.phone == phone)
+            .order_by(WhatsAppMessage.id)
+        ]
+    finally:
+        db.close()
+
+
+def test_paging_backwards_covers_history_without_gaps(session_factory):
+    """Recorrer hacia atrás con ``next_before_id`` devuelve todo, sin repetir."""
+    db = session_factory()
+    try:
+        pages = [message_page(db, "A", limit=50)]
+        while pages[-1]["next_before_id"]:
+            pages.append(
+                message_page(db, "A", before_id=pages[-1]["next_before_id"], limit=50)
+            )
+    finally:
+        db.close()
+
+    assert [len(p["messages"]) for p in pages] == [50, 50, 20]
+    assert [p["has_more"] for p in pages] == [True, True, False]
+    # Cada página en orden cronológico; la primera es la más reciente
+    seen = [m for page in reversed(pages) for m in page["messages"]]
+    assert seen == _all_for(session_factory, "A")
+
+
+def test_after_id_returns_only_newer_messages(session_factory):
+    """``after_id`` trae los mensajes nuevos desde el último que tiene el cliente."""
+    history = _all_for(session_factory, "A")
+    db = session_factory()
+    try:
+        page = message_page(db, "A", after_id=history[-3]["id"], limit=10)
+        empty = message_page(db, "A", after_id=page["next_after_id"])
+        huge = message_page(db, "A", limit=10_000)
+    finally:
+        db.close()
+
+    assert page["messages"] == history[-2:]
+    assert page["has_more"] is False
+    assert empty["messages"] == []
+    assert empty["next_after_id"] == history[-1]["id"]
+    assert huge["limit"] == HISTORY_MAX_LIMIT
+
+
+def test_streaming_export_matches_to_dict_in_both_formats(session_factory):
+    """La exportación por bloques produce lo mismo que ``to_dict`` fila a fila."""
+    expected = _all_for(session_factory, "A")
+
+    ndjson = "".join(
+        iter_ndjson(iter_messages("A", session_factory=session_factory, batch_size=7))
+    )
+    array = "".join(
+        iter_json_array(
+            iter_messages("A", session_factory=session_factory, batch_size=7)
+        )
+    )
+
+    assert [json.loads(line) for line in ndjson.splitlines()] == expected
+    assert json.loads(array) == expected
+    assert json.loads("".join(iter_json_array(iter([])))) == []
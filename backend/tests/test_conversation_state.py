@@ -0,0 +1,108 @@
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from db.db import ConversationState, WhatsAppMessage
+from utils import conversation_state as cs_mod
+from utils.conversation_state import (
+    InMemoryConversationStateStore,
+    SQLConversationStateStore,
+    build_state_store,
+)
+
+
+@pytest.fixture
+def session_factory():
+    """SQLite en memoria con las tablas de estado y de mensajes."""
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    ConversationState.__table__.create(engine)
+    WhatsAppMessage.__table__.create(engine)
+    yield sessionmaker(bind=engine, autoflush=False, autocommit=False)
+    engine.dispose()
+
+
+def _count_selects(engine):
+    statements = []
+
+    def before(conn, cursor, statement, *args):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before)
+    return statements
+
+
+def test_sql_store_upserts_and_bumps_version(session_factory):
+    store = SQLConversationStateStore(session_factory)
+    assert store.load("A") is None
+
+    assert store.save("A", "", [("in", "hola"), ("out", "¡Hola!")]) == 1
+    assert store.save("A", "Saludó.", [("in", "¿qué como hoy?")]) == 2
+
+    snapshot = store.load("A")
+    assert snapshot.version == 2
+    assert snapshot.summary == "Saludó."
+    assert snapshot.turns == [("in", "¿qué como hoy?")]
+
+
+def test_sql_store_loads_in_a_single_query(session_factory):
+    store = SQLConversationStateStore(session_factory)
+    store.save("A", "resumen", [("in", "hola")])
+    selects = _count_selects(session_factory.kw["bind"])
+
+    store.load("A")
+
+    assert len(selects) == 1
+    assert "whatsapp_messages" not in selects[0]
+
+
+def test_sql_store_bootstraps_users_without_state(session_factory, monkeypatch):
+    """Un teléfono sin fila arranca con sus últimos mensajes guardados."""
+    monkeypatch.setattr(cs_mod, "SESSION_REBUILD_MESSAGES", 2)
+    db = session_factory()
+    for n, direction in enumerate(["in", "out", "in"]):
+        db.add(WhatsAppMessage(phone="B", message=f"m{n}", direction=direction))
+    db.commit()
+    db.close()
+
+    snapshot = SQLConversationStateStore(session_factory).load("B")
+
+    assert snapshot.version == 0
+    assert snapshot.turns == [("out", "m1"), ("in", "m2")]
+
+
+def test_every_unsummarized_turn_is_kept():
+    """Los turnos aún fuera del resumen no se recortan: otro worker los necesita."""
+    store = InMemoryConversationStateStore()
+
+    store.save("A", "", [("in", str(n)) for n in range(50)])
+
+    assert [t for _, t in store.load("A").turns] == [str(n) for n in range(50)]
+
+
+def test_sql_store_only_ships_the_row_when_the_version_changed(session_factory):
+    store = SQLConversationStateStore(session_factory)
+    assert store.load_if_newer("A", 0) is None
+    version = store.save("A", "resumen", [("in", "hola")])
+    selects = _count_selects(session_factory.kw["bind"])
+
+    assert store.load_if_newer("A", version) is None
+    snapshot = store.load_if_newer("A", version - 1)
+
+    assert snapshot.version == version
+    assert snapshot.turns == [("in", "hola")]
+    assert len(selects) == 2
+    assert all("whatsapp_messages" not in sql for sql in selects)
+
+
+def test_build_state_store_by_backend_name():
+    assert isinstance(build_state_store("sql"), SQLConversationStateStore)
+    assert isinstance(build_state_store("memory"), InMemoryConversationStateStore)
+    assert build_state_store("none") is None
+    with pytest.raises(ValueError):
+        build_state_store("redis")
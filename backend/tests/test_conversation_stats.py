@@ -0,0 +1,133 @@
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import utils.whatsapp as wa_mod
+from db.db import Base, Client, ConversationStats, UserProfile, WhatsAppMessage
+from utils.conversation_stats import message_count, recent_messages, record_messages
+from utils.profile_cache import PROFILE_CACHE, ProfileSnapshot
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def session_factory(engine):
+    return sessionmaker(
+        bind=engine, autoflush=False, autocommit=False, expire_on_commit=False
+    )
+
+
+def _store(db, phone, *directions):
+    messages = [
+        WhatsAppMessage(phone=phone, message=f"{direction}{n}", direction=direction)
+        for n, direction in enumerate(directions)
+    ]
+    db.add_all(messages)
+    record_messages(db, messages)
+    db.commit()
+    return messages
+
+
+def test_counters_accumulate_per_phone(session_factory):
+    db = session_factory()
+    _store(db, "A", "in", "in", "out")
+    _store(db, "B", "in")
+    last = _store(db, "A", "in", "out")[-1]
+
+    stats = db.get(ConversationStats, "A")
+    assert (stats.messages_in, stats.messages_out) == (3, 2)
+    assert stats.last_message_id == last.id
+    assert stats.last_message_at == last.created_at
+    assert message_count(db, "A") == 5
+    assert message_count(db, "B") == 1
+    assert message_count(db, "C") == 0
+    db.close()
+
+
+def test_rollback_discards_counters_with_the_messages(session_factory):
+    db = session_factory()
+    messages = [WhatsAppMessage(phone="A", message="hola", direction="in")]
+    db.add_all(messages)
+    record_messages(db, messages)
+    db.rollback()
+
+    assert message_count(db, "A") == 0
+    db.close()
+
+
+def test_recent_messages_returns_the_tail_in_order(session_factory):
+    db = session_factory()
+    _store(db, "A", *["in", "out"] * 30)
+
+    tail = recent_messages(db, "A", limit=40)
+
+    assert len(tail) == 40
+    assert [m.id for m in tail] == sorted(m.id for m in tail)
+    assert tail[-1].message == "out59"
+    db.close()
+
+
+def test_profiling_check_does_not_scan_the_history(
+    engine, session_factory, monkeypatch
+):
+    """Bajo el umbral solo se lee conversation_stats; al pasarlo, 40 mensajes."""
+    db = session_factory()
+    client = Client()
+    profile = UserProfile(
+        client=client, full_name="Ana Pérez", whatsapp_number="A", diseases=[]
+    )
+    db.add(profile)
+    db.commit()
+    _store(db, "A", *["in", "out"] * 5)
+    db.close()
+    snapshot = ProfileSnapshot.from_model(profile)
+
+    statements = []
+    event.listen(
+        engine,
+        "before_cursor_execute",
+        lambda conn, cursor, sql, *args: statements.append(sql),
+    )
+    summaries = []
+
+    def fake_summary(history_text, user_profile):
+        summaries.append(history_text)
+        return {"mood_baseline": "tranquilo"}
+
+    monkeypatch.setattr(wa_mod, "SessionLocal", session_factory)
+    monkeypatch.setattr(wa_mod, "summarize_personality", fake_summary)
+
+    wa_mod._update_personality_stage("A", snapshot, {})
+
+    assert summaries == []
+    assert not any("count(" in sql.lower() for sql in statements)
+    assert not any("FROM whatsapp_messages" in sql for sql in statements)
+
+    db = session_factory()
+    _store(db, "A", *["in", "out"] * 25)
+    db.close()
+
+    PROFILE_CACHE.get_or_load("A", lambda phone: snapshot)
+    wa_mod._update_personality_stage("A", snapshot, {})
+
+    lines = summaries[0].splitlines()
+    assert len(lines) == 40
+    assert lines[-1] == "Victoria: out49"
+    db = session_factory()
+    stored = db.get(UserProfile, snapshot.id)
+    assert stored.personality_stage == "daily"
+    assert stored.personality_profile == {"mood_baseline": "tranquilo"}
+    db.close()
+    # El perfil en caché quedó viejo y se descarta
+    assert len(PROFILE_CACHE) == 0
@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from db.db import WhatsAppMessage
+from db.session import (
+    DB_CHECKOUTS,
+    UNIT_CHECKOUTS,
+    after_commit,
+    db_session,
+    unit_of_work,
+)
+from utils.metrics import REGISTRY
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    """SQLite en archivo con el pool por defecto, para contar checkouts reales."""
+    engine = create_engine(f"sqlite:///{tmp_path}/db.sqlite")
+    WhatsAppMessage.__table__.create(engine)
+    REGISTRY.clear()
+    yield sessionmaker(bind=engine, autoflush=False, autocommit=False)
+    engine.dispose()
+
+
+def _add(phone: str) -> None:
+    with db_session() as db:
+        db.add(WhatsAppMessage(phone=phone, message="hola", direction="in"))
+
+
+def _count(session_factory) -> int:
+    with db_session(session_factory) as db:
+        return db.query(WhatsAppMessage).count()
+
+
+def test_steps_outside_a_unit_use_one_checkout_each(session_factory):
+    for _ in range(3):
+        with db_session(session_factory) as db:
+            db.add(WhatsAppMessage(phone="A", message="hola", direction="in"))
+
+    assert _count(session_factory) == 3
+    assert DB_CHECKOUTS.value() == 4
+    assert UNIT_CHECKOUTS.count(unit="test") == 0
+
+
+def test_unit_shares_one_session_and_checkout(session_factory):
+    with unit_of_work("test", session_factory) as unit:
+        for _ in range(3):
+            _add("A")
+            with db_session() as db:
+                assert db is unit
+        assert unit.query(WhatsAppMessage).count() == 3
+
+    assert _count(session_factory) == 3
+    assert UNIT_CHECKOUTS.count(unit="test") == 1
+    assert UNIT_CHECKOUTS.sum(unit="test") == 1
+
+
+def test_unit_rolls_back_when_the_block_fails(session_factory):
+    with pytest.raises(RuntimeError), unit_of_work("test", session_factory):
+        _add("A")
+        raise RuntimeError("falla el LLM")
+
+    assert _count(session_factory) == 0
+
+
+def test_failing_step_only_rolls_back_its_own_savepoint(session_factory):
+    """Un paso que falla no descarta lo que otros pasos ya escribieron."""
+    with unit_of_work("test", session_factory):
+        _add("A")
+        with pytest.raises(RuntimeError), db_session() as db:
+            db.add(WhatsAppMessage(phone="B", message="hola", direction="in"))
+            db.flush()
+            raise RuntimeError("falla el UPDATE de la fase")
+        _add("C")
+
+    with db_session(session_factory) as db:
+        phones = [m.phone for m in db.query(WhatsAppMessage).order_by("id")]
+    assert phones == ["A", "C"]
+
+
+def test_after_commit_waits_for_the_unit_commit(session_factory):
+    """Las invalidaciones corren tras el commit de la unidad, no del paso."""
+    calls = []
+    with unit_of_work("test", session_factory):
+        with db_session() as db:
+            after_commit(db, lambda: calls.append("fase"))
+        assert calls == []
+        with pytest.raises(RuntimeError), db_session() as db:
+            after_commit(db, lambda: calls.append("deshecho"))
+            raise RuntimeError("falla el paso")
+    assert calls == ["fase"]
+
+    with pytest.raises(RuntimeError), unit_of_work("test", session_factory):
+        with db_session() as db:
+            after_commit(db, lambda: calls.append("unidad deshecha"))
+        raise RuntimeError("falla la unidad")
+    assert calls == ["fase"]
+
+
+def test_unit_reaches_steps_run_in_threads(session_factory):
+    """``asyncio.to_thread`` copia el contexto: el paso usa la sesión de la unidad."""
+
+    async def run():
+        with unit_of_work("test", session_factory) as unit:
+            seen = await asyncio.to_thread(_session_in_step)
+            assert seen is unit
+
+    def _session_in_step():
+        with db_session() as db:
+            return db
+
+    asyncio.run(run())
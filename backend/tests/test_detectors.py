@@ -0,0 +1,86 @@
+import asyncio
+import threading
+
+from utils.ai import detector_audio, detector_image
+
+
+class _FakeHttpClient:
+    def __init__(self) -> None:
+        self.kwargs = None
+
+    async def post(self, url, **kwargs):
+        self.kwargs = kwargs
+        return _FakeResponse()
+
+
+class _FakeResponse:
+    status_code = 200
+
+    def json(self):
+        return {"results": [{"alternatives": [{"transcript": "hola"}]}]}
+
+
+def test_async_transcription_encodes_off_the_loop_with_a_bounded_timeout(
+    monkeypatch,
+):
+    """El base64 del audio va a un hilo y la petición tiene timeout."""
+    threads = []
+    speech_request = detector_audio._speech_request
+
+    def recording_request(audio_bytes):
+        threads.append(threading.current_thread())
+        return speech_request(audio_bytes)
+
+    client = _FakeHttpClient()
+    monkeypatch.setenv("GOOGLE_API_KEY", "key")
+    monkeypatch.setattr(detector_audio, "_speech_request", recording_request)
+    monkeypatch.setattr(detector_audio, "get_async_client", lambda: client)
+
+    text = asyncio.run(detector_audio.transcribir_audio_async(b"ogg"))
+
+    assert text == "hola"
+    assert threads and threads[0] is not threading.main_thread()
+    assert client.kwargs["timeout"] == detector_audio.SPEECH_TO_TEXT_TIMEOUT
+    assert client.kwargs["timeout"] is not None
+
+
+class _FakeMessage:
+    content = '```json\n[{"alimento": "arroz"}]\n```'
+
+
+class _FakeLLM:
+    async def ainvoke(self, messages):
+        return _FakeMessage()
+
+
+def test_async_image_detection_decodes_and_encodes_off_the_loop(monkeypatch):
+    """PIL y el base64 de la imagen corren en hilos, no en el event loop."""
+    threads = {}
+
+    def recording(name, fn):
+        def wrapper(*args):
+            threads[name] = threading.current_thread()
+            return fn(*args)
+
+        return wrapper
+
+    async def fake_acall_model(model, priority, fn, *args):
+        return await fn(*args)
+
+    monkeypatch.setenv("GEMINI_API_KEY", "key")
+    monkeypatch.setattr(
+        detector_image, "_detect_mime", recording("mime", lambda data: "image/png")
+    )
+    monkeypatch.setattr(
+        detector_image,
+        "_detection_message",
+        recording("message", lambda data, mime_type: mime_type),
+    )
+    monkeypatch.setattr(detector_image, "detection_llm", lambda key: _FakeLLM())
+    monkeypatch.setattr(detector_image, "acall_model", fake_acall_model)
+
+    result = asyncio.run(detector_image.detectar_auto_async(b"png"))
+
+    assert result == '[{"alimento": "arroz"}]'
+    assert set(threads) == {"mime", "message"}
+    assert all(t is not threading.main_thread() for t in threads.values())
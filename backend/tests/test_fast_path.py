@@ -0,0 +1,67 @@
+import pytest
+
+from utils import langchain as lc_mod
+from utils import whatsapp as wa_mod
+from utils.conversation_state import InMemoryConversationStateStore
+from utils.fast_path import FAST_PATH_REPLIES, classify_intent, fast_reply
+from utils.metrics import REGISTRY
+
+
+@pytest.fixture(autouse=True)
+def clear_metrics():
+    REGISTRY.clear()
+    yield
+    REGISTRY.clear()
+
+
+@pytest.mark.parametrize(
+    ("text", "intent"),
+    [
+        ("gracias", "thanks"),
+        ("Muchas graciasss!!", "thanks"),
+        ("ok 👍", "ack"),
+        ("jajaja", "ack"),
+        ("Ok gracias, chao", "bye"),
+        ("Adiós", "bye"),
+        ("👍🏽", "emoji"),
+        ("❤️", "emoji"),
+        ("Hola", None),
+        ("Buenos días", None),
+        ("gracias, ¿y qué ceno?", None),
+        ("sí", None),
+        ("hoy comí arepa", None),
+    ],
+)
+def test_classify_intent(text, intent):
+    assert classify_intent(text) == intent
+
+
+def test_ack_after_a_question_goes_to_the_llm():
+    """Un "ok" a "¿Te preparo una receta?" es una respuesta, no un cierre."""
+    question = lambda: "¿Quieres que te pase una receta?"  # noqa: E731
+
+    assert fast_reply("ok", question) is None
+    assert fast_reply("👍", question) is None
+    assert fast_reply("gracias", question) is not None
+    assert fast_reply("ok", lambda: "¡Perfecto! 😊") is not None
+    assert FAST_PATH_REPLIES.value(intent="thanks") == 1
+    assert FAST_PATH_REPLIES.value(intent="ack") == 1
+
+
+def test_trivial_reply_skips_gemini_and_is_remembered(monkeypatch):
+    store = InMemoryConversationStateStore()
+    store.save("573001112233", "Le gusta caminar.", [("in", "hola"), ("out", "¡Hola!")])
+    monkeypatch.setattr(lc_mod, "_state_store", store)
+    monkeypatch.setattr(lc_mod, "USER_SESSIONS", lc_mod.SessionCache("test"))
+
+    def no_context(phone):
+        raise AssertionError("no debe cargar el perfil ni llamar al LLM")
+
+    monkeypatch.setattr(wa_mod, "_load_reply_context", no_context)
+
+    reply = wa_mod.build_whatsapp_reply("gracias!", "573001112233")
+
+    snapshot = store.load("573001112233")
+    assert snapshot.summary == "Le gusta caminar."
+    assert snapshot.turns[-2:] == [("in", "gracias!"), ("out", reply)]
+    assert wa_mod.REPLY_PATHS.value(path="fast_path") == 1
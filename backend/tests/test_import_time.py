@@ -0,0 +1,80 @@
+import os
+import subprocess
+import sys
+import types
+
+import pytest
+
+import importtime
+from utils.lazy import lazy_imports
+
+
+def test_app_import_does_not_load_heavy_dependencies():
+    """Importar la app no carga LangChain, Gemini, Cloud Storage, PIL ni Chroma."""
+    records = importtime.measure("app")
+
+    assert records, "python -X importtime no produjo registros"
+    assert importtime.heavy_imports(records) == []
+
+
+@pytest.mark.skipif(
+    importtime.IMPORT_TIME_BUDGET_MS is None,
+    reason="presupuesto de tiempo opcional: definir IMPORT_TIME_BUDGET_MS",
+)
+def test_app_import_fits_the_time_budget():
+    """Con ``IMPORT_TIME_BUDGET_MS`` definido, la importación cabe en él."""
+    records = importtime.measure("app")
+
+    assert importtime.total_ms(records) <= importtime.IMPORT_TIME_BUDGET_MS
+
+
+def test_app_import_starts_no_threads():
+    """Importar la app (p. ej. ``flask --app app init-db``) no arranca hilos."""
+    code = "import threading, app; print(sorted(t.name for t in threading.enumerate()))"
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=os.path.dirname(os.path.abspath(importtime.__file__)),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    assert result.stdout.strip() == "['MainThread']"
+
+
+def test_parse_importtime_reads_self_cumulative_and_depth():
+    output = (
+        "import time: self [us] | cumulative | imported package\n"
+        "import time:       120 |        150 |   json.decoder\n"
+        "import time:        30 |        180 | json\n"
+    )
+    records = importtime.parse_importtime(output)
+
+    assert [(r.module, r.self_us, r.cumulative_us, r.depth) for r in records] == [
+        ("json.decoder", 120, 150, 1),
+        ("json", 30, 180, 0),
+    ]
+
+
+def test_lazy_imports_load_on_first_use_and_respect_overrides(monkeypatch):
+    """Los nombres se importan al usarse y no pisan un reemplazo existente."""
+    fake = types.ModuleType("_victoria_fake_heavy")
+    fake.Heavy = object()
+    monkeypatch.setitem(sys.modules, "_victoria_fake_heavy", fake)
+
+    module_globals = {"__name__": "demo"}
+    load, getattr_ = lazy_imports(
+        module_globals,
+        {"Heavy": "_victoria_fake_heavy:Heavy", "mod": "_victoria_fake_heavy"},
+    )
+    assert "Heavy" not in module_globals
+
+    assert getattr_("Heavy") is fake.Heavy
+    assert module_globals["Heavy"] is fake.Heavy
+
+    module_globals["mod"] = "reemplazo"
+    load()
+    assert module_globals["mod"] == "reemplazo"
+
+    with pytest.raises(AttributeError):
+        getattr_("Otro")
@@ -0,0 +1,338 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, update
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from db.db import WebhookJob
+from services.whatsapp_pipeline import SEEN_MESSAGE_IDS, enqueue_webhook_messages
+from utils.jobs import (
+    DEAD,
+    DONE,
+    PENDING,
+    RUNNING,
+    AsyncWorkerPool,
+    SQLJobStore,
+    WorkerPool,
+)
+
+
+@pytest.fixture
+def session_factory():
+    """Tabla ``webhook_jobs`` sobre SQLite en memoria, compartida entre sesiones."""
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    WebhookJob.__table__.create(engine)
+    SEEN_MESSAGE_IDS.clear()
+    yield sessionmaker(bind=engine, autoflush=False, autocommit=False)
+    SEEN_MESSAGE_IDS.clear()
+    engine.dispose()
+
+
+def _status(session_factory, job_id):
+    db = session_factory()
+    try:
+        return db.get(WebhookJob, job_id)
+    finally:
+        db.close()
+
+
+def test_worker_processes_enqueued_job(session_factory):
+    """Un trabajo encolado se entrega al handler de su tipo y queda 'done'."""
+    store = SQLJobStore(session_factory=session_factory)
+    received = []
+    pool = WorkerPool(store, {"echo": received.append}, workers=0)
+
+    job_id = store.enqueue("echo", {"from": "573001112233", "type": "text"})
+
+    assert pool.run_once() is True
+    assert received == [{"from": "573001112233", "type": "text"}]
+    assert _status(session_factory, job_id).status == DONE
+    # Cola vacía
+    assert pool.run_once() is False
+
+
+def test_failed_job_is_retried_with_backoff_then_dead_lettered(session_factory):
+    """Los fallos reprograman el trabajo y, agotados los intentos, va a dead-letter."""
+    store = SQLJobStore(
+        session_factory=session_factory, max_attempts=2, backoff_seconds=0
+    )
+    calls = []
+
+    def boom(payload):
+        calls.append(payload)
+        raise RuntimeError("Gemini no responde")
+
+    pool = WorkerPool(store, {"boom": boom}, workers=0)
+    job_id = store.enqueue("boom", {"n": 1})
+
+    assert pool.run_once() is True
+    job = _status(session_factory, job_id)
+    assert job.status == PENDING
+    assert job.attempts == 1
+    assert "Gemini no responde" in job.last_error
+
+    assert pool.run_once() is True
+    assert _status(session_factory, job_id).status == DEAD
+    assert len(calls) == 2
+    assert [j["id"] for j in store.dead_letters()] == [job_id]
+
+    # Se puede re-encolar manualmente desde la dead-letter
+    store.requeue(job_id)
+    assert _status(session_factory, job_id).status == PENDING
+
+
+def test_claim_is_exclusive(session_factory):
+    """Un trabajo reclamado no puede volver a reclamarse mientras está en curso."""
+    store = SQLJobStore(session_factory=session_factory)
+    store.enqueue("echo", {})
+
+    first = store.claim()
+    assert first is not None
+    assert first.attempts == 1
+    assert store.claim() is None
+
+
+def test_finished_jobs_are_purged_after_their_retention(session_factory):
+    """'done' y 'dead' vencidos se borran por tandas; lo demás se conserva."""
+    store = SQLJobStore(
+        session_factory=session_factory,
+        done_ttl=3600,
+        dead_ttl=7 * 24 * 3600,
+        purge_batch_size=2,
+    )
+    now = datetime.utcnow()
+    ages = {
+        (DONE, 2): 5,  # 5 'done' de hace 2 h: vencidos
+        (DONE, 0): 1,  # recién terminado
+        (DEAD, 2): 1,  # dead-letter aún dentro de su retención
+        (DEAD, 24 * 8): 1,
+        (PENDING, 24 * 8): 1,  # viejo pero sin terminar
+        (RUNNING, 24 * 8): 1,
+    }
+    db = session_factory()
+    try:
+        for (status, hours), count in ages.items():
+            ids = store.enqueue_many("echo", [({}, None, None)] * count)
+            db.execute(
+                update(WebhookJob)
+                .where(WebhookJob.id.in_(ids))
+                .values(status=status, updated_at=now - timedelta(hours=hours))
+            )
+        db.commit()
+    finally:
+        db.close()
+
+    assert store.purge_finished(now) == 6
+    assert store.counts() == {DONE: 1, DEAD: 1, PENDING: 1, RUNNING: 1}
+    assert store.purge_finished(now) == 0
+
+
+def test_purge_runs_at_most_once_per_interval(session_factory, monkeypatch):
+    store = SQLJobStore(session_factory=session_factory, purge_interval=300)
+    runs = []
+    monkeypatch.setattr(store, "purge_finished", lambda: runs.append(1) or 0)
+    clock = [1000.0]
+    monkeypatch.setattr("utils.jobs.time.monotonic", lambda: clock[0])
+
+    store.purge_if_due()
+    store.purge_if_due()
+    clock[0] += 301
+    store.purge_if_due()
+
+    assert len(runs) == 2
+
+
+def _msg(phone, body, ts):
+    return {
+        "from": phone,
+        "id": f"wamid.{phone}.{ts}",
+        "timestamp": str(ts),
+        "type": "text",
+        "text": {"body": body},
+    }
+
+
+def test_enqueue_webhook_messages_fans_out_whole_delivery(session_factory):
+    """Todos los mensajes de todas las entries/changes se encolan, no solo el primero."""
+    payload = {
+        "entry": [
+            {
+                "changes": [
+                    {"value": {"messages": [_msg("A", "hola", 1), _msg("A", "ok", 2)]}},
+                    {"value": {"statuses": [{"id": "x"}]}},
+                ]
+            },
+            {"changes": [{"value": {"messages": [_msg("B", "buenas", 1)]}}]},
+        ]
+    }
+    store = SQLJobStore(session_factory=session_factory)
+
+    job_ids = enqueue_webhook_messages(store, payload)
+
+    assert len(job_ids) == 3
+    db = session_factory()
+    try:
+        jobs = db.query(WebhookJob).order_by(WebhookJob.id).all()
+        assert [j.partition_key for j in jobs] == ["A", "B", "A"]
+        assert [j.payload["text"]["body"] for j in jobs] == ["hola", "buenas", "ok"]
+    finally:
+        db.close()
+
+
+def test_claim_keeps_order_within_phone_and_parallelism_across_phones(
+    session_factory,
+):
+    """Mientras un mensaje de A está en curso, solo se puede avanzar con B."""
+    store = SQLJobStore(session_factory=session_factory)
+    a1, a2, b1 = store.enqueue_many(
+        "echo",
+        [({"n": "a1"}, "A", None), ({"n": "a2"}, "A", None), ({"n": "b1"}, "B", None)],
+    )
+
+    first = store.claim()
+    second = store.claim()
+    assert (first.id, second.id) == (a1, b1)
+    # a2 espera a que a1 termine
+    assert store.claim() is None
+
+    store.complete(a1)
+    assert store.claim().id == a2
+
+
+def test_retrying_job_blocks_later_jobs_of_same_phone(session_factory):
+    """Un trabajo en backoff sigue bloqueando a los posteriores de su teléfono."""
+    store = SQLJobStore(session_factory=session_factory, backoff_seconds=60)
+    a1, a2 = store.enqueue_many("echo", [({}, "A", None), ({}, "A", None)])
+
+    job = store.claim()
+    assert job.id == a1
+    store.fail(job, "timeout")
+
+    assert store.claim() is None
+
+
+def test_redelivered_message_is_enqueued_only_once(session_factory):
+    """Una re-entrega de Meta no crea un segundo trabajo, ni con la caché vacía."""
+    payload = {
+        "entry": [{"changes": [{"value": {"messages": [_msg("A", "hola", 1)]}}]}]
+    }
+    store = SQLJobStore(session_factory=session_factory)
+
+    assert len(enqueue_webhook_messages(store, payload)) == 1
+    # Cortocircuito en la caché en memoria
+    assert enqueue_webhook_messages(store, payload) == []
+
+    # Otro proceso (caché vacía): la columna única dedup_key lo detecta
+    SEEN_MESSAGE_IDS.clear()
+    assert enqueue_webhook_messages(store, payload) == []
+
+    db = session_factory()
+    try:
+        assert db.query(WebhookJob).count() == 1
+    finally:
+        db.close()
+
+
+def test_debounce_window_slides_for_pending_jobs_of_same_phone(session_factory):
+    """Un mensaje nuevo aplaza los pendientes de su teléfono para fusionarlos."""
+    store = SQLJobStore(session_factory=session_factory)
+    (a1,) = store.enqueue_many("echo", [({}, "A", None)], debounce_seconds=60)
+    (b1,) = store.enqueue_many("echo", [({}, "B", None)], debounce_seconds=60)
+    first = _status(session_factory, a1).available_at
+
+    store.enqueue_many("echo", [({}, "A", None)], debounce_seconds=120)
+
+    assert _status(session_factory, a1).available_at > first
+    # Otros teléfonos no se ven afectados
+    assert (
+        _status(session_factory, b1).available_at
+        < _status(session_factory, a1).available_at
+    )
+    # Nada disponible aún
+    assert store.claim() is None
+
+
+def test_worker_coalesces_burst_of_same_phone_into_one_batch(session_factory):
+    """Los mensajes pendientes de un teléfono llegan juntos al batch handler."""
+    store = SQLJobStore(session_factory=session_factory)
+    store.enqueue_many(
+        "msg",
+        [
+            ({"n": "a1"}, "A", None),
+            ({"n": "a2"}, "A", None),
+            ({"n": "b1"}, "B", None),
+            ({"n": "a3"}, "A", None),
+        ],
+    )
+    batches = []
+    pool = WorkerPool(
+        store, batch_handlers={"msg": batches.append}, batch_size=10, workers=0
+    )
+
+    assert pool.run_once() is True
+    assert pool.run_once() is True
+    assert pool.run_once() is False
+
+    assert batches == [
+        [{"n": "a1"}, {"n": "a2"}, {"n": "a3"}],
+        [{"n": "b1"}],
+    ]
+
+
+def test_async_pool_processes_batches_of_many_phones_concurrently(session_factory):
+    """El pool asíncrono mantiene en vuelo un lote por teléfono a la vez."""
+    store = SQLJobStore(session_factory=session_factory)
+    store.enqueue_many("msg", [({"n": n}, f"phone-{n}", None) for n in range(30)])
+    handled = []
+
+    async def slow_handler(payloads):
+        await asyncio.sleep(0.2)
+        handled.extend(p["n"] for p in payloads)
+
+    pool = AsyncWorkerPool(
+        store,
+        batch_handlers={"msg": slow_handler},
+        batch_size=10,
+        concurrency=50,
+        poll_interval=0.01,
+        db_threads=1,
+    )
+    started = time.perf_counter()
+    pool.start()
+    try:
+        # Solo se mira ``handled``: SQLite en memoria no admite otro hilo de BD
+        while len(handled) < 30 and time.perf_counter() - started < 5:
+            time.sleep(0.02)
+    finally:
+        # stop() espera a los lotes en vuelo (y a que se marquen como 'done')
+        pool.stop(timeout=5)
+    elapsed = time.perf_counter() - started
+
+    assert sorted(handled) == list(range(30))
+    assert store.counts() == {DONE: 30}
+    # En serie serían 6 s
+    assert elapsed < 2.0
+
+
+def test_async_pool_failure_goes_through_retry_policy(session_factory):
+    """Un fallo en un handler asíncrono sigue la misma política de reintentos."""
+    store = SQLJobStore(session_factory=session_factory, backoff_seconds=60)
+    job_id = store.enqueue("boom", {})
+
+    async def boom(payload):
+        raise RuntimeError("Gemini no responde")
+
+    pool = AsyncWorkerPool(store, {"boom": boom})
+
+    assert asyncio.run(pool.run_once()) is True
+    job = _status(session_factory, job_id)
+    assert job.status == PENDING
+    assert "Gemini no responde" in job.last_error
+    assert asyncio.run(pool.run_once()) is False
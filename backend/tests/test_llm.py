@@ -0,0 +1,91 @@
+import threading
+
+import pytest
+
+import utils.llm as llm_mod
+from utils.llm import LLM_CLIENT_LOOKUPS, LLM_CLIENTS, clear_chat_models, get_chat_model
+from utils.metrics import REGISTRY
+
+
+class _FakeModel:
+    created = 0
+
+    def __init__(self, **kwargs):
+        type(self).created += 1
+        self.kwargs = kwargs
+
+
+@pytest.fixture(autouse=True)
+def empty_registry():
+    """Cada prueba parte de un registro y unas métricas vacíos."""
+    clear_chat_models()
+    REGISTRY.clear()
+    _FakeModel.created = 0
+    yield
+    clear_chat_models()
+
+
+def test_chat_model_is_built_once_per_configuration():
+    """El mismo modelo, temperatura y api key devuelven la misma instancia."""
+    a = get_chat_model(_FakeModel, model="m", temperature=0.1, api_key="k")
+    b = get_chat_model(_FakeModel, api_key="k", temperature=0.1, model="m")
+    c = get_chat_model(_FakeModel, model="m", temperature=0.6, api_key="k")
+    d = get_chat_model(_FakeModel, model="m", temperature=0.1, api_key="otra")
+
+    assert a is b
+    assert len({id(a), id(c), id(d)}) == 3
+    assert c.kwargs == {"model": "m", "temperature": 0.6, "api_key": "k"}
+
+
+def test_lookups_are_counted_as_hits_and_misses():
+    for _ in range(3):
+        get_chat_model(_FakeModel, model="gemini-2.0-flash", temperature=0.6)
+
+    assert LLM_CLIENT_LOOKUPS.value(model="gemini-2.0-flash", result="miss") == 1
+    assert LLM_CLIENT_LOOKUPS.value(model="gemini-2.0-flash", result="hit") == 2
+    assert LLM_CLIENTS.value() == 1
+    assert "victoria_llm_client_lookups_total" in REGISTRY.render()
+
+
+def test_concurrent_first_use_builds_a_single_client():
+    """Muchos hilos pidiendo el mismo modelo a la vez crean un solo cliente."""
+    barrier = threading.Barrier(16)
+    results = []
+
+    def worker():
+        barrier.wait()
+        results.append(get_chat_model(_FakeModel, model="m", temperature=0.3))
+
+    threads = [threading.Thread(target=worker) for _ in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert _FakeModel.created == 1
+    assert len({id(r) for r in results}) == 1
+
+
+def test_clients_are_rebuilt_in_a_forked_process(monkeypatch):
+    first = get_chat_model(_FakeModel, model="m")
+    monkeypatch.setattr(llm_mod, "_pid", llm_mod._pid + 1)
+
+    assert get_chat_model(_FakeModel, model="m") is not first
+
+
+def test_gemini_chat_clients_do_not_retry_internally(monkeypatch):
+    """Los 429 llegan al limitador en vez de reintentarse dentro del cliente."""
+    import utils.ai.detector_image as detector_mod
+    import utils.chroma_db as chroma_mod
+    import utils.langchain as lc_mod
+
+    for mod in (lc_mod, detector_mod, chroma_mod):
+        monkeypatch.setattr(mod, "ChatGoogleGenerativeAI", _FakeModel, raising=False)
+
+    clients = [
+        lc_mod.conversation_llm(),
+        detector_mod.detection_llm("k"),
+        chroma_mod._llm(),
+    ]
+
+    assert [c.kwargs["max_retries"] for c in clients] == [1, 1, 1]
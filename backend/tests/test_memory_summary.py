@@ -0,0 +1,116 @@
+import threading
+
+import pytest
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+import utils.memory_summary as ms_mod
+from utils import langchain as lc_mod
+from utils.memory_summary import (
+    MEMORY_SUMMARIES,
+    schedule_summary,
+    summarize_memory,
+)
+from utils.metrics import REGISTRY, STAGE_DURATION
+
+
+@pytest.fixture(autouse=True)
+def clear_metrics():
+    REGISTRY.clear()
+    yield
+    REGISTRY.clear()
+
+
+def _memory(limit: int = 10, responses=("resumen nuevo",)):
+    lc_mod._load("ConversationSummaryBufferMemory")
+    return lc_mod._deferred_summary_memory(
+        llm=FakeListChatModel(responses=list(responses)),
+        max_token_limit=limit,
+        return_messages=True,
+    )
+
+
+def test_reply_path_does_not_summarize():
+    """save_context (dentro de chain.predict) ya no llama al LLM de resumen."""
+    memory = _memory(limit=5)
+    memory.save_context({"input": "hola " * 50}, {"output": "respuesta " * 50})
+
+    assert len(memory.chat_memory.messages) == 2
+    assert memory.moving_summary_buffer == ""
+
+
+def test_summarize_memory_trims_oldest_turns_into_the_summary():
+    memory = _memory(limit=10)
+    memory.save_context({"input": "a" * 40}, {"output": "b" * 40})
+    memory.save_context({"input": "corto"}, {"output": "ok"})
+
+    assert summarize_memory(memory) == "applied"
+    assert memory.moving_summary_buffer == "resumen nuevo"
+    assert [m.content for m in memory.chat_memory.messages] == ["corto", "ok"]
+    assert summarize_memory(memory) == "skipped"
+
+
+class _Message:
+    def __init__(self, content: str) -> None:
+        self.content = content
+
+
+class _ChatHistory:
+    def __init__(self, messages) -> None:
+        self.messages = messages
+
+
+class _RacingMemory:
+    """Memoria cuyo resumen cambia mientras el LLM trabaja (otro resumen ganó)."""
+
+    max_token_limit = 1
+
+    def __init__(self) -> None:
+        self.moving_summary_buffer = ""
+        self.chat_memory = _ChatHistory([_Message("x" * 40), _Message("y" * 40)])
+
+    def predict_new_summary(self, messages, summary):
+        self.moving_summary_buffer = "otro resumen"
+        return "resumen perdido"
+
+
+def test_summary_is_discarded_if_memory_changed_meanwhile():
+    memory = _RacingMemory()
+
+    assert summarize_memory(memory) == "stale"
+    assert memory.moving_summary_buffer == "otro resumen"
+    assert len(memory.chat_memory.messages) == 2
+
+
+def test_schedule_summary_runs_off_the_reply_path(monkeypatch):
+    """El resumen corre en otro hilo, se guarda el estado y se mide aparte."""
+    memory = _memory(limit=10)
+    memory.save_context({"input": "a" * 80}, {"output": "b" * 80})
+    saved = threading.Event()
+    release = threading.Event()
+    original_run = ms_mod._run
+
+    def slow_run(phone):
+        release.wait(5)
+        original_run(phone)
+
+    monkeypatch.setattr(ms_mod, "session_memory", lambda phone: memory)
+    monkeypatch.setattr(ms_mod, "save_conversation_state", lambda p: saved.set())
+    monkeypatch.setattr(ms_mod, "_run", slow_run)
+
+    assert schedule_summary("573001112233") is True
+    # Ya hay un resumen en curso para ese teléfono
+    assert schedule_summary("573001112233") is False
+    release.set()
+
+    assert saved.wait(5)
+    assert memory.moving_summary_buffer == "resumen nuevo"
+    assert MEMORY_SUMMARIES.value(result="applied") == 1
+    assert STAGE_DURATION.count(stage="memory_summary", msg_type="summary") == 1
+
+
+def test_schedule_summary_skips_small_buffers(monkeypatch):
+    memory = _memory(limit=1000)
+    memory.save_context({"input": "hola"}, {"output": "¡Hola!"})
+    monkeypatch.setattr(ms_mod, "session_memory", lambda phone: memory)
+
+    assert schedule_summary("573001112233") is False
@@ -0,0 +1,121 @@
+import json
+import os
+
+import pytest
+
+import utils.metrics as metrics_mod
+from utils.metrics import (
+    REGISTRY,
+    STAGE_DURATION,
+    STAGE_ERRORS,
+    MetricsRegistry,
+    labels,
+    render_prometheus,
+    span,
+    write_snapshot,
+)
+
+
+@pytest.fixture(autouse=True)
+def clear_metrics():
+    """Limpia los valores registrados entre pruebas."""
+    REGISTRY.clear()
+    yield
+    REGISTRY.clear()
+
+
+def test_span_records_duration_per_stage_and_message_type():
+    """Un span observa su duración con el msg_type heredado del contexto."""
+    with labels(msg_type="image"):
+        with span("gemini_image") as s:
+            pass
+
+    assert s.elapsed >= 0
+    assert STAGE_DURATION.count(stage="gemini_image", msg_type="image") == 1
+    assert STAGE_DURATION.count(stage="gemini_image", msg_type="text") == 0
+
+
+def test_span_counts_errors_and_reraises():
+    """Si la etapa falla se cuenta el error y la excepción se propaga."""
+    with pytest.raises(TimeoutError):
+        with span("graph_send", msg_type="text"):
+            raise TimeoutError("Graph API")
+
+    assert STAGE_ERRORS.value(stage="graph_send", msg_type="text") == 1
+    assert STAGE_DURATION.count(stage="graph_send", msg_type="text") == 1
+
+
+def test_render_prometheus_exposes_cumulative_histogram():
+    """El texto expuesto en /metrics sigue el formato de Prometheus."""
+    STAGE_DURATION.observe(0.02, stage="db_profile_lookup", msg_type="text")
+    STAGE_DURATION.observe(3.0, stage="db_profile_lookup", msg_type="text")
+
+    text = render_prometheus()
+
+    assert "# TYPE victoria_stage_duration_seconds histogram" in text
+    prefix = 'victoria_stage_duration_seconds_bucket{stage="db_profile_lookup",msg_type="text",'
+    assert f'{prefix}le="0.01"}} 0' in text
+    assert f'{prefix}le="0.025"}} 1' in text
+    assert f'{prefix}le="5"}} 2' in text
+    assert f'{prefix}le="+Inf"}} 2' in text
+    assert (
+        'victoria_stage_duration_seconds_count{stage="db_profile_lookup",msg_type="text"} 2'
+        in text
+    )
+
+
+def _other_worker(directory, name: str) -> None:
+    """Volcado de otro worker de gunicorn con su propio registro."""
+    other = MetricsRegistry()
+    other.counter(STAGE_ERRORS.name, "", STAGE_ERRORS.labelnames).inc(
+        2, stage="graph_send", msg_type="text"
+    )
+    other.histogram(STAGE_DURATION.name, "", STAGE_DURATION.labelnames).observe(
+        3.0, stage="gemini_chat", msg_type="text"
+    )
+    other.gauge("victoria_llm_clients", "").set(4)
+    other.gauge("victoria_queue_jobs", "", ("status",), per_process=False).set(
+        99, status="pending"
+    )
+    with open(directory / f"{name}.json", "w", encoding="utf-8") as f:
+        json.dump(other.snapshot(), f)
+
+
+def test_metrics_are_summed_across_gunicorn_workers(tmp_path, monkeypatch):
+    """Cualquier worker que atienda el scrape devuelve el total de todos."""
+    monkeypatch.setattr(metrics_mod, "METRICS_MULTIPROC_DIR", str(tmp_path))
+    _other_worker(tmp_path, "41-1")
+    STAGE_ERRORS.inc(stage="graph_send", msg_type="text")
+    STAGE_DURATION.observe(0.02, stage="gemini_chat", msg_type="text")
+    REGISTRY.gauge("victoria_llm_clients", "").set(1)
+    queue = REGISTRY.gauge("victoria_queue_jobs", "", ("status",), per_process=False)
+    queue.set(3, status="pending")
+
+    text = render_prometheus()
+
+    assert 'victoria_stage_errors_total{stage="graph_send",msg_type="text"} 3' in text
+    assert (
+        'victoria_stage_duration_seconds_count{stage="gemini_chat",msg_type="text"} 2'
+        in text
+    )
+    # Gauges: una serie por proceso, salvo los que se calculan al servir /metrics
+    assert 'victoria_llm_clients{pid="41"} 4' in text
+    assert f'victoria_llm_clients{{pid="{os.getpid()}"}} 1' in text
+    assert 'victoria_queue_jobs{status="pending"} 3' in text
+    assert "99" not in text
+
+
+def test_exited_worker_keeps_its_counters_but_not_its_gauges(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics_mod, "METRICS_MULTIPROC_DIR", str(tmp_path))
+    monkeypatch.setattr(metrics_mod, "_snapshot_name", None)
+    STAGE_ERRORS.inc(stage="graph_send", msg_type="text")
+    REGISTRY.gauge("victoria_llm_clients", "").set(1)
+
+    # Como en el hook worker_exit de gunicorn
+    write_snapshot(str(tmp_path), gauges=False)
+    REGISTRY.clear()
+    monkeypatch.setattr(metrics_mod, "_snapshot_name", None)
+
+    text = render_prometheus()
+    assert 'victoria_stage_errors_total{stage="graph_send",msg_type="text"} 1' in text
+    assert "victoria_llm_clients{" not in text
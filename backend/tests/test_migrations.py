@@ -0,0 +1,162 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, func, inspect, select, text
+from sqlalchemy.pool import StaticPool
+
+from db.db import (
+    Base,
+    ConversationStats,
+    FoodRegister,
+    UserProfile,
+    WhatsAppMessage,
+)
+from db.migrations import MIGRATIONS, migrate
+
+
+@pytest.fixture
+def engine():
+    """SQLite en memoria vacía, compartida entre conexiones."""
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    yield engine
+    engine.dispose()
+
+
+def _plan(engine, query) -> str:
+    compiled = query.compile(engine, compile_kwargs={"literal_binds": True})
+    with engine.connect() as conn:
+        rows = conn.execute(text(f"EXPLAIN QUERY PLAN {compiled}")).all()
+    return "\n".join(row[-1] for row in rows)
+
+
+def test_migrate_is_versioned_and_idempotent(engine):
+    """Una base vacía llega a la última versión y volver a migrar no hace nada."""
+    versions = [m.version for m in MIGRATIONS]
+
+    assert migrate(engine) == versions
+    assert migrate(engine) == []
+
+    with engine.connect() as conn:
+        recorded = conn.execute(
+            text("SELECT version FROM schema_migrations ORDER BY version")
+        ).scalars()
+        assert list(recorded) == versions
+
+
+def test_migrations_build_the_schema_of_the_models(engine):
+    """
+    Las migraciones están fijadas (no leen los modelos), así que un cambio en
+    ``db.db`` sin su migración nueva deja de coincidir aquí.
+    """
+    migrate(engine)
+
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        columns = {c["name"] for c in inspector.get_columns(table.name)}
+        indexes = {i["name"] for i in inspector.get_indexes(table.name)}
+        assert columns == {c.name for c in table.columns}, table.name
+        assert {i.name for i in table.indexes} <= indexes, table.name
+
+
+def test_legacy_database_is_upgraded_in_place(engine):
+    """Una base creada antes de las migraciones recibe columnas e índices nuevos."""
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "CREATE TABLE whatsapp_messages ("
+                "id INTEGER PRIMARY KEY, phone VARCHAR(32) NOT NULL, "
+                "message VARCHAR(4096) NOT NULL, direction VARCHAR(8) NOT NULL, "
+                "media_url VARCHAR(2048), media_id VARCHAR(128), "
+                "media_type VARCHAR(16), created_at DATETIME NOT NULL)"
+            )
+        )
+        conn.execute(
+            text("CREATE INDEX ix_whatsapp_messages_phone ON whatsapp_messages (phone)")
+        )
+
+    migrate(engine)
+
+    inspector = inspect(engine)
+    columns = {c["name"] for c in inspector.get_columns("whatsapp_messages")}
+    indexes = {i["name"] for i in inspector.get_indexes("whatsapp_messages")}
+    assert "wa_message_id" in columns
+    assert {
+        "ix_whatsapp_messages_phone_created_at",
+        "ix_whatsapp_messages_phone_id",
+        "ux_whatsapp_messages_wa_message_id",
+    } <= indexes
+    # Redundante con los compuestos
+    assert "ix_whatsapp_messages_phone" not in indexes
+
+
+def test_hot_queries_use_composite_indexes(engine):
+    """EXPLAIN QUERY PLAN: las consultas calientes usan índice y no ordenan en memoria."""
+    migrate(engine)
+
+    history = (
+        select(WhatsAppMessage)
+        .where(WhatsAppMessage.phone == "573001112233")
+        .order_by(WhatsAppMessage.created_at.asc())
+    )
+    plan = _plan(engine, history)
+    assert "ix_whatsapp_messages_phone_created_at" in plan
+    assert "TEMP B-TREE" not in plan
+
+    page = (
+        select(WhatsAppMessage.id, WhatsAppMessage.message)
+        .where(WhatsAppMessage.phone == "573001112233", WhatsAppMessage.id < 500)
+        .order_by(WhatsAppMessage.id.desc())
+        .limit(50)
+    )
+    plan = _plan(engine, page)
+    assert "ix_whatsapp_messages_phone_id" in plan
+    assert "TEMP B-TREE" not in plan
+
+    profile = (
+        select(UserProfile)
+        .where(UserProfile.whatsapp_number == "573001112233")
+        .order_by(UserProfile.created_at.desc())
+        .limit(1)
+    )
+    plan = _plan(engine, profile)
+    assert "ix_user_profiles_whatsapp_number_created_at" in plan
+    assert "TEMP B-TREE" not in plan
+
+    daily = select(func.sum(FoodRegister.calorias)).where(
+        FoodRegister.user_profile_id == 7,
+        FoodRegister.timestamp >= datetime(2025, 1, 1),
+        FoodRegister.timestamp < datetime(2025, 1, 2),
+    )
+    plan = _plan(engine, daily)
+    assert "ix_food_register_user_profile_id_timestamp" in plan
+    assert "timestamp>" in plan.replace(" ", "")
+
+
+def test_conversation_stats_are_backfilled_from_history(engine):
+    migrate(engine, target=5)
+    with engine.begin() as conn:
+        for n, direction in enumerate(["in", "out", "in", "in", "out"], start=1):
+            conn.execute(
+                WhatsAppMessage.__table__.insert().values(
+                    id=n,
+                    phone="A" if n < 5 else "B",
+                    message=f"m{n}",
+                    direction=direction,
+                    created_at=datetime(2025, 1, 1, 12, n),
+                )
+            )
+
+    migrate(engine)
+
+    with engine.connect() as conn:
+        rows = conn.execute(
+            select(ConversationStats.__table__).order_by(ConversationStats.phone)
+        ).all()
+    assert [tuple(r) for r in rows] == [
+        ("A", 3, 1, 4, datetime(2025, 1, 1, 12, 4)),
+        ("B", 0, 1, 5, datetime(2025, 1, 1, 12, 5)),
+    ]
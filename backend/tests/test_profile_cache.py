@@ -0,0 +1,155 @@
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import utils.whatsapp as wa_mod
+from db.db import ConversationStats, UserProfile
+from db.migrations import migrate
+from services.client_registration import bulk_register
+from utils.metrics import REGISTRY
+from utils.profile_cache import (
+    PROFILE_CACHE,
+    PROFILE_CACHE_LOOKUPS,
+    ProfileCache,
+    ProfileSnapshot,
+)
+
+ANA = ProfileSnapshot(
+    id=1,
+    personality_stage="daily",
+    personality_profile=None,
+    user_profile={"full_name": "Ana Pérez"},
+)
+
+
+@pytest.fixture(autouse=True)
+def clean():
+    REGISTRY.clear()
+    PROFILE_CACHE.clear()
+    yield
+    PROFILE_CACHE.clear()
+
+
+def test_hits_and_negative_hits_skip_the_loader():
+    cache = ProfileCache(ttl=60, negative_ttl=60)
+    loads = []
+
+    def load(phone):
+        loads.append(phone)
+        return ANA if phone == "ana" else None
+
+    for _ in range(3):
+        assert cache.get_or_load("ana", load) is ANA
+        assert cache.get_or_load("nadie", load) is None
+
+    assert loads == ["ana", "nadie"]
+    assert PROFILE_CACHE_LOOKUPS.value(result="miss") == 2
+    assert PROFILE_CACHE_LOOKUPS.value(result="hit") == 2
+    assert PROFILE_CACHE_LOOKUPS.value(result="negative_hit") == 2
+
+
+def test_negative_entries_use_their_own_ttl():
+    cache = ProfileCache(ttl=60, negative_ttl=0)
+    loads = []
+
+    cache.get_or_load("nadie", lambda phone: loads.append(phone))
+    cache.get_or_load("nadie", lambda phone: loads.append(phone))
+
+    assert loads == ["nadie", "nadie"]
+
+
+def test_invalidation_during_a_load_is_not_overwritten():
+    cache = ProfileCache(ttl=60, negative_ttl=60)
+
+    def stale_load(phone):
+        # El perfil se registra mientras esta lectura está en curso
+        cache.invalidate(phone)
+        return None
+
+    assert cache.get_or_load("ana", stale_load) is None
+    assert cache.get_or_load("ana", lambda phone: ANA) is ANA
+
+
+def test_failed_loads_are_not_cached():
+    cache = ProfileCache()
+
+    def broken(phone):
+        raise RuntimeError("BD caída")
+
+    with pytest.raises(RuntimeError):
+        cache.get_or_load("ana", broken)
+    assert len(cache) == 0
+
+
+def test_registration_invalidates_the_negative_entry(monkeypatch):
+    """Un número que escribió antes de registrarse ve su perfil al registrarse."""
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    migrate(engine)
+    session_factory = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+    monkeypatch.setattr(wa_mod, "SessionLocal", session_factory)
+    queries = []
+    event.listen(
+        engine,
+        "before_cursor_execute",
+        lambda conn, cursor, sql, *args: queries.append(sql),
+    )
+
+    assert wa_mod._load_reply_context("573001")[1] is None
+    bulk_register(
+        [{"profile": {"full_name": "Ana Pérez", "whatsapp_number": "573001"}}],
+        session_factory=session_factory,
+    )
+    queries.clear()
+
+    profile, user_profile, stage = wa_mod._load_reply_context("573001")
+    assert user_profile["full_name"] == "Ana Pérez"
+    assert stage == "profiling"
+    assert len(queries) == 1
+
+    queries.clear()
+    assert wa_mod._load_reply_context("573001")[0] == profile
+    assert queries == []
+    engine.dispose()
+
+
+def test_stale_profiling_snapshot_skips_the_summary(monkeypatch):
+    """Otro worker ya pasó el perfil a 'daily': no se paga otro resumen."""
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    migrate(engine)
+    session_factory = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+    monkeypatch.setattr(wa_mod, "SessionLocal", session_factory)
+    bulk_register(
+        [{"profile": {"full_name": "Ana Pérez", "whatsapp_number": "573001"}}],
+        session_factory=session_factory,
+    )
+    # Caché de este proceso, aún en 'profiling'
+    stale = wa_mod._load_reply_context("573001")[0]
+    assert stale.personality_stage == "profiling"
+
+    with session_factory() as db:
+        db.add(ConversationStats(phone="573001", messages_in=6, messages_out=6))
+        db.query(UserProfile).update(
+            {"personality_stage": "daily", "personality_profile": "Resumen"}
+        )
+        db.commit()
+
+    summaries = []
+    monkeypatch.setattr(
+        wa_mod,
+        "summarize_personality",
+        lambda *args: summaries.append(args) or "Otro resumen",
+    )
+    wa_mod._update_personality_stage("573001", stale, {})
+
+    assert summaries == []
+    assert wa_mod._load_reply_context("573001")[2] == "daily"
+    engine.dispose()
@@ -0,0 +1,89 @@
+import pytest
+
+from utils import langchain as lc_mod
+
+PROFILE = {
+    "full_name": "Ana",
+    "age": 70,
+    "diseases": ["diabetes"],
+    "allergies": [],
+}
+
+
+class _FakeMemory:
+    def __init__(self, *args, **kwargs) -> None:
+        pass
+
+
+class _FakeChain:
+    def __init__(self, llm=None, memory=None, prompt=None, verbose=False) -> None:
+        self.prompt = prompt
+
+
+@pytest.fixture
+def builds(monkeypatch):
+    """Cuenta cuántas veces se arma un prompt de verdad."""
+    calls = []
+    original = lc_mod._build_prompt
+
+    def counting_build(*args):
+        calls.append(args)
+        return original(*args)
+
+    monkeypatch.setattr(lc_mod, "_build_prompt", counting_build)
+    monkeypatch.setattr(lc_mod, "ChatGoogleGenerativeAI", lambda **kw: object())
+    monkeypatch.setattr(lc_mod, "ConversationSummaryBufferMemory", _FakeMemory)
+    monkeypatch.setattr(lc_mod, "ConversationChain", _FakeChain)
+    monkeypatch.setattr(lc_mod, "_state_store", None)
+    lc_mod.USER_SESSIONS.clear()
+    lc_mod.PROMPT_CACHE.clear()
+    yield calls
+    lc_mod.USER_SESSIONS.clear()
+    lc_mod.PROMPT_CACHE.clear()
+
+
+def test_unchanged_profile_skips_prompt_rebuild(builds):
+    chain = lc_mod.get_user_chain("A", user_profile=dict(PROFILE))
+    prompt = chain.prompt
+
+    for _ in range(5):
+        assert lc_mod.get_user_chain("A", user_profile=dict(PROFILE)) is chain
+
+    assert chain.prompt is prompt
+    assert len(builds) == 1
+
+
+def test_profile_or_personality_change_rebuilds_prompt(builds):
+    chain = lc_mod.get_user_chain("A", user_profile=dict(PROFILE))
+
+    lc_mod.get_user_chain("A", user_profile={**PROFILE, "allergies": ["maní"]})
+    assert chain.prompt.partial_variables["allergies"] == "maní"
+
+    lc_mod.get_user_chain(
+        "A",
+        user_profile={**PROFILE, "allergies": ["maní"]},
+        personality_stage="daily",
+        personality_profile={"mood_baseline": "tranquilo"},
+    )
+    assert chain.prompt.partial_variables["mood_baseline"] == "tranquilo"
+    assert "NO es seguir investigando" in chain.prompt.template
+    assert len(builds) == 3
+
+
+def test_rebuilt_session_reuses_cached_prompt(builds):
+    first = lc_mod.get_user_chain("A", user_profile=dict(PROFILE))
+    lc_mod.USER_SESSIONS.pop("A")
+
+    second = lc_mod.get_user_chain("A", user_profile=dict(PROFILE))
+
+    assert second is not first
+    assert second.prompt is first.prompt
+    assert len(builds) == 1
+
+
+def test_profile_version_ignores_key_order():
+    a = lc_mod.profile_version({"age": 1, "full_name": "x"}, {"b": 1, "a": 2})
+    b = lc_mod.profile_version({"full_name": "x", "age": 1}, {"a": 2, "b": 1})
+
+    assert a == b
+    assert a != lc_mod.profile_version({"full_name": "x", "age": 2}, None)
@@ -0,0 +1,198 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import utils.ratelimit as rl_mod
+from db.db import LLMRateBucket
+from utils.metrics import REGISTRY
+from utils.ratelimit import (
+    LLM_QUEUE_DEPTH,
+    LLM_RATE_LIMITED,
+    LocalTokenBucket,
+    ModelLimiter,
+    SQLTokenBucket,
+    acall_model,
+    call_model,
+    parse_limits,
+)
+
+
+@pytest.fixture(autouse=True)
+def clean(monkeypatch):
+    REGISTRY.clear()
+    rl_mod.clear_limiters()
+    monkeypatch.setattr(rl_mod, "_backoff", lambda attempt: 0)
+    monkeypatch.setattr(rl_mod, "LLM_RATE_LIMIT_COOLDOWN", 0.01)
+    yield
+    rl_mod.clear_limiters()
+    REGISTRY.clear()
+
+
+class ResourceExhausted(Exception):
+    """Mismo nombre que el 429 de google.api_core."""
+
+
+def test_parse_limits():
+    assert parse_limits("a=900:4, models/x=60") == {
+        "a": (900.0, 4),
+        "models/x": (60.0, rl_mod.LLM_DEFAULT_CONCURRENCY),
+    }
+
+
+def test_local_bucket_refills_at_its_rate(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(rl_mod.time, "monotonic", lambda: now[0])
+    bucket = LocalTokenBucket(rate=2, capacity=2)
+
+    assert bucket.take() == 0 and bucket.take() == 0
+    assert bucket.take() == pytest.approx(0.5)
+    now[0] += 0.5
+    assert bucket.take() == 0
+
+    bucket.penalize(3)
+    now[0] += 2
+    assert bucket.take() > 0
+
+
+def test_replies_go_ahead_of_background_calls():
+    limiter = ModelLimiter("m", bucket=None, max_concurrency=1)
+    order = []
+    limiter.acquire("reply")
+
+    def call(priority):
+        limiter.acquire(priority)
+        order.append(priority)
+        limiter.release()
+
+    background = threading.Thread(target=call, args=("background",))
+    background.start()
+    while LLM_QUEUE_DEPTH.value(model="m", priority="background") < 1:
+        time.sleep(0.001)
+    reply = threading.Thread(target=call, args=("reply",))
+    reply.start()
+    while LLM_QUEUE_DEPTH.value(model="m", priority="reply") < 1:
+        time.sleep(0.001)
+
+    limiter.release()
+    background.join(5)
+    reply.join(5)
+
+    assert order == ["reply", "background"]
+    assert LLM_QUEUE_DEPTH.value(model="m", priority="background") == 0
+
+
+def test_queue_timeout_leaves_the_queue():
+    limiter = ModelLimiter("m", bucket=None, max_concurrency=1)
+    limiter.acquire("reply")
+
+    with pytest.raises(rl_mod.LLMQueueTimeout):
+        limiter.acquire("background", timeout=0.01)
+
+    assert limiter._waiting == []
+    assert LLM_QUEUE_DEPTH.value(model="m", priority="background") == 0
+
+
+class _SlowBucket:
+    """Bucket compartido cuyo ``take`` se queda esperando (un viaje a la BD)."""
+
+    shared = True
+
+    def __init__(self) -> None:
+        self.taking = threading.Event()
+        self.proceed = threading.Event()
+
+    def take(self) -> float:
+        self.taking.set()
+        self.proceed.wait(5)
+        return 0.0
+
+
+def test_token_is_taken_without_holding_the_queue_lock():
+    """Mientras una llamada pide token, las demás pueden encolarse y liberar."""
+    bucket = _SlowBucket()
+    limiter = ModelLimiter("m", bucket=bucket, max_concurrency=2)
+    caller = threading.Thread(target=limiter.acquire)
+    caller.start()
+    assert bucket.taking.wait(5)
+
+    assert limiter._cond.acquire(timeout=1)
+    limiter._cond.release()
+
+    bucket.proceed.set()
+    caller.join(5)
+    assert limiter._inflight == 1
+    assert limiter._waiting == []
+
+
+def test_bucket_error_leaves_the_queue():
+    class _BrokenBucket:
+        shared = True
+
+        def take(self):
+            raise RuntimeError("BD caída")
+
+    limiter = ModelLimiter("m", bucket=_BrokenBucket(), max_concurrency=1)
+
+    with pytest.raises(RuntimeError):
+        limiter.acquire("reply")
+
+    assert limiter._waiting == []
+    assert not limiter._taking
+    assert LLM_QUEUE_DEPTH.value(model="m", priority="reply") == 0
+
+
+def test_call_model_retries_only_rate_limit_errors():
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ResourceExhausted("429 Resource has been exhausted")
+        return "ok"
+
+    assert call_model("m", "reply", flaky) == "ok"
+    assert len(attempts) == 3
+    assert LLM_RATE_LIMITED.value(model="m") == 2
+
+    def broken():
+        raise ValueError("prompt inválido")
+
+    with pytest.raises(ValueError):
+        call_model("m", "reply", broken)
+    assert rl_mod.get_limiter("m")._inflight == 0
+
+
+def test_acall_model_retries_on_429():
+    attempts = []
+
+    async def flaky(text):
+        attempts.append(text)
+        if len(attempts) < 2:
+            raise ResourceExhausted("RESOURCE_EXHAUSTED")
+        return text.upper()
+
+    assert asyncio.run(acall_model("m", "reply", flaky, "hola")) == "HOLA"
+    assert LLM_RATE_LIMITED.value(model="m") == 1
+
+
+def test_sql_bucket_is_shared_between_workers():
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    LLMRateBucket.__table__.create(engine)
+    factory = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+    # Dos workers con su propio objeto bucket sobre la misma fila
+    first = SQLTokenBucket("m", rate=0.001, capacity=2, session_factory=factory)
+    second = SQLTokenBucket("m", rate=0.001, capacity=2, session_factory=factory)
+
+    assert first.take() == 0
+    assert second.take() == 0
+    assert first.take() > 0
+    assert second.take() > 0
@@ -0,0 +1,170 @@
+import numpy as np
+import pytest
+
+import utils.semantic_cache as sc_mod
+from utils import whatsapp as wa_mod
+from utils.metrics import REGISTRY
+from utils.semantic_cache import (
+    SEMANTIC_CACHE_LOOKUPS,
+    SEMANTIC_CACHE_SAVED_SECONDS,
+    SemanticCache,
+    is_cacheable_question,
+    profile_scope,
+)
+
+# Embeddings falsos: preguntas equivalentes comparten vector
+_VECTORS = {
+    "¿puedo comer arroz?": [1.0, 0.0, 0.0],
+    "¿se puede comer arroz?": [0.99, 0.05, 0.0],
+    "¿puedo comer pan?": [0.0, 1.0, 0.0],
+}
+
+
+def _embed(text: str):
+    return _VECTORS.get(text.lower(), [0.0, 0.0, 1.0])
+
+
+@pytest.fixture(autouse=True)
+def clear_metrics():
+    REGISTRY.clear()
+    yield
+    REGISTRY.clear()
+
+
+DIABETES = profile_scope("A", {"diseases": ["Diabetes"], "allergies": []}, "daily")
+
+
+def test_similar_question_in_same_scope_hits():
+    cache = SemanticCache(embed=_embed, threshold=0.9)
+    miss = cache.lookup("¿Puedo comer arroz?", DIABETES)
+    assert not miss.hit
+    cache.store(miss, "Con moderación, mejor integral.", latency=2.5)
+
+    hit = cache.lookup("¿Se puede comer arroz?", DIABETES)
+
+    assert hit.answer == "Con moderación, mejor integral."
+    assert hit.similarity > 0.9
+    assert not cache.lookup("¿Puedo comer pan?", DIABETES).hit
+    assert SEMANTIC_CACHE_LOOKUPS.value(result="hit") == 1
+    assert SEMANTIC_CACHE_LOOKUPS.value(result="miss") == 2
+    assert SEMANTIC_CACHE_SAVED_SECONDS.value() == 2.5
+
+
+def test_answers_are_not_shared_across_profile_facets():
+    cache = SemanticCache(embed=_embed, threshold=0.9)
+    cache.store(cache.lookup("¿Puedo comer arroz?", DIABETES), "Sí, con moderación.")
+
+    other = profile_scope("A", {"diseases": ["hipertensión"]}, "daily")
+    profiling = profile_scope("A", {"diseases": ["diabetes"]}, "profiling")
+    other_user = profile_scope("B", {"diseases": ["diabetes"]}, "daily")
+
+    assert not cache.lookup("¿Puedo comer arroz?", other).hit
+    assert not cache.lookup("¿Puedo comer arroz?", profiling).hit
+    assert not cache.lookup("¿Puedo comer arroz?", other_user).hit
+    # El orden y las mayúsculas de las facetas no cambian el ámbito
+    same = profile_scope("A", {"diseases": ["diabetes"], "allergies": None}, "daily")
+    assert cache.lookup("¿Puedo comer arroz?", same).hit
+
+
+def test_ttl_and_size_bounds(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(sc_mod.time, "monotonic", lambda: now[0])
+    cache = SemanticCache(embed=_embed, threshold=0.9, ttl=60, max_entries=1)
+
+    cache.store(cache.lookup("¿Puedo comer arroz?", DIABETES), "arroz")
+    cache.store(cache.lookup("¿Puedo comer pan?", DIABETES), "pan")
+    assert len(cache) == 1
+    assert not cache.lookup("¿Puedo comer arroz?", DIABETES).hit
+
+    now[0] += 61
+    assert not cache.lookup("¿Puedo comer pan?", DIABETES).hit
+    assert len(cache) == 0
+
+
+def test_only_short_general_questions_are_cacheable():
+    assert is_cacheable_question("¿Puedo comer arroz?")
+    assert is_cacheable_question("qué desayuno es bueno para la diabetes")
+    assert not is_cacheable_question("hoy me siento un poco triste")
+    assert not is_cacheable_question("¿" + "a" * 300 + "?")
+
+
+class _FakeMemory:
+    def __init__(self) -> None:
+        self.turns = []
+
+    def save_context(self, inputs, outputs) -> None:
+        self.turns.append((inputs["input"], outputs["output"]))
+
+
+class _FakeChain:
+    def __init__(self, reply: str) -> None:
+        self.reply = reply
+        self.memory = _FakeMemory()
+        self.calls = 0
+
+    def predict(self, input: str) -> str:
+        self.calls += 1
+        self.memory.save_context({"input": input}, {"output": self.reply})
+        return self.reply
+
+
+@pytest.fixture
+def reply_pipeline(monkeypatch):
+    """build_whatsapp_reply con la caché activa y sin BD ni Gemini."""
+    cache = SemanticCache(embed=_embed, threshold=0.9)
+    chains = {}
+
+    def fake_chain(phone, *args):
+        return chains.setdefault(phone, _FakeChain("Mejor integral y poca cantidad."))
+
+    def fake_context(phone):
+        profile = {"full_name": f"Usuario {phone}", "diseases": ["diabetes"]}
+        return None, profile, "daily"
+
+    monkeypatch.setattr(wa_mod, "SEMANTIC_CACHE_ENABLED", True)
+    monkeypatch.setattr(wa_mod, "SEMANTIC_CACHE", cache)
+    monkeypatch.setattr(wa_mod, "_load_reply_context", fake_context)
+    monkeypatch.setattr(wa_mod, "_reply_chain", fake_chain)
+    monkeypatch.setattr(wa_mod, "save_conversation_state", lambda phone: None)
+    return chains
+
+
+def test_reply_is_served_from_cache_and_kept_in_memory(reply_pipeline):
+    first = wa_mod.build_whatsapp_reply("¿Puedo comer arroz?", "A")
+    second = wa_mod.build_whatsapp_reply("¿Se puede comer arroz?", "A")
+
+    assert first == second == "Mejor integral y poca cantidad."
+    assert reply_pipeline["A"].calls == 1
+    # La memoria tiene los dos turnos aunque el segundo no llamó al LLM
+    assert reply_pipeline["A"].memory.turns == [
+        ("¿Puedo comer arroz?", "Mejor integral y poca cantidad."),
+        ("¿Se puede comer arroz?", "Mejor integral y poca cantidad."),
+    ]
+
+
+def test_replies_are_not_shared_across_users(reply_pipeline):
+    """La respuesta depende de la memoria y el perfil de cada usuario."""
+    wa_mod.build_whatsapp_reply("¿Puedo comer arroz?", "A")
+    wa_mod.build_whatsapp_reply("¿Puedo comer arroz?", "B")
+
+    assert reply_pipeline["A"].calls == reply_pipeline["B"].calls == 1
+    assert np.isclose(SEMANTIC_CACHE_SAVED_SECONDS.value(), 0.0)
+
+
+def test_profiling_replies_skip_the_cache(reply_pipeline, monkeypatch):
+    """En la entrevista de perfilamiento cada respuesta depende del usuario."""
+    cache = wa_mod.SEMANTIC_CACHE
+    lookups = []
+    monkeypatch.setattr(cache, "lookup", lambda *a: lookups.append(a))
+    monkeypatch.setattr(
+        wa_mod,
+        "_load_reply_context",
+        lambda phone: (None, {"full_name": "Ana", "diseases": []}, "profiling"),
+    )
+
+    wa_mod.build_whatsapp_reply("¿Puedo comer arroz?", "A")
+    wa_mod.build_whatsapp_reply("¿Puedo comer arroz?", "B")
+
+    assert lookups == []
+    assert reply_pipeline["A"].calls == reply_pipeline["B"].calls == 1
+    assert len(cache) == 0
@@ -0,0 +1,171 @@
+import pytest
+
+import utils.cache as cache_mod
+from utils import langchain as lc_mod
+from utils.cache import SESSION_EVICTIONS, SessionCache
+from utils.conversation_state import InMemoryConversationStateStore
+from utils.metrics import REGISTRY
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Reloj controlable para la expiración por inactividad."""
+    fake = _Clock()
+    monkeypatch.setattr(cache_mod.time, "monotonic", fake)
+    REGISTRY.clear()
+    return fake
+
+
+def test_lru_bound_evicts_least_recently_used(clock):
+    cache = SessionCache("t", maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "b" pasa a ser la menos usada
+    cache.set("c", 3)
+
+    assert "b" not in cache
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert SESSION_EVICTIONS.value(cache="t", reason="size") == 1
+
+
+def test_idle_ttl_is_renewed_on_each_use(clock):
+    cache = SessionCache("t", idle_ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+
+    clock.now += 50
+    assert cache.get("a") == 1
+    clock.now += 50
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.purge_expired() == 0
+    assert SESSION_EVICTIONS.value(cache="t", reason="idle") == 1
+
+
+def test_memory_budget_tracks_growing_sessions(clock):
+    """El tamaño se recalcula al usar la sesión y se expulsan las más antiguas."""
+    cache = SessionCache("t", max_bytes=100, sizeof=len)
+    cache.set("a", ["x"] * 40)
+    cache.set("b", ["x"] * 40)
+    assert cache.approx_bytes == 80
+
+    grown = cache.get("b")
+    grown.extend(["x"] * 30)
+    cache.get("b")
+
+    assert "a" not in cache
+    assert cache.approx_bytes == 70
+    assert SESSION_EVICTIONS.value(cache="t", reason="memory") == 1
+
+
+def test_oversized_current_session_is_kept(clock):
+    cache = SessionCache("t", max_bytes=10, sizeof=len)
+    cache.set("a", "x" * 50)
+    assert cache.get("a") == "x" * 50
+
+
+class _FakeMessage:
+    def __init__(self, type_: str, content: str) -> None:
+        self.type = type_
+        self.content = content
+
+
+class _FakeChatHistory:
+    def __init__(self) -> None:
+        self.messages = []
+
+    def add_user_message(self, text: str) -> None:
+        self.messages.append(_FakeMessage("human", text))
+
+    def add_ai_message(self, text: str) -> None:
+        self.messages.append(_FakeMessage("ai", text))
+
+    def clear(self) -> None:
+        self.messages = []
+
+
+class _FakeMemory:
+    def __init__(self, *args, **kwargs) -> None:
+        self.moving_summary_buffer = ""
+        self.chat_memory = _FakeChatHistory()
+
+
+class _FakeChain:
+    def __init__(self, llm=None, memory=None, prompt=None, verbose=False) -> None:
+        self.memory = memory
+        self.prompt = prompt
+
+
+@pytest.fixture
+def state_store(monkeypatch):
+    """LangChain falso y un almacén de estado en memoria."""
+    store = InMemoryConversationStateStore()
+    monkeypatch.setattr(lc_mod, "ChatGoogleGenerativeAI", lambda **kw: object())
+    monkeypatch.setattr(lc_mod, "ConversationSummaryBufferMemory", _FakeMemory)
+    monkeypatch.setattr(lc_mod, "ConversationChain", _FakeChain)
+    monkeypatch.setattr(lc_mod, "_state_store", store)
+    lc_mod.USER_SESSIONS.clear()
+    yield store
+    lc_mod.USER_SESSIONS.clear()
+
+
+def _turns(chain):
+    return [(m.type, m.content) for m in chain.memory.chat_memory.messages]
+
+
+def test_evicted_session_is_rebuilt_from_persisted_state(state_store):
+    phone = "573001112233"
+    state_store.save(phone, "Le gusta caminar.", [("in", "hola"), ("out", "¡Hola!")])
+
+    first = lc_mod.get_user_chain(phone)
+    assert lc_mod.get_user_chain(phone) is first
+
+    lc_mod.USER_SESSIONS.pop(phone)
+    rebuilt = lc_mod.get_user_chain(phone)
+
+    assert rebuilt is not first
+    assert rebuilt.memory.moving_summary_buffer == "Le gusta caminar."
+    assert _turns(rebuilt) == [("human", "hola"), ("ai", "¡Hola!")]
+
+
+def test_stale_local_session_picks_up_another_workers_state(state_store):
+    """Si otro worker guardó una versión nueva, la sesión local se rehidrata."""
+    phone = "573001112233"
+    chain = lc_mod.get_user_chain(phone)
+    chain.memory.chat_memory.add_user_message("hola")
+    lc_mod.save_conversation_state(phone)
+    assert state_store.load(phone).version == 1
+
+    # Otro proceso continúa la conversación
+    state_store.save(
+        phone, "", [("in", "hola"), ("out", "¡Hola!"), ("in", "tengo hambre")]
+    )
+
+    assert lc_mod.get_user_chain(phone) is chain
+    assert _turns(chain) == [
+        ("human", "hola"),
+        ("ai", "¡Hola!"),
+        ("human", "tengo hambre"),
+    ]
+
+
+def test_cached_session_only_checks_the_version(state_store, monkeypatch):
+    """Con la sesión en caché no se vuelve a leer el estado completo."""
+    phone = "573001112233"
+    state_store.save(phone, "", [("in", "hola")])
+    chain = lc_mod.get_user_chain(phone)
+    loads = []
+    monkeypatch.setattr(state_store, "load", lambda p: loads.append(p))
+
+    assert lc_mod.get_user_chain(phone) is chain
+    assert lc_mod.get_user_chain(phone) is chain
+    assert loads == []
@@ -0,0 +1,79 @@
+import importlib
+import os
+
+import pytest
+
+import services.warmup as warmup_mod
+import utils.gcp as gcp_mod
+
+
+@pytest.fixture(autouse=True)
+def reset_ready():
+    """Cada prueba empieza con el proceso sin calentar."""
+    warmup_mod.READY.clear()
+    yield
+    warmup_mod.READY.clear()
+
+
+def _boom():
+    raise RuntimeError("sin credenciales")
+
+
+def test_warm_up_marks_ready_and_tolerates_optional_failures():
+    """Un paso opcional que falla no impide marcar el proceso como listo."""
+    calls = []
+    ok = warmup_mod.warm_up(
+        [
+            ("db", lambda: calls.append("db"), True),
+            ("storage", _boom, False),
+        ]
+    )
+
+    assert ok is True
+    assert calls == ["db"]
+    assert warmup_mod.READY.is_set()
+
+
+def test_warm_up_not_ready_when_required_step_fails():
+    """Si la BD no responde el worker no se anuncia como listo."""
+    assert warmup_mod.warm_up([("db", _boom, True)]) is False
+    assert not warmup_mod.READY.is_set()
+
+
+def test_default_db_step_runs():
+    """El paso de BD por defecto abre una conexión del pool."""
+    warmup_mod._warm_db()
+
+
+def test_storage_client_is_shared_and_recreated_after_fork(monkeypatch):
+    """Un cliente por proceso: se reutiliza y se recrea si cambia el pid."""
+    created = []
+
+    class _FakeClient:
+        def __init__(self):
+            created.append(self)
+
+    monkeypatch.setattr(gcp_mod.storage, "Client", _FakeClient)
+    monkeypatch.setattr(gcp_mod, "_client", None)
+
+    first = gcp_mod.get_storage_client()
+    assert gcp_mod.get_storage_client() is first
+    assert len(created) == 1
+
+    # Simula un worker hijo: el pid guardado ya no es el del proceso
+    monkeypatch.setattr(gcp_mod, "_client", (os.getpid() + 1, first))
+    assert gcp_mod.get_storage_client() is not first
+    assert len(created) == 2
+
+
+def test_readyz_reports_warm_state(monkeypatch):
+    """/readyz responde 503 hasta que el worker terminó de calentar."""
+    client = importlib.import_module("app").app.test_client()
+
+    assert client.get("/healthz").status_code == 200
+    assert client.get("/readyz").status_code == 503
+
+    warmup_mod.READY.set()
+    resp = client.get("/readyz")
+    assert resp.status_code == 200
+    assert resp.get_json() == {"status": "ready"}
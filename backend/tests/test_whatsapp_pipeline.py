@@ -0,0 +1,402 @@
+import asyncio
+import io
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from db import session as db_session_mod
+from db.db import ConversationStats, WhatsAppMessage
+from db.session import UNIT_CHECKOUTS
+from services import whatsapp_pipeline as pipeline_mod
+from services.whatsapp_pipeline import (
+    prepare_incoming,
+    process_whatsapp_messages,
+    process_whatsapp_messages_async,
+)
+from utils import gcp as gcp_mod
+from utils import whatsapp as wa_mod
+from utils.metrics import REGISTRY
+
+
+def _text(phone, body, n):
+    return {"from": phone, "id": f"wamid.{n}", "type": "text", "text": {"body": body}}
+
+
+def _fake_turn(reply=None, areply=None, steps=None):
+    """
+    ``WhatsAppTurn`` sin BD ni LLM: la respuesta sale de ``reply``/``areply``
+    y, si se pasa ``steps``, cada etapa registra si corrió dentro de una unidad.
+    """
+
+    class FakeTurn:
+        def __init__(self, phone):
+            self.phone = phone
+
+        def _step(self, name):
+            if steps is not None:
+                steps.append((name, db_session_mod._current_unit.get() is not None))
+
+        def load(self):
+            self._step("load")
+
+        def reply(self, user_message):
+            self._step("reply")
+            return reply(user_message, self.phone)
+
+        async def areply(self, user_message):
+            self._step("reply")
+            return await areply(user_message, self.phone)
+
+        def save(self):
+            self._step("save")
+
+        def summarize(self):
+            self._step("summarize")
+
+    return FakeTurn
+
+
+@pytest.fixture
+def fake_io(monkeypatch):
+    """
+    Parchea BD, LLM y envío del pipeline.
+
+    - SessionLocal apunta a ``whatsapp_messages`` y ``conversation_stats`` en
+      SQLite en memoria.
+    - WhatsAppTurn y send_whatsapp_message solo registran sus llamadas.
+    """
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    WhatsAppMessage.__table__.create(engine)
+    ConversationStats.__table__.create(engine)
+    session_factory = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+
+    calls = {"reply": [], "send": []}
+
+    def fake_reply(user_message, phone):
+        calls["reply"].append((user_message, phone))
+        return "¡Qué rico! ¿Con qué acompañaste la arepa?"
+
+    def fake_send(phone, text):
+        calls["send"].append((phone, text))
+        return {"status_code": 200}
+
+    monkeypatch.setattr(pipeline_mod, "SessionLocal", session_factory)
+    monkeypatch.setattr(pipeline_mod, "WhatsAppTurn", _fake_turn(fake_reply))
+    monkeypatch.setattr(pipeline_mod, "send_whatsapp_message", fake_send)
+    yield calls, session_factory
+    engine.dispose()
+
+
+def test_burst_of_texts_is_answered_with_one_model_turn(fake_io):
+    """Tres mensajes seguidos del mismo teléfono generan una sola respuesta."""
+    calls, session_factory = fake_io
+    msgs = [
+        _text("573001112233", "hola", 1),
+        _text("573001112233", "buenos días", 2),
+        _text("573001112233", "hoy comí arepa", 3),
+    ]
+
+    result = process_whatsapp_messages(msgs)
+
+    assert result["status"] == "ok"
+    assert calls["reply"] == [("hola\nbuenos días\nhoy comí arepa", "573001112233")]
+    assert len(calls["send"]) == 1
+
+    db = session_factory()
+    try:
+        rows = db.query(WhatsAppMessage).order_by(WhatsAppMessage.id).all()
+        assert [r.direction for r in rows] == ["in", "in", "in", "out"]
+        assert [r.wa_message_id for r in rows] == [
+            "wamid.1",
+            "wamid.2",
+            "wamid.3",
+            None,
+        ]
+        stats = db.get(ConversationStats, "573001112233")
+        assert (stats.messages_in, stats.messages_out) == (3, 1)
+        assert stats.last_message_id == rows[-1].id
+    finally:
+        db.close()
+
+
+def test_batch_holds_no_connection_during_reply_and_send(fake_io, monkeypatch):
+    """Lecturas y escrituras van en dos unidades cortas, fuera de LLM y envío."""
+    steps = []
+
+    def send(phone, text):
+        steps.append(("send", db_session_mod._current_unit.get() is not None))
+        return {"status_code": 200}
+
+    monkeypatch.setattr(
+        pipeline_mod,
+        "WhatsAppTurn",
+        _fake_turn(lambda user_message, phone: "respuesta", steps=steps),
+    )
+    monkeypatch.setattr(pipeline_mod, "send_whatsapp_message", send)
+    REGISTRY.clear()
+
+    process_whatsapp_messages([_text("573001112233", "hola", 1)])
+
+    assert steps == [
+        ("load", True),
+        ("reply", False),
+        ("send", False),
+        ("save", True),
+        ("summarize", False),
+    ]
+    assert UNIT_CHECKOUTS.sum(unit="whatsapp_inbound") == 1
+    assert UNIT_CHECKOUTS.sum(unit="whatsapp_outbound") == 1
+    assert UNIT_CHECKOUTS.count(unit="whatsapp_pipeline") == 1
+    assert UNIT_CHECKOUTS.sum(unit="whatsapp_pipeline") == 2
+
+
+def test_retried_batch_skips_already_stored_messages(fake_io):
+    """Si el lote ya se respondió y guardó, un reintento no vuelve a llamar al LLM."""
+    calls, _ = fake_io
+    msgs = [_text("573001112233", "hola", 1)]
+
+    process_whatsapp_messages(msgs)
+    result = process_whatsapp_messages(msgs)
+
+    assert result["status"] == "ignored"
+    assert len(calls["reply"]) == 1
+    assert len(calls["send"]) == 1
+
+
+def test_image_upload_and_detection_run_concurrently(monkeypatch):
+    """La latencia de media es la de la etapa más lenta, no la suma de ambas."""
+
+    def slow_upload(fileobj, fname, size, content_type):
+        time.sleep(0.3)
+        return f"https://storage.googleapis.com/bucket/{fname}"
+
+    def slow_detect(data):
+        time.sleep(0.3)
+        return '[{"alimento": "arepa"}]'
+
+    monkeypatch.setattr(
+        pipeline_mod,
+        "download_whatsapp_media_stream",
+        lambda _id: (io.BytesIO(b"jpg"), 3),
+    )
+    monkeypatch.setattr(pipeline_mod, "upload_file_to_gcp", slow_upload)
+    monkeypatch.setattr(pipeline_mod, "detectar_auto", slow_detect)
+
+    started = time.perf_counter()
+    item = prepare_incoming(
+        {
+            "from": "573001112233",
+            "id": "wamid.9",
+            "type": "image",
+            "image": {"id": "m1"},
+        }
+    )
+    elapsed = time.perf_counter() - started
+
+    assert item["user_message"] == '[{"alimento": "arepa"}]'
+    assert item["media_url"].endswith("_m1.jpg")
+    assert elapsed < 0.5
+    assert set(item["timings"]) == {"download", "upload", "analysis", "media_total"}
+    assert item["timings"]["upload"] >= 0.3
+    assert item["timings"]["analysis"] >= 0.3
+
+
+def _run_async(coro):
+    """Ejecuta ``coro`` con un solo hilo de BD (SQLite en memoria no admite más)."""
+
+    async def main():
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(1))
+        return await coro
+
+    return asyncio.run(main())
+
+
+def test_async_pipeline_keeps_many_conversations_in_flight(fake_io, monkeypatch):
+    """Con el pipeline asíncrono 50 conversaciones esperan al LLM a la vez."""
+    calls, session_factory = fake_io
+
+    async def slow_reply(user_message, phone):
+        await asyncio.sleep(0.2)
+        calls["reply"].append((user_message, phone))
+        return f"respuesta para {phone}"
+
+    async def fake_send(phone, text):
+        calls["send"].append((phone, text))
+        return {"status_code": 200}
+
+    monkeypatch.setattr(pipeline_mod, "WhatsAppTurn", _fake_turn(areply=slow_reply))
+    monkeypatch.setattr(pipeline_mod, "send_whatsapp_message_async", fake_send)
+
+    async def run_all():
+        return await asyncio.gather(
+            *(
+                process_whatsapp_messages_async([_text(f"57300{n:04d}", "hola", n)])
+                for n in range(50)
+            )
+        )
+
+    started = time.perf_counter()
+    results = _run_async(run_all())
+    elapsed = time.perf_counter() - started
+
+    # En serie serían 10 s
+    assert elapsed < 2.0
+    assert [r["reply"] for r in results] == [
+        f"respuesta para 57300{n:04d}" for n in range(50)
+    ]
+    assert len(calls["send"]) == 50
+
+    db = session_factory()
+    try:
+        assert db.query(WhatsAppMessage).count() == 100
+    finally:
+        db.close()
+
+
+def test_async_image_upload_and_detection_run_concurrently(fake_io, monkeypatch):
+    """En la variante asíncrona la subida y la detección también se solapan."""
+    calls, _ = fake_io
+
+    async def fake_download(media_id):
+        return io.BytesIO(b"jpg"), 3
+
+    async def slow_upload(fileobj, fname, size, content_type):
+        await asyncio.sleep(0.3)
+        return f"https://storage.googleapis.com/bucket/{fname}"
+
+    async def slow_detect(data):
+        await asyncio.sleep(0.3)
+        return '[{"alimento": "arepa"}]'
+
+    async def fake_reply(user_message, phone):
+        calls["reply"].append((user_message, phone))
+        return "¡Qué rico!"
+
+    async def fake_send(phone, text):
+        return {"status_code": 200}
+
+    monkeypatch.setattr(
+        pipeline_mod, "download_whatsapp_media_stream_async", fake_download
+    )
+    monkeypatch.setattr(pipeline_mod, "upload_file_to_gcp_async", slow_upload)
+    monkeypatch.setattr(pipeline_mod, "detectar_auto_async", slow_detect)
+    monkeypatch.setattr(pipeline_mod, "WhatsAppTurn", _fake_turn(areply=fake_reply))
+    monkeypatch.setattr(pipeline_mod, "send_whatsapp_message_async", fake_send)
+
+    msg = {
+        "from": "573001112233",
+        "id": "wamid.9",
+        "type": "image",
+        "image": {"id": "m1"},
+    }
+    started = time.perf_counter()
+    result = _run_async(process_whatsapp_messages_async([msg]))
+    elapsed = time.perf_counter() - started
+
+    assert elapsed < 0.5
+    assert result["user_message"] == '[{"alimento": "arepa"}]'
+    assert result["media_urls"][0].endswith("_m1.jpg")
+
+
+class _FakeStreamResponse:
+    """Respuesta de ``requests`` que entrega ``total`` bytes en bloques."""
+
+    def __init__(self, total: int) -> None:
+        self.total = total
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"url": "https://lookaside.fbsbx.com/media"}
+
+    def iter_content(self, chunk_size):
+        sent = 0
+        while sent < self.total:
+            n = min(chunk_size, self.total - sent)
+            sent += n
+            yield b"\0" * n
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _FakeBlob:
+    """Blob de GCS que consume el archivo por bloques como una subida reanudable."""
+
+    def __init__(self, name, chunk_size=None) -> None:
+        self.name = name
+        self.chunk_size = chunk_size
+        self.uploaded = 0
+
+    def upload_from_file(self, fileobj, rewind=False, size=None, content_type=None):
+        if rewind:
+            fileobj.seek(0)
+        while chunk := fileobj.read(self.chunk_size):
+            self.uploaded += len(chunk)
+
+    @property
+    def public_url(self):
+        return f"https://storage.googleapis.com/bucket/{self.name}"
+
+
+class _FakeStorageClient:
+    blobs: list = []
+
+    def bucket(self, name):
+        return self
+
+    def blob(self, name, chunk_size=None):
+        blob = _FakeBlob(name, chunk_size)
+        _FakeStorageClient.blobs.append(blob)
+        return blob
+
+
+def test_large_voice_note_streams_with_bounded_memory(monkeypatch):
+    """Una nota de voz de 24 MB se sube completa sin retenerla entera en memoria."""
+    total = 24 * 1024 * 1024
+    monkeypatch.setenv("WHATSAPP_ACCESS_TOKEN", "token")
+    monkeypatch.setenv("GCP_BUCKET_NAME", "bucket")
+    monkeypatch.setattr(
+        wa_mod.requests, "get", lambda *a, **kw: _FakeStreamResponse(total)
+    )
+    monkeypatch.setattr(gcp_mod.storage, "Client", _FakeStorageClient)
+    monkeypatch.setattr(gcp_mod, "_client", None)
+    monkeypatch.setattr(gcp_mod, "GCP_UPLOAD_CHUNK_BYTES", 256 * 1024)
+    monkeypatch.setattr(pipeline_mod, "AUDIO_ANALYSIS_MAX_BYTES", 512 * 1024)
+    monkeypatch.setattr(pipeline_mod, "transcribir_audio", lambda data: "hola")
+    _FakeStorageClient.blobs = []
+
+    tracemalloc.start()
+    try:
+        item = prepare_incoming(
+            {
+                "from": "573001112233",
+                "id": "wamid.7",
+                "type": "audio",
+                "audio": {"id": "a1"},
+            }
+        )
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    # Demasiado grande para transcribir, pero se guarda igual en GCS
+    assert item["user_message"] == "El audio es demasiado largo para transcribirlo."
+    assert _FakeStorageClient.blobs[0].uploaded == total
+    assert item["memory"]["media_bytes"] == total
+    assert item["memory"]["peak_buffer_bytes"] < 2 * 1024 * 1024
+    # Pico real del proceso muy por debajo del tamaño del archivo
+    assert peak < 4 * 1024 * 1024
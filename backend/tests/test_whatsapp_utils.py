@@ -1,10 +1,14 @@
 
+import asyncio
+import threading
+
 from utils import whatsapp as wa_mod
-from utils.whatsapp import build_whatsapp_reply
+from utils.whatsapp import build_whatsapp_reply, build_whatsapp_reply_async
 
 
 class _FakeProfile:
     def __init__(self, stage: str = "profiling", personality_profile=None) -> None:
+        self.id = 1
         self.personality_stage = stage
         self.personality_profile = personality_profile
         # Campos usados para armar user_profile_dict
@@ -40,10 +44,17 @@ class _FakeQuery:
 class _FakeSession:
     def __init__(self, profile):
         self._profile = profile
+        self.info = {}
 
     def query(self, *args, **kwargs):
         return _FakeQuery(self._profile)
 
+    def commit(self):  # pragma: no cover - sin efecto
+        pass
+
+    def rollback(self):  # pragma: no cover - sin efecto
+        pass
+
     def close(self):  # pragma: no cover - sin efecto
         pass
 
@@ -57,6 +68,9 @@ class _FakeChain:
         self.last_input = input
         return self._expected_response
 
+    async def apredict(self, input: str):
+        return self.predict(input)
+
 
 def test_build_whatsapp_reply_calls_chain_with_profiling(monkeypatch):
     """Cuando no hay perfil en DB, debe llamar get_user_chain con stage profiling."""
@@ -132,3 +146,79 @@ def test_build_whatsapp_reply_uses_daily_stage_when_profile_daily(monkeypatch):
     # El user_profile que se pasa a LangChain debe tener datos básicos
     assert captured["user_profile"]["full_name"] == "Test User"
     assert captured["user_profile"]["diseases"] == ["hipertensión"]
+
+
+def test_async_reply_loads_the_chain_off_the_event_loop(monkeypatch):
+    """Cargar la sesión (lee conversation_state) no bloquea el event loop."""
+    threads = []
+
+    def fake_get_user_chain(user_id, **kwargs):
+        threads.append(threading.current_thread())
+        return _FakeChain("respuesta async")
+
+    monkeypatch.setattr(wa_mod, "SessionLocal", lambda: _FakeSession(profile=None))
+    monkeypatch.setattr(wa_mod, "get_user_chain", fake_get_user_chain)
+
+    result = asyncio.run(build_whatsapp_reply_async("Hola", "55555"))
+
+    assert result == "respuesta async"
+    assert threads and threads[0] is not threading.main_thread()
+
+
+class _FakeResponse:
+    def __init__(self, payload=None, chunks=()) -> None:
+        self._payload = payload
+        self._chunks = chunks
+
+    def raise_for_status(self) -> None:
+        pass
+
+    def json(self):
+        return self._payload
+
+    async def aiter_bytes(self, chunk_size):
+        for chunk in self._chunks:
+            yield chunk
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        pass
+
+
+class _FakeHttpClient:
+    def __init__(self, chunks) -> None:
+        self.chunks = chunks
+
+    async def get(self, url, **kwargs):
+        return _FakeResponse({"url": "https://media.example/1"})
+
+    def stream(self, method, url, **kwargs):
+        return _FakeResponse(chunks=self.chunks)
+
+
+def test_async_media_download_writes_to_disk_off_the_event_loop(monkeypatch):
+    """Lo que pasa de ``spool_bytes`` se escribe (en disco) desde un hilo."""
+    writes = []
+
+    class RecordingSpool(wa_mod.tempfile.SpooledTemporaryFile):
+        def write(self, data):
+            writes.append((len(data), threading.current_thread()))
+            return super().write(data)
+
+    monkeypatch.setenv("WHATSAPP_ACCESS_TOKEN", "token")
+    monkeypatch.setattr(wa_mod.tempfile, "SpooledTemporaryFile", RecordingSpool)
+    monkeypatch.setattr(
+        wa_mod, "get_async_client", lambda: _FakeHttpClient([b"a" * 4] * 4)
+    )
+
+    fileobj, size = asyncio.run(
+        wa_mod.download_whatsapp_media_stream_async("m1", spool_bytes=8)
+    )
+
+    with fileobj:
+        assert fileobj.read() == b"a" * 16
+    assert size == 16
+    on_loop = [t is threading.main_thread() for _, t in writes]
+    assert on_loop == [True, True, False, False]
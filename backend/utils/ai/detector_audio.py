@@ -1,20 +1,25 @@
+import asyncio
 import base64
 import os
 
 import requests
 from dotenv import load_dotenv
 
+from utils.http_async import get_async_client
+from utils.metrics import span
+
 load_dotenv()
 
+# Segundos máximos de una transcripción: el reconocimiento síncrono acepta
+# hasta un minuto de audio y puede tardar más que el timeout HTTP por defecto
+SPEECH_TO_TEXT_TIMEOUT = float(os.getenv("SPEECH_TO_TEXT_TIMEOUT", "60"))
 
-def transcribir_audio(audio_bytes, mime_type="audio/ogg"):
-    """
-    Transcribe audio usando Google Speech-to-Text v1p1beta1.
-    Devuelve SOLO el texto transcrito.
-    """
+
+def _speech_request(audio_bytes):
+    """``(url, body)`` de la petición a Speech-to-Text, o ``None`` sin API key."""
     GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
     if not GOOGLE_API_KEY:
-        return "ERROR: Falta GOOGLE_API_KEY en variables de entorno"
+        return None
 
     # Se convierte el audio en base64
     audio_b64 = base64.b64encode(audio_bytes).decode("utf-8")
@@ -33,8 +38,11 @@ def transcribir_audio(audio_bytes, mime_type="audio/ogg"):
         },
     }
 
-    response = requests.post(url, json=body)
+    return url, body
+
 
+def _parse_transcript(response):
+    # Sirve igual para respuestas de requests y de httpx
     if response.status_code != 200:
         return f"ERROR: {response.text}"
 
@@ -46,3 +54,38 @@ def transcribir_audio(audio_bytes, mime_type="audio/ogg"):
 
     transcript = data["results"][0]["alternatives"][0]["transcript"]
     return transcript
+
+
+def transcribir_audio(audio_bytes, mime_type="audio/ogg"):
+    """
+    Transcribe audio usando Google Speech-to-Text v1p1beta1.
+    Devuelve SOLO el texto transcrito.
+    """
+    request = _speech_request(audio_bytes)
+    if request is None:
+        return "ERROR: Falta GOOGLE_API_KEY en variables de entorno"
+    url, body = request
+
+    with span("speech_to_text"):
+        response = requests.post(url, json=body, timeout=SPEECH_TO_TEXT_TIMEOUT)
+
+    return _parse_transcript(response)
+
+
+async def transcribir_audio_async(audio_bytes, mime_type="audio/ogg"):
+    """
+    Versión asíncrona de ``transcribir_audio`` con el cliente httpx compartido.
+
+    El base64 de hasta 7 MB de audio se arma en un hilo, fuera del event loop.
+    """
+    request = await asyncio.to_thread(_speech_request, audio_bytes)
+    if request is None:
+        return "ERROR: Falta GOOGLE_API_KEY en variables de entorno"
+    url, body = request
+
+    with span("speech_to_text"):
+        response = await get_async_client().post(
+            url, json=body, timeout=SPEECH_TO_TEXT_TIMEOUT
+        )
+
+    return _parse_transcript(response)
@@ -1,26 +1,37 @@
+import asyncio
 import base64
 import os
 from io import BytesIO
+from typing import TYPE_CHECKING
 
 from dotenv import load_dotenv
-from langchain_core.messages import HumanMessage
-from langchain_google_genai import ChatGoogleGenerativeAI
-from PIL import Image
 
-load_dotenv()
+from utils.lazy import lazy_imports
+from utils.llm import GEMINI_CLIENT_MAX_RETRIES, get_chat_model
+from utils.metrics import span
+from utils.ratelimit import acall_model, call_model
 
+if TYPE_CHECKING:
+    from langchain_core.messages import HumanMessage
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    from PIL import Image
 
-def detectar(image_bytes, mime_type="image/jpeg"):
-    GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-    if not GEMINI_API_KEY:
-        return '{"error": "No existe la variable de entorno GEMINI_API_KEY"}'
+# Dependencias pesadas: se importan la primera vez que llega una imagen
+_load, __getattr__ = lazy_imports(
+    globals(),
+    {
+        "HumanMessage": "langchain_core.messages:HumanMessage",
+        "ChatGoogleGenerativeAI": "langchain_google_genai:ChatGoogleGenerativeAI",
+        "Image": "PIL.Image",
+    },
+)
 
-    try:
-        llm = ChatGoogleGenerativeAI(
-            model="gemini-2.5-flash", api_key=GEMINI_API_KEY, temperature=0.1
-        )
+load_dotenv()
+
+DETECTION_MODEL = "gemini-2.5-flash"
 
-        prompt = """
+
+DETECTION_PROMPT = """
 Actúa como un experto en identificación y nutrición de alimentos.
 
 Analiza la imagen y devuelve EXCLUSIVAMENTE un JSON válido con el formato:
@@ -49,34 +60,87 @@ JSON:
 
 """
 
-        encoded_image = base64.b64encode(image_bytes).decode("utf-8")
 
-        msg = HumanMessage(
-            content=[
-                {"type": "text", "text": prompt},
-                {
-                    "type": "image_url",
-                    "image_url": {"url": f"data:{mime_type};base64,{encoded_image}"},
-                },
-            ]
-        )
+def _detection_message(image_bytes, mime_type):
+    _load("HumanMessage")
+    encoded_image = base64.b64encode(image_bytes).decode("utf-8")
+
+    return HumanMessage(
+        content=[
+            {"type": "text", "text": DETECTION_PROMPT},
+            {
+                "type": "image_url",
+                "image_url": {"url": f"data:{mime_type};base64,{encoded_image}"},
+            },
+        ]
+    )
 
-        response = llm.invoke([msg])
-        raw = response.content.strip()
 
-        if raw.startswith("```"):
-            lines = raw.split("\n")
-            raw = "\n".join(
-                [line for line in lines if not line.strip().startswith("```")]
-            ).strip()
+def _clean_response(content):
+    raw = content.strip()
 
-        return raw
+    if raw.startswith("```"):
+        lines = raw.split("\n")
+        raw = "\n".join(
+            [line for line in lines if not line.strip().startswith("```")]
+        ).strip()
+
+    return raw
+
+
+def detection_llm(api_key):
+    """Cliente Gemini de detección de alimentos, compartido por proceso."""
+    _load("ChatGoogleGenerativeAI")
+    return get_chat_model(
+        ChatGoogleGenerativeAI,
+        model=DETECTION_MODEL,
+        api_key=api_key,
+        temperature=0.1,
+        max_retries=GEMINI_CLIENT_MAX_RETRIES,
+    )
+
+
+def detectar(image_bytes, mime_type="image/jpeg"):
+    GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+    if not GEMINI_API_KEY:
+        return '{"error": "No existe la variable de entorno GEMINI_API_KEY"}'
+
+    try:
+        llm = detection_llm(GEMINI_API_KEY)
+        msg = _detection_message(image_bytes, mime_type)
+
+        with span("gemini_image"):
+            response = call_model(DETECTION_MODEL, "reply", llm.invoke, [msg])
+        return _clean_response(response.content)
 
     except Exception as e:
         return f'{{"error": "Error procesando imagen: {str(e)}"}}'
 
 
-def detectar_auto(image_bytes):
+async def detectar_async(image_bytes, mime_type="image/jpeg"):
+    """
+    Versión asíncrona de ``detectar`` (``llm.ainvoke``, sin bloquear el event loop).
+
+    El base64 de la imagen (hasta 10 MB) se arma en un hilo.
+    """
+    GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+    if not GEMINI_API_KEY:
+        return '{"error": "No existe la variable de entorno GEMINI_API_KEY"}'
+
+    try:
+        llm = detection_llm(GEMINI_API_KEY)
+        msg = await asyncio.to_thread(_detection_message, image_bytes, mime_type)
+
+        with span("gemini_image"):
+            response = await acall_model(DETECTION_MODEL, "reply", llm.ainvoke, [msg])
+        return _clean_response(response.content)
+
+    except Exception as e:
+        return f'{{"error": "Error procesando imagen: {str(e)}"}}'
+
+
+def _detect_mime(image_bytes):
+    _load("Image")
     try:
         image = Image.open(BytesIO(image_bytes))
 
@@ -94,4 +158,14 @@ def detectar_auto(image_bytes):
     except Exception:
         mime_type = "image/jpeg"
 
-    return detectar(image_bytes, mime_type)
+    return mime_type
+
+
+def detectar_auto(image_bytes):
+    return detectar(image_bytes, _detect_mime(image_bytes))
+
+
+async def detectar_auto_async(image_bytes):
+    # PIL lee la cabecera (y la primera vez se importa) en un hilo
+    mime_type = await asyncio.to_thread(_detect_mime, image_bytes)
+    return await detectar_async(image_bytes, mime_type)
@@ -0,0 +1,222 @@
+import threading
+import time
+from collections import OrderedDict
+
+from utils.metrics import REGISTRY
+
+_MISSING = object()
+
+SESSION_EVICTIONS = REGISTRY.counter(
+    "victoria_session_evictions_total",
+    "Sesiones expulsadas de una SessionCache por motivo (size, idle, memory).",
+    ("cache", "reason"),
+)
+SESSION_ENTRIES = REGISTRY.gauge(
+    "victoria_session_cache_entries",
+    "Sesiones vivas en cada SessionCache.",
+    ("cache",),
+)
+SESSION_BYTES = REGISTRY.gauge(
+    "victoria_session_cache_bytes",
+    "Memoria aproximada (bytes) de las sesiones de cada SessionCache.",
+    ("cache",),
+)
+
+
+class TTLCache:
+    """
+    Caché en memoria acotada por tamaño (LRU) y por tiempo de vida (TTL).
+
+    Es segura entre hilos y lleva contadores de aciertos/fallos. Pensada para
+    estado pequeño y caliente del proceso (ids de mensajes ya vistos, etc.).
+    """
+
+    def __init__(self, maxsize: int = 10_000, ttl: float = 3600.0) -> None:
+        """Crea la caché con ``maxsize`` entradas como máximo y ``ttl`` en segundos."""
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING:
+                value, expires_at = item
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl: float | None = None) -> None:
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, _MISSING)
+            return default if item is _MISSING else item[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key) -> bool:
+        """Indica si ``key`` está presente y no ha expirado."""
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        """Número de entradas guardadas (incluye las expiradas aún no purgadas)."""
+        return len(self._data)
+
+
+class SessionCache:
+    """
+    Caché de sesiones con límite LRU, expiración por inactividad y presupuesto
+    aproximado de memoria.
+
+    A diferencia de ``TTLCache`` el TTL es deslizante: cada ``get`` renueva el
+    plazo. ``sizeof(valor)`` estima los bytes de una sesión; se recalcula en
+    cada acceso, porque la memoria de una conversación crece con los turnos.
+    Cuando se supera ``maxsize`` o ``max_bytes`` se expulsan las sesiones
+    usadas hace más tiempo. Cada expulsión se cuenta en
+    ``victoria_session_evictions_total`` con su motivo; quien usa la caché
+    debe poder reconstruir una sesión expulsada a partir de estado persistido.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        maxsize: int = 1000,
+        idle_ttl: float = 1800.0,
+        max_bytes: int | None = None,
+        sizeof=None,
+    ) -> None:
+        """Crea una caché vacía; ``name`` es la etiqueta de sus métricas."""
+        self.name = name
+        self.maxsize = maxsize
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or (lambda value: 0)
+        self.hits = 0
+        self.misses = 0
+        # key -> [valor, último uso (monotonic), bytes estimados]
+        self._data: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and now - entry[1] > self.idle_ttl:
+                self._evict(key, "idle")
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            entry[1] = now
+            self._data.move_to_end(key)
+            self._resize(entry)
+            self.hits += 1
+            self._enforce_limits(keep=key)
+            return entry[0]
+
+    def set(self, key, value) -> None:
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            entry = [value, time.monotonic(), 0]
+            self._data[key] = entry
+            self._resize(entry)
+            self._enforce_limits(keep=key)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return default
+            self._bytes -= entry[2]
+            self._report()
+            return entry[0]
+
+    def purge_expired(self) -> int:
+        """Expulsa las sesiones inactivas; devuelve cuántas se quitaron."""
+        cutoff = time.monotonic() - self.idle_ttl
+        with self._lock:
+            expired = [k for k, e in self._data.items() if e[1] < cutoff]
+            for key in expired:
+                self._evict(key, "idle")
+            return len(expired)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+            self._report()
+
+    @property
+    def approx_bytes(self) -> int:
+        return self._bytes
+
+    def __contains__(self, key) -> bool:
+        """Indica si hay una sesión vigente para ``key`` (sin renovarla)."""
+        entry = self._data.get(key)
+        return entry is not None and time.monotonic() - entry[1] <= self.idle_ttl
+
+    def __len__(self) -> int:
+        """Número de sesiones guardadas."""
+        return len(self._data)
+
+    def __getitem__(self, key):
+        """Como ``get``, pero lanza ``KeyError`` si no hay sesión vigente."""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value) -> None:
+        """Equivale a ``set``."""
+        self.set(key, value)
+
+    # --- Internos (con el lock tomado) ---------------------------------
+
+    def _resize(self, entry: list) -> None:
+        try:
+            size = int(self.sizeof(entry[0]))
+        except Exception:
+            size = entry[2]
+        self._bytes += size - entry[2]
+        entry[2] = size
+
+    def _evict(self, key, reason: str) -> None:
+        entry = self._data.pop(key)
+        self._bytes -= entry[2]
+        SESSION_EVICTIONS.inc(cache=self.name, reason=reason)
+
+    def _enforce_limits(self, keep) -> None:
+        # La sesión recién usada nunca se expulsa, aunque por sí sola supere
+        # el presupuesto de memoria.
+        while len(self._data) > self.maxsize:
+            self._evict(next(iter(self._data)), "size")
+        if self.max_bytes is not None:
+            while self._bytes > self.max_bytes and len(self._data) > 1:
+                oldest = next(iter(self._data))
+                if oldest == keep:
+                    break
+                self._evict(oldest, "memory")
+        self._report()
+
+    def _report(self) -> None:
+        SESSION_ENTRIES.set(len(self._data), cache=self.name)
+        SESSION_BYTES.set(self._bytes, cache=self.name)
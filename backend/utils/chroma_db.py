@@ -1,36 +1,81 @@
 import json
+import threading
 import uuid
+from typing import TYPE_CHECKING
 
-import chromadb
 import dotenv
-from chromadb.config import Settings
-from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
 
-dotenv.load_dotenv()
+from utils.lazy import lazy_imports
+from utils.llm import GEMINI_CLIENT_MAX_RETRIES, get_chat_model
+from utils.ratelimit import call_model
 
-embeddings = GoogleGenerativeAIEmbeddings(
-    model="models/embedding-001",
-)
+if TYPE_CHECKING:
+    import chromadb
+    from chromadb.config import Settings
+    from langchain_google_genai import (
+        ChatGoogleGenerativeAI,
+        GoogleGenerativeAIEmbeddings,
+    )
 
-llm = ChatGoogleGenerativeAI(
-    model="gemini-2.0-flash",
-    temperature=0.7,
+# Chroma y los clientes de Gemini se crean en el primer uso, no al importar
+_load, __getattr__ = lazy_imports(
+    globals(),
+    {
+        "chromadb": "chromadb",
+        "Settings": "chromadb.config:Settings",
+        "ChatGoogleGenerativeAI": "langchain_google_genai:ChatGoogleGenerativeAI",
+        "GoogleGenerativeAIEmbeddings": (
+            "langchain_google_genai:GoogleGenerativeAIEmbeddings"
+        ),
+    },
 )
 
-client = chromadb.Client(
-    Settings(persist_directory="./chroma_db", anonymized_telemetry=False)
-)
+dotenv.load_dotenv()
+
+EMBEDDING_MODEL = "models/embedding-001"
+FACTS_MODEL = "gemini-2.0-flash"
+
+_collection_lock = threading.Lock()
+_collection = None
 
-collection = client.get_or_create_collection(name="long_term_memory")
+
+def _embeddings():
+    _load("GoogleGenerativeAIEmbeddings")
+    return get_chat_model(GoogleGenerativeAIEmbeddings, model=EMBEDDING_MODEL)
+
+
+def _llm():
+    _load("ChatGoogleGenerativeAI")
+    return get_chat_model(
+        ChatGoogleGenerativeAI,
+        model=FACTS_MODEL,
+        temperature=0.7,
+        max_retries=GEMINI_CLIENT_MAX_RETRIES,
+    )
+
+
+def _memory_collection():
+    global _collection
+    if _collection is None:
+        with _collection_lock:
+            if _collection is None:
+                _load("chromadb", "Settings")
+                client = chromadb.Client(
+                    Settings(
+                        persist_directory="./chroma_db", anonymized_telemetry=False
+                    )
+                )
+                _collection = client.get_or_create_collection(name="long_term_memory")
+    return _collection
 
 
 def store_long_term_memory(user_id: str, fact: str):
     """
     Guarda un hecho relevante en Chroma usando embeddings de Gemini.
     """
-    vector = embeddings.embed_query(fact)
+    vector = call_model(EMBEDDING_MODEL, "background", _embeddings().embed_query, fact)
 
-    collection.add(
+    _memory_collection().add(
         documents=[fact],
         embeddings=[vector],
         metadatas=[{"user_id": user_id}],
@@ -42,9 +87,11 @@ def retrieve_long_term_memory(user_id: str, query: str, k: int = 5):
     """
     Recupera los k hechos más relevantes de un usuario según la consulta.
     """
-    query_vector = embeddings.embed_query(query)
+    query_vector = call_model(
+        EMBEDDING_MODEL, "background", _embeddings().embed_query, query
+    )
 
-    results = collection.query(
+    results = _memory_collection().query(
         query_embeddings=[query_vector], n_results=k, where={"user_id": user_id}
     )
 
@@ -77,7 +124,7 @@ Devuelve SOLO este formato JSON:
 **Importante**: Dame solo el string JSON, no en formato código.
 """
 
-    response = llm.invoke(prompt)
+    response = call_model(FACTS_MODEL, "background", _llm().invoke, prompt)
     print(response)
     try:
         return json.loads(response.content).get("facts", [])
@@ -0,0 +1,178 @@
+import logging
+import os
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from db.db import ConversationState, SessionLocal, WhatsAppMessage
+from db.session import db_session
+from utils.metrics import span
+
+logging.basicConfig(level=logging.INFO)
+
+# Backend del estado de conversación: "sql" (PostgreSQL/SQLite), "memory"
+# (un solo proceso, tests) o "none" (solo la memoria local del worker).
+CONVERSATION_STATE_BACKEND = os.getenv("CONVERSATION_STATE_BACKEND", "sql")
+# Usuarios anteriores a conversation_states: mensajes de whatsapp_messages con
+# los que se arranca su estado la primera vez.
+SESSION_REBUILD_MESSAGES = int(os.getenv("SESSION_REBUILD_MESSAGES", "20"))
+
+
+@dataclass
+class ConversationSnapshot:
+    """
+    Resumen acumulado y turnos ``(direction, texto)`` de un teléfono.
+
+    ``turns`` son todos los turnos que todavía no entraron al resumen: no se
+    recortan al guardar, así que otro worker (o ``_restore_memory`` tras un
+    cambio de versión) rehidrata exactamente la memoria local. Su tamaño lo
+    acota el resumen diferido (``utils.memory_summary``).
+    """
+
+    summary: str = ""
+    turns: list[tuple[str, str]] = field(default_factory=list)
+    version: int = 0
+
+
+class InMemoryConversationStateStore:
+    """Implementación en memoria (un solo proceso); pensada para tests."""
+
+    def __init__(self) -> None:
+        """Crea un almacén vacío."""
+        self._data: dict[str, ConversationSnapshot] = {}
+        self._lock = threading.Lock()
+
+    def load(self, phone: str) -> ConversationSnapshot | None:
+        with self._lock:
+            snapshot = self._data.get(phone)
+            if snapshot is None:
+                return None
+            return ConversationSnapshot(
+                snapshot.summary, list(snapshot.turns), snapshot.version
+            )
+
+    def load_if_newer(self, phone: str, version: int) -> ConversationSnapshot | None:
+        with self._lock:
+            snapshot = self._data.get(phone)
+            if snapshot is None or snapshot.version == version:
+                return None
+            return ConversationSnapshot(
+                snapshot.summary, list(snapshot.turns), snapshot.version
+            )
+
+    def save(self, phone: str, summary: str, turns: list[tuple[str, str]]) -> int:
+        turns = list(turns)
+        with self._lock:
+            previous = self._data.get(phone)
+            version = (previous.version if previous else 0) + 1
+            self._data[phone] = ConversationSnapshot(summary or "", turns, version)
+            return version
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+class SQLConversationStateStore:
+    """
+    Estado de conversación en la tabla ``conversation_states``.
+
+    ``load`` es una lectura por clave primaria y ``save`` un único
+    ``INSERT ... ON CONFLICT DO UPDATE`` que incrementa ``version``; funciona
+    igual sobre PostgreSQL que sobre SQLite. ``load_if_newer`` es la
+    comprobación de cada turno con la sesión ya en caché: la misma lectura,
+    pero la fila solo viaja si otro worker cambió la versión. Dentro de una unidad de trabajo
+    (``db.session``) usan su sesión y ``save`` se confirma con ella.
+    """
+
+    def __init__(self, session_factory=SessionLocal) -> None:
+        """Configura la fábrica de sesiones de BD."""
+        self.session_factory = session_factory
+
+    def load(self, phone: str) -> ConversationSnapshot | None:
+        with db_session(self.session_factory) as db:
+            with span("db_conversation_load"):
+                row = db.execute(
+                    select(
+                        ConversationState.summary,
+                        ConversationState.turns,
+                        ConversationState.version,
+                    ).where(ConversationState.phone == phone)
+                ).first()
+            if row is not None:
+                return ConversationSnapshot(
+                    row.summary or "",
+                    [tuple(t) for t in row.turns or []],
+                    row.version,
+                )
+            return self._bootstrap(db, phone)
+
+    def load_if_newer(self, phone: str, version: int) -> ConversationSnapshot | None:
+        with db_session(self.session_factory) as db:
+            with span("db_conversation_check"):
+                row = db.execute(
+                    select(
+                        ConversationState.summary,
+                        ConversationState.turns,
+                        ConversationState.version,
+                    ).where(
+                        ConversationState.phone == phone,
+                        ConversationState.version != version,
+                    )
+                ).first()
+        if row is None:
+            return None
+        return ConversationSnapshot(
+            row.summary or "", [tuple(t) for t in row.turns or []], row.version
+        )
+
+    def _bootstrap(self, db, phone: str) -> ConversationSnapshot | None:
+        # Solo para teléfonos sin fila todavía: últimos mensajes guardados
+        with span("db_conversation_bootstrap"):
+            rows = db.execute(
+                select(WhatsAppMessage.direction, WhatsAppMessage.message)
+                .where(WhatsAppMessage.phone == phone)
+                .order_by(WhatsAppMessage.id.desc())
+                .limit(SESSION_REBUILD_MESSAGES)
+            ).all()
+        if not rows:
+            return None
+        return ConversationSnapshot(turns=[(d, m) for d, m in reversed(rows)])
+
+    def save(self, phone: str, summary: str, turns: list[tuple[str, str]]) -> int:
+        values = {
+            "phone": phone,
+            "summary": summary or "",
+            "turns": [list(t) for t in turns],
+            "version": 1,
+            "updated_at": datetime.utcnow(),
+        }
+        with db_session(self.session_factory) as db:
+            dialect = postgresql if db.bind.dialect.name == "postgresql" else sqlite
+            stmt = dialect.insert(ConversationState).values(**values)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[ConversationState.phone],
+                set_={
+                    "summary": stmt.excluded.summary,
+                    "turns": stmt.excluded.turns,
+                    "version": ConversationState.version + 1,
+                    "updated_at": stmt.excluded.updated_at,
+                },
+            ).returning(ConversationState.version)
+            with span("db_conversation_save"):
+                return db.execute(stmt).scalar_one()
+
+
+def build_state_store(backend: str | None = None):
+    """Crea el almacén indicado por ``CONVERSATION_STATE_BACKEND`` (o ``None``)."""
+    backend = (backend or CONVERSATION_STATE_BACKEND).lower()
+    if backend == "sql":
+        return SQLConversationStateStore()
+    if backend == "memory":
+        return InMemoryConversationStateStore()
+    if backend == "none":
+        return None
+    raise ValueError(f"CONVERSATION_STATE_BACKEND desconocido: {backend}")
@@ -0,0 +1,81 @@
+"""
+Contadores por teléfono de ``whatsapp_messages`` (tabla ``conversation_stats``).
+
+``record_messages`` recibe los mensajes recién agregados a la sesión, antes
+del commit, y los suma con un ``INSERT ... ON CONFLICT DO UPDATE`` por
+teléfono: contador y mensajes se confirman (o se descartan) juntos.
+"""
+
+from sqlalchemy import case
+from sqlalchemy.dialects import postgresql, sqlite
+
+from db.db import ConversationStats, WhatsAppMessage
+
+
+def record_messages(db, messages: list[WhatsAppMessage]) -> None:
+    """
+    Suma ``messages`` (ya agregados a ``db``) a los contadores de su teléfono.
+
+    Hace ``flush`` para conocer los ids; el commit queda a cargo del llamador.
+    """
+    if not messages:
+        return
+    db.flush()
+
+    by_phone: dict[str, dict] = {}
+    for m in messages:
+        values = by_phone.setdefault(
+            m.phone,
+            {
+                "messages_in": 0,
+                "messages_out": 0,
+                "last_message_id": None,
+                "last_message_at": None,
+            },
+        )
+        values["messages_in" if m.direction == "in" else "messages_out"] += 1
+        if values["last_message_id"] is None or m.id > values["last_message_id"]:
+            values["last_message_id"] = m.id
+            values["last_message_at"] = m.created_at
+
+    dialect = postgresql if db.bind.dialect.name == "postgresql" else sqlite
+    for phone, values in by_phone.items():
+        stmt = dialect.insert(ConversationStats).values(phone=phone, **values)
+        # Con last_message_id NULL la comparación es NULL y gana el nuevo
+        newer = ConversationStats.last_message_id > stmt.excluded.last_message_id
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[ConversationStats.phone],
+            set_={
+                "messages_in": ConversationStats.messages_in
+                + stmt.excluded.messages_in,
+                "messages_out": ConversationStats.messages_out
+                + stmt.excluded.messages_out,
+                "last_message_id": case(
+                    (newer, ConversationStats.last_message_id),
+                    else_=stmt.excluded.last_message_id,
+                ),
+                "last_message_at": case(
+                    (newer, ConversationStats.last_message_at),
+                    else_=stmt.excluded.last_message_at,
+                ),
+            },
+        )
+        db.execute(stmt)
+
+
+def message_count(db, phone: str) -> int:
+    """Total de mensajes (entrantes y salientes) del teléfono; lectura por PK."""
+    stats = db.get(ConversationStats, phone)
+    return stats.total_messages if stats else 0
+
+
+def recent_messages(db, phone: str, limit: int) -> list[WhatsAppMessage]:
+    """Últimos ``limit`` mensajes del teléfono en orden cronológico."""
+    rows = (
+        db.query(WhatsAppMessage)
+        .filter(WhatsAppMessage.phone == phone)
+        .order_by(WhatsAppMessage.id.desc())
+        .limit(limit)
+        .all()
+    )
+    return rows[::-1]
@@ -0,0 +1,139 @@
+import os
+import random
+import re
+import unicodedata
+
+from utils.metrics import REGISTRY
+
+# Respuesta local (sin Gemini) para agradecimientos, confirmaciones y emojis
+FAST_PATH_ENABLED = os.getenv("FAST_PATH_ENABLED", "1") == "1"
+# Los mensajes triviales son cortos; lo demás ni se clasifica
+FAST_PATH_MAX_CHARS = int(os.getenv("FAST_PATH_MAX_CHARS", "60"))
+
+FAST_PATH_REPLIES = REGISTRY.counter(
+    "victoria_fast_path_replies_total",
+    "Mensajes triviales respondidos con plantilla local por intención.",
+    ("intent",),
+)
+
+# Palabras que por sí solas no dicen nada ("muchas gracias", "ok va")
+_FILLER = "muchas muchisimas mil muy bien super va dale si bueno entonces".split()
+
+# Orden de prioridad: "ok gracias, chao" es una despedida
+_INTENT_WORDS = {
+    "bye": "chao chau adios bye hasta luego pronto".split(),
+    "thanks": "gracias graciass agradecido agradecida".split(),
+    "ack": (
+        "ok oki okey okay vale listo perfecto entendido entiendo claro "
+        "genial excelente jaja jeje jiji".split()
+    ),
+}
+
+_TEMPLATES = {
+    "bye": (
+        "¡Hasta pronto! 👋 Aquí estaré cuando quieras seguir conversando.",
+        "¡Cuídate mucho! 👋 Escríbeme cuando quieras.",
+    ),
+    "thanks": (
+        "¡Con gusto! 😊 Aquí estoy si necesitas algo más.",
+        "¡Para eso estoy! 😊 Cuéntame cuando quieras cómo te va.",
+    ),
+    "ack": (
+        "¡Perfecto! 😊 Cualquier cosa, me escribes.",
+        "¡Genial! 🙌 Aquí estoy si necesitas algo.",
+    ),
+    "emoji": ("😊", "🙌"),
+}
+
+# Palabras tal como quedan tras ``_normalize``
+_WORDS = re.compile(r"[a-zñ]+")
+_REPEATS = re.compile(r"(.)\1+")
+_LAUGH = re.compile(r"(?:ja|je|ji)+")
+_EMOJI_EXTRAS = {"\u200d", "\ufe0e", "\ufe0f"}  # ZWJ y selectores de variante
+
+
+def _normalize(word: str) -> str:
+    # "Graciasss" -> "gracias", "okkk" -> "ok", "jajaja" -> "jaja"
+    word = _REPEATS.sub(r"\1", word)
+    return "jaja" if _LAUGH.fullmatch(word) else word
+
+
+def _build_index() -> dict[str, str | None]:
+    index: dict[str, str | None] = {_normalize(w): None for w in _FILLER}
+    for intent, words in reversed(_INTENT_WORDS.items()):
+        index.update({_normalize(w): intent for w in words})
+    return index
+
+
+# Palabra normalizada -> intención (``None`` para relleno)
+_INDEX = _build_index()
+_PRIORITY = {intent: rank for rank, intent in enumerate(_INTENT_WORDS)}
+
+
+def _strip_accents(text: str) -> str:
+    decomposed = unicodedata.normalize("NFD", text)
+    # La ñ se conserva: "n" + tilde combinada se recompone
+    return unicodedata.normalize(
+        "NFC",
+        "".join(
+            c for c in decomposed if unicodedata.category(c) != "Mn" or c == "\u0303"
+        ),
+    )
+
+
+def _is_emoji(char: str) -> bool:
+    return unicodedata.category(char) in ("So", "Sk") or char in _EMOJI_EXTRAS
+
+
+def classify_intent(text: str | None) -> str | None:
+    """
+    Clasifica un mensaje trivial: ``"thanks"``, ``"ack"``, ``"bye"`` o ``"emoji"``.
+
+    Un mensaje es trivial si todas sus palabras están en el índice de
+    palabras clave (intenciones más relleno) y el resto son emojis o
+    puntuación. Cualquier palabra desconocida lo manda al LLM: "gracias,
+    ¿y qué ceno?" devuelve ``None``. Los saludos tampoco se atajan, porque
+    abren la conversación.
+    """
+    if not text or len(text) > FAST_PATH_MAX_CHARS:
+        return None
+    lowered = _strip_accents(text.lower())
+
+    intent = None
+    for word in _WORDS.findall(lowered):
+        word = _normalize(word)
+        if word not in _INDEX:
+            return None
+        found = _INDEX[word]
+        if found and (intent is None or _PRIORITY[found] < _PRIORITY[intent]):
+            intent = found
+    if intent:
+        return intent
+
+    rest = _WORDS.sub("", lowered)
+    if any(_is_emoji(c) for c in rest) and all(
+        _is_emoji(c) or not c.isalnum() for c in rest
+    ):
+        return "emoji"
+    return None
+
+
+def fast_reply(text: str | None, last_reply=None) -> str | None:
+    """
+    Respuesta de plantilla para un mensaje trivial, o ``None`` si va al LLM.
+
+    ``last_reply`` devuelve el último mensaje de Victoria y solo se llama
+    para confirmaciones y emojis: si fue una pregunta, un "ok" o un 👍 son
+    una respuesta y van al LLM. Agradecer y despedirse se atajan siempre.
+    """
+    if not FAST_PATH_ENABLED:
+        return None
+    intent = classify_intent(text)
+    if intent is None:
+        return None
+    if intent in ("ack", "emoji") and last_reply is not None:
+        previous = (last_reply() or "").rstrip()
+        if previous.endswith("?"):
+            return None
+    FAST_PATH_REPLIES.inc(intent=intent)
+    return random.choice(_TEMPLATES[intent])
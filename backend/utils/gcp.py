@@ -1,18 +1,61 @@
+import asyncio
 import logging
 import os
+import threading
+from typing import TYPE_CHECKING
 
-from google.cloud import storage
+from utils.lazy import lazy_imports
+from utils.metrics import span
+
+if TYPE_CHECKING:
+    from google.cloud import storage
+
+# google-cloud-storage se importa en la primera subida
+_load, __getattr__ = lazy_imports(globals(), {"storage": "google.cloud.storage"})
 
 logging.basicConfig(level=logging.INFO)
 
+# Tamaño de bloque de las subidas reanudables (múltiplo de 256 KiB)
+GCP_UPLOAD_CHUNK_BYTES = int(os.getenv("GCP_UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+
+_client_lock = threading.Lock()
+_client: "tuple[int, storage.Client] | None" = None
+
 
-def upload_image_to_gcp(image_bytes: bytes, filename: str) -> str | None:
+def get_storage_client() -> "storage.Client":
     """
-    Sube una imagen a un bucket de GCP y devuelve la URL pública (si el bucket lo permite).
+    Cliente de Cloud Storage compartido por todo el proceso.
 
-    Requiere:
-    - GCP_BUCKET_NAME: nombre del bucket
-    - Credenciales de servicio configuradas (GOOGLE_APPLICATION_CREDENTIALS o similar)
+    Crear ``storage.Client()`` resuelve credenciales y abre una sesión HTTP,
+    así que se hace una sola vez por proceso. Se guarda junto al pid: un
+    worker creado con ``fork`` no reutiliza el cliente (ni sus sockets) del
+    proceso padre.
+    """
+    global _client
+    pid = os.getpid()
+    client = _client
+    if client is None or client[0] != pid:
+        with _client_lock:
+            if _client is None or _client[0] != pid:
+                _load()
+                _client = (pid, storage.Client())
+            client = _client
+    return client[1]
+
+
+def upload_file_to_gcp(
+    fileobj,
+    filename: str,
+    size: int | None = None,
+    content_type: str | None = None,
+) -> str | None:
+    """
+    Sube un archivo a GCS por bloques (subida reanudable) sin leerlo entero.
+
+    ``fileobj`` puede ser cualquier archivo con ``read``/``seek`` (por ejemplo
+    el ``SpooledTemporaryFile`` de ``download_whatsapp_media_stream``). Solo
+    se mantiene en memoria un bloque de ``GCP_UPLOAD_CHUNK_BYTES`` a la vez.
+    Devuelve la URL pública o ``None`` si falla.
     """
     bucket_name = os.getenv("GCP_BUCKET_NAME")
     if not bucket_name:
@@ -20,15 +63,33 @@ def upload_image_to_gcp(image_bytes: bytes, filename: str) -> str | None:
         return None
 
     try:
-        client = storage.Client()
+        client = get_storage_client()
         bucket = client.bucket(bucket_name)
-        blob = bucket.blob(filename)
-        blob.upload_from_string(image_bytes)
-
-        # Si el bucket es público o tiene acceso anónimo, esta será la URL accesible
+        blob = bucket.blob(filename, chunk_size=GCP_UPLOAD_CHUNK_BYTES)
+        with span("gcs_upload"):
+            blob.upload_from_file(
+                fileobj, rewind=True, size=size, content_type=content_type
+            )
         return blob.public_url
     except Exception as e:
         logging.exception(
-            "[GCP STORAGE] Error subiendo imagen a bucket %s: %s", bucket_name, e
+            "[GCP STORAGE] Error subiendo archivo a bucket %s: %s", bucket_name, e
         )
         return None
+
+
+async def upload_file_to_gcp_async(
+    fileobj,
+    filename: str,
+    size: int | None = None,
+    content_type: str | None = None,
+) -> str | None:
+    """
+    Versión asíncrona de ``upload_file_to_gcp``.
+
+    El SDK de Cloud Storage no tiene cliente asíncrono, así que la subida
+    corre en un hilo (``asyncio.to_thread``) sin bloquear el event loop.
+    """
+    return await asyncio.to_thread(
+        upload_file_to_gcp, fileobj, filename, size, content_type
+    )
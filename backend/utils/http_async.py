@@ -0,0 +1,45 @@
+import asyncio
+import os
+import weakref
+
+import httpx
+
+# Límites del cliente HTTP asíncrono compartido. Con el pipeline asíncrono un
+# proceso mantiene cientos de conversaciones en vuelo, así que las conexiones
+# a Graph API / Speech-to-Text se reutilizan (keep-alive) en lugar de abrir
+# una por petición.
+ASYNC_HTTP_MAX_CONNECTIONS = int(os.getenv("ASYNC_HTTP_MAX_CONNECTIONS", "200"))
+ASYNC_HTTP_MAX_KEEPALIVE = int(os.getenv("ASYNC_HTTP_MAX_KEEPALIVE", "50"))
+ASYNC_HTTP_TIMEOUT = float(os.getenv("ASYNC_HTTP_TIMEOUT", "20"))
+
+# Un cliente por event loop: httpx.AsyncClient no puede compartirse entre loops.
+_CLIENTS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """
+    Devuelve el ``httpx.AsyncClient`` del event loop actual, creándolo si hace falta.
+
+    Debe llamarse desde una corrutina. El cliente se cierra con
+    ``aclose_async_client`` al detener el loop (lo hace ``AsyncWorkerPool``).
+    """
+    loop = asyncio.get_running_loop()
+    client = _CLIENTS.get(loop)
+    if client is None or client.is_closed:
+        client = _CLIENTS[loop] = httpx.AsyncClient(
+            timeout=ASYNC_HTTP_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=ASYNC_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=ASYNC_HTTP_MAX_KEEPALIVE,
+            ),
+        )
+    return client
+
+
+async def aclose_async_client() -> None:
+    """Cierra el cliente del event loop actual, si existe."""
+    client = _CLIENTS.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
@@ -0,0 +1,753 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections.abc import Awaitable, Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, exists, func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
+
+from db.db import SessionLocal, WebhookJob
+from utils.http_async import aclose_async_client
+from utils.metrics import REGISTRY, span
+
+logging.basicConfig(level=logging.INFO)
+
+# Estados posibles de un trabajo en la cola
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+DEAD = "dead"
+
+# Retención de los trabajos terminados: los 'done' solo sirven para depurar;
+# los 'dead' se guardan más para revisarlos o reencolarlos (``requeue``).
+JOB_RETENTION_DONE_SECONDS = float(
+    os.getenv("JOB_RETENTION_DONE_SECONDS", str(24 * 3600))
+)
+JOB_RETENTION_DEAD_SECONDS = float(
+    os.getenv("JOB_RETENTION_DEAD_SECONDS", str(7 * 24 * 3600))
+)
+# Cada cuánto barre un proceso los trabajos vencidos, y filas por DELETE
+JOB_PURGE_INTERVAL = float(os.getenv("JOB_PURGE_INTERVAL", "300"))
+JOB_PURGE_BATCH_SIZE = int(os.getenv("JOB_PURGE_BATCH_SIZE", "1000"))
+
+JOBS_TOTAL = REGISTRY.counter(
+    "victoria_jobs_total",
+    "Trabajos de la cola terminados por tipo y resultado (done, retry, dead).",
+    ("kind", "result"),
+)
+JOB_DURATION = REGISTRY.histogram(
+    "victoria_job_duration_seconds",
+    "Duración del handler de cada lote de trabajos reclamado.",
+    ("kind",),
+)
+QUEUE_DEPTH = REGISTRY.gauge(
+    "victoria_queue_jobs",
+    "Trabajos en la cola por estado (se actualiza al consultar /metrics).",
+    ("status",),
+    per_process=False,
+)
+JOBS_PURGED = REGISTRY.counter(
+    "victoria_jobs_purged_total",
+    "Trabajos terminados borrados de la cola al vencer su retención.",
+    ("status",),
+)
+
+
+@dataclass
+class Job:
+    """Copia desacoplada de la sesión de un ``WebhookJob`` reclamado por un worker."""
+
+    id: int
+    kind: str
+    payload: dict
+    attempts: int
+    max_attempts: int
+    partition_key: str | None = None
+
+
+def _record_outcome(
+    store: "SQLJobStore", jobs: list[Job], elapsed: float, error: Exception | None
+) -> None:
+    """Marca un lote como terminado o fallido y actualiza las métricas."""
+    kind = jobs[0].kind
+    JOB_DURATION.observe(elapsed, kind=kind)
+    if error is None:
+        for job in jobs:
+            with span("db_job_update"):
+                store.complete(job.id)
+            JOBS_TOTAL.inc(kind=kind, result=DONE)
+        return
+
+    for job in jobs:
+        with span("db_job_update"):
+            status = store.fail(job, f"{type(error).__name__}: {error}")
+        JOBS_TOTAL.inc(kind=kind, result="retry" if status == PENDING else DEAD)
+        logging.error(
+            "[JOBS] Error procesando trabajo %s (intento %s/%s) -> %s",
+            job.id,
+            job.attempts,
+            job.max_attempts,
+            status,
+            exc_info=error,
+        )
+
+
+def _to_job(row: WebhookJob) -> Job:
+    return Job(
+        id=row.id,
+        kind=row.kind,
+        payload=row.payload,
+        attempts=row.attempts,
+        max_attempts=row.max_attempts,
+        partition_key=row.partition_key,
+    )
+
+
+class SQLJobStore:
+    """
+    Cola de trabajos durable respaldada por la tabla ``webhook_jobs``.
+
+    Funciona igual sobre PostgreSQL (producción) que sobre SQLite (tests):
+    basta con pasar otro ``session_factory``. El reclamo de un trabajo es un
+    ``UPDATE ... WHERE status = 'pending'`` condicional, así que varios
+    workers (hilos o procesos) pueden compartir la misma tabla sin tomar dos
+    veces el mismo trabajo.
+
+    Los trabajos 'done' y 'dead' se borran al vencer su retención
+    (``purge_finished``), así la tabla y el ``NOT EXISTS`` del reclamo no
+    crecen con el historial.
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        max_attempts: int = 5,
+        backoff_seconds: float = 5.0,
+        max_backoff_seconds: float = 300.0,
+        visibility_timeout: float = 600.0,
+        done_ttl: float = JOB_RETENTION_DONE_SECONDS,
+        dead_ttl: float = JOB_RETENTION_DEAD_SECONDS,
+        purge_interval: float = JOB_PURGE_INTERVAL,
+        purge_batch_size: int = JOB_PURGE_BATCH_SIZE,
+    ) -> None:
+        """Configura la fábrica de sesiones, los reintentos y la retención."""
+        self.session_factory = session_factory
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        # Un trabajo 'running' cuyo worker murió vuelve a ser reclamable
+        # pasado este tiempo.
+        self.visibility_timeout = visibility_timeout
+        self.done_ttl = done_ttl
+        self.dead_ttl = dead_ttl
+        self.purge_interval = purge_interval
+        self.purge_batch_size = purge_batch_size
+        self._next_purge = 0.0
+        self._purge_lock = threading.Lock()
+
+    def enqueue(
+        self,
+        kind: str,
+        payload: dict,
+        partition_key: str | None = None,
+        dedup_key: str | None = None,
+    ) -> int | None:
+        ids = self.enqueue_many(kind, [(payload, partition_key, dedup_key)])
+        return ids[0] if ids else None
+
+    def enqueue_many(
+        self,
+        kind: str,
+        items: list[tuple[dict, str | None, str | None]],
+        debounce_seconds: float = 0.0,
+        debounce_max_wait: float = 10.0,
+    ) -> list[int]:
+        """
+        Guarda varios trabajos en una sola transacción.
+
+        ``items`` son tuplas ``(payload, partition_key, dedup_key)`` en el
+        orden en que deben procesarse dentro de cada partición. Los trabajos
+        cuyo ``dedup_key`` ya existe (re-entregas del mismo mensaje) se
+        omiten; se devuelven solo los ids de los trabajos nuevos.
+
+        Con ``debounce_seconds > 0`` los trabajos nuevos quedan disponibles
+        tras esa ventana y los pendientes de la misma partición y tipo se
+        aplazan con ellos (ventana deslizante), para que ``claim_batch`` los
+        tome juntos. Un trabajo nunca se aplaza más de ``debounce_max_wait``
+        segundos desde su creación.
+        """
+        db = self.session_factory()
+        try:
+            keys = [key for _, _, key in items if key]
+            seen = set()
+            if keys:
+                seen.update(
+                    db.execute(
+                        select(WebhookJob.dedup_key).where(
+                            WebhookJob.dedup_key.in_(keys)
+                        )
+                    ).scalars()
+                )
+
+            jobs = []
+            for payload, partition_key, dedup_key in items:
+                if dedup_key and dedup_key in seen:
+                    continue
+                if dedup_key:
+                    seen.add(dedup_key)
+                jobs.append(self._new_job(kind, payload, partition_key, dedup_key))
+
+            if not jobs:
+                return []
+
+            if debounce_seconds > 0:
+                now = datetime.utcnow()
+                available_at = now + timedelta(seconds=debounce_seconds)
+                for job in jobs:
+                    job.available_at = available_at
+                partitions = {job.partition_key for job in jobs if job.partition_key}
+                if partitions:
+                    db.execute(
+                        update(WebhookJob)
+                        .where(
+                            WebhookJob.partition_key.in_(partitions),
+                            WebhookJob.kind == kind,
+                            WebhookJob.status == PENDING,
+                            WebhookJob.attempts == 0,
+                            WebhookJob.created_at
+                            >= now - timedelta(seconds=debounce_max_wait),
+                        )
+                        .values(available_at=available_at, updated_at=now)
+                    )
+
+            db.add_all(jobs)
+            try:
+                db.flush()
+            except IntegrityError:
+                # Otra entrega concurrente insertó alguna clave entre la
+                # consulta y el flush: se guardan uno a uno omitiendo duplicados.
+                db.rollback()
+                return self._enqueue_one_by_one(db, jobs)
+            ids = [job.id for job in jobs]
+            db.commit()
+            return ids
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _new_job(self, kind, payload, partition_key, dedup_key) -> WebhookJob:
+        return WebhookJob(
+            kind=kind,
+            payload=payload,
+            partition_key=partition_key,
+            dedup_key=dedup_key,
+            status=PENDING,
+            max_attempts=self.max_attempts,
+            available_at=datetime.utcnow(),
+        )
+
+    def _enqueue_one_by_one(self, db, jobs: list[WebhookJob]) -> list[int]:
+        ids = []
+        for job in jobs:
+            fresh = self._new_job(
+                job.kind, job.payload, job.partition_key, job.dedup_key
+            )
+            fresh.available_at = job.available_at
+            db.add(fresh)
+            try:
+                db.commit()
+            except IntegrityError:
+                db.rollback()
+                continue
+            ids.append(fresh.id)
+        return ids
+
+    def claim(self) -> Job | None:
+        """
+        Reclama el siguiente trabajo disponible y lo marca como 'running'.
+
+        Un trabajo solo es elegible si no hay otro anterior de su misma
+        partición pendiente o en curso, lo que garantiza orden estricto por
+        teléfono mientras teléfonos distintos avanzan en paralelo.
+
+        Devuelve ``None`` si no hay nada que procesar.
+        """
+        now = datetime.utcnow()
+        stale_before = now - timedelta(seconds=self.visibility_timeout)
+        earlier = aliased(WebhookJob)
+
+        db = self.session_factory()
+        try:
+            candidates = db.execute(
+                select(WebhookJob.id)
+                .where(
+                    ((WebhookJob.status == PENDING) & (WebhookJob.available_at <= now))
+                    | (
+                        (WebhookJob.status == RUNNING)
+                        & (WebhookJob.locked_at < stale_before)
+                    ),
+                    (WebhookJob.partition_key.is_(None))
+                    | ~exists().where(
+                        earlier.partition_key == WebhookJob.partition_key,
+                        earlier.id < WebhookJob.id,
+                        earlier.status.in_((PENDING, RUNNING)),
+                    ),
+                )
+                .order_by(WebhookJob.id.asc())
+                .limit(10)
+            ).scalars()
+
+            for job_id in list(candidates):
+                claimed = db.execute(
+                    update(WebhookJob)
+                    .where(
+                        WebhookJob.id == job_id,
+                        (WebhookJob.status == PENDING)
+                        | (
+                            (WebhookJob.status == RUNNING)
+                            & (WebhookJob.locked_at < stale_before)
+                        ),
+                    )
+                    .values(
+                        status=RUNNING,
+                        locked_at=now,
+                        attempts=WebhookJob.attempts + 1,
+                        updated_at=now,
+                    )
+                )
+                if claimed.rowcount != 1:
+                    # Otro worker lo tomó primero
+                    db.rollback()
+                    continue
+
+                db.commit()
+                return _to_job(db.get(WebhookJob, job_id))
+            return None
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def claim_batch(self, limit: int = 1) -> list[Job]:
+        """
+        Reclama el siguiente trabajo y los consecutivos de su misma partición.
+
+        Sirve para fusionar en un solo turno los mensajes que un mismo
+        teléfono envió en ráfaga: además del trabajo elegido por ``claim`` se
+        reclaman hasta ``limit - 1`` trabajos pendientes del mismo teléfono y
+        tipo, en orden, deteniéndose en el primero que aún no está disponible.
+        """
+        head = self.claim()
+        if head is None:
+            return []
+        if limit <= 1 or head.partition_key is None:
+            return [head]
+
+        now = datetime.utcnow()
+        batch = [head]
+        db = self.session_factory()
+        try:
+            followers = (
+                db.query(WebhookJob)
+                .filter(
+                    WebhookJob.partition_key == head.partition_key,
+                    WebhookJob.status == PENDING,
+                    WebhookJob.id > head.id,
+                )
+                .order_by(WebhookJob.id.asc())
+                .limit(limit - 1)
+                .all()
+            )
+            for follower in followers:
+                if follower.kind != head.kind or follower.available_at > now:
+                    break
+                claimed = db.execute(
+                    update(WebhookJob)
+                    .where(WebhookJob.id == follower.id, WebhookJob.status == PENDING)
+                    .values(
+                        status=RUNNING,
+                        locked_at=now,
+                        attempts=WebhookJob.attempts + 1,
+                        updated_at=now,
+                    )
+                )
+                if claimed.rowcount != 1:
+                    break
+                db.commit()
+                db.refresh(follower)
+                batch.append(_to_job(follower))
+            return batch
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def complete(self, job_id: int) -> None:
+        self._set(job_id, status=DONE, locked_at=None, last_error=None)
+
+    def fail(self, job: Job, error: str) -> str:
+        """
+        Registra un fallo del trabajo.
+
+        Si aún quedan intentos se reprograma con backoff exponencial; si no,
+        pasa a la dead-letter ('dead'). Devuelve el nuevo estado.
+        """
+        if job.attempts >= job.max_attempts:
+            self._set(job.id, status=DEAD, locked_at=None, last_error=error[:2048])
+            return DEAD
+
+        delay = min(
+            self.backoff_seconds * (2 ** (job.attempts - 1)), self.max_backoff_seconds
+        )
+        self._set(
+            job.id,
+            status=PENDING,
+            locked_at=None,
+            last_error=error[:2048],
+            available_at=datetime.utcnow() + timedelta(seconds=delay),
+        )
+        return PENDING
+
+    def dead_letters(self, limit: int = 100) -> list[dict]:
+        db = self.session_factory()
+        try:
+            jobs = (
+                db.query(WebhookJob)
+                .filter(WebhookJob.status == DEAD)
+                .order_by(WebhookJob.id.asc())
+                .limit(limit)
+                .all()
+            )
+            return [j.to_dict() for j in jobs]
+        finally:
+            db.close()
+
+    def counts(self) -> dict[str, int]:
+        """Número de trabajos por estado (para la métrica de profundidad de cola)."""
+        db = self.session_factory()
+        try:
+            rows = (
+                db.query(WebhookJob.status, func.count(WebhookJob.id))
+                .group_by(WebhookJob.status)
+                .all()
+            )
+            return dict(rows)
+        finally:
+            db.close()
+
+    def requeue(self, job_id: int) -> None:
+        """Devuelve un trabajo de la dead-letter a la cola con los intentos en cero."""
+        self._set(
+            job_id,
+            status=PENDING,
+            attempts=0,
+            locked_at=None,
+            available_at=datetime.utcnow(),
+        )
+
+    def purge_finished(self, now: datetime | None = None) -> int:
+        """
+        Borra los trabajos 'done' y 'dead' cuya última actualización es más
+        vieja que ``done_ttl`` / ``dead_ttl``. Devuelve cuántos borró.
+
+        Borra de a ``purge_batch_size`` filas, una transacción por tanda,
+        para no retener bloqueos largos sobre la cola.
+        """
+        now = now or datetime.utcnow()
+        purged = 0
+        for status, ttl in ((DONE, self.done_ttl), (DEAD, self.dead_ttl)):
+            cutoff = now - timedelta(seconds=ttl)
+            while True:
+                deleted = self._delete_finished(status, cutoff)
+                JOBS_PURGED.inc(deleted, status=status)
+                purged += deleted
+                if deleted < self.purge_batch_size:
+                    break
+        if purged:
+            logging.info("[JOBS] %s trabajos terminados purgados", purged)
+        return purged
+
+    def purge_if_due(self) -> int:
+        """
+        ``purge_finished`` como mucho una vez cada ``purge_interval`` segundos.
+
+        Lo llaman los workers en cada vuelta; un error se registra y no
+        detiene el reclamo de trabajos.
+        """
+        with self._purge_lock:
+            now = time.monotonic()
+            if now < self._next_purge:
+                return 0
+            self._next_purge = now + self.purge_interval
+        try:
+            with span("db_job_purge"):
+                return self.purge_finished()
+        except Exception:
+            logging.exception("[JOBS] Error purgando trabajos terminados")
+            return 0
+
+    def _delete_finished(self, status: str, cutoff: datetime) -> int:
+        expired = (
+            select(WebhookJob.id)
+            .where(WebhookJob.status == status, WebhookJob.updated_at < cutoff)
+            .limit(self.purge_batch_size)
+        )
+        db = self.session_factory()
+        try:
+            result = db.execute(
+                delete(WebhookJob)
+                .where(WebhookJob.id.in_(expired))
+                .execution_options(synchronize_session=False)
+            )
+            db.commit()
+            return result.rowcount
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _set(self, job_id: int, **values) -> None:
+        db = self.session_factory()
+        try:
+            db.execute(
+                update(WebhookJob)
+                .where(WebhookJob.id == job_id)
+                .values(updated_at=datetime.utcnow(), **values)
+            )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+
+class WorkerPool:
+    """
+    Pool de hilos que consume trabajos de un ``SQLJobStore``.
+
+    ``handlers`` mapea ``Job.kind`` a la función que lo procesa; cualquier
+    excepción del handler cuenta como fallo y dispara reintento o dead-letter.
+    ``batch_handlers`` hace lo mismo para tipos que aceptan una lista de
+    payloads consecutivos de la misma partición (hasta ``batch_size``).
+    """
+
+    def __init__(
+        self,
+        store: SQLJobStore,
+        handlers: dict[str, Callable[[dict], object]] | None = None,
+        workers: int = 2,
+        poll_interval: float = 0.5,
+        batch_handlers: dict[str, Callable[[list[dict]], object]] | None = None,
+        batch_size: int = 1,
+    ) -> None:
+        """Registra los handlers; los hilos no arrancan hasta ``start()``."""
+        self.store = store
+        self.handlers = handlers or {}
+        self.batch_handlers = batch_handlers or {}
+        self.batch_size = batch_size
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._threads: list[threading.Thread] = []
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        self._stop.clear()
+        for i in range(self.workers):
+            t = threading.Thread(
+                target=self._loop, name=f"webhook-worker-{i}", daemon=True
+            )
+            t.start()
+            self._threads.append(t)
+        logging.info("[JOBS] %s workers iniciados", self.workers)
+
+    def stop(self, timeout: float | None = None) -> None:
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def run_once(self) -> bool:
+        """
+        Reclama y procesa un trabajo (o un lote). Devuelve ``False`` si la cola está vacía.
+        """
+        with span("db_claim"):
+            jobs = self.store.claim_batch(self.batch_size if self.batch_handlers else 1)
+        if not jobs:
+            return False
+
+        kind = jobs[0].kind
+        started = time.perf_counter()
+        error = None
+        try:
+            if kind in self.batch_handlers:
+                self.batch_handlers[kind]([job.payload for job in jobs])
+            elif kind in self.handlers:
+                for job in jobs:
+                    self.handlers[kind](job.payload)
+            else:
+                raise LookupError(f"No hay handler para trabajos de tipo '{kind}'")
+        except Exception as e:
+            error = e
+        _record_outcome(self.store, jobs, time.perf_counter() - started, error)
+        return True
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            self.store.purge_if_due()
+            try:
+                if self.run_once():
+                    continue
+            except Exception:
+                # Error de infraestructura (p. ej. BD caída): esperar y reintentar
+                logging.exception("[JOBS] Error reclamando trabajos")
+            time.sleep(self.poll_interval)
+
+
+class AsyncWorkerPool:
+    """
+    Variante asyncio de ``WorkerPool``: un hilo con un event loop que mantiene
+    hasta ``concurrency`` lotes en vuelo a la vez.
+
+    Los handlers son corrutinas (``async def``) con la misma firma que en
+    ``WorkerPool``. Mientras esperan a Gemini, Speech-to-Text o la Graph API
+    no ocupan ningún hilo; solo las llamadas bloqueantes (BD, SDK de GCS)
+    pasan por ``asyncio.to_thread``, acotadas a ``db_threads`` hilos.
+    """
+
+    def __init__(
+        self,
+        store: SQLJobStore,
+        handlers: dict[str, Callable[[dict], Awaitable[object]]] | None = None,
+        concurrency: int = 100,
+        poll_interval: float = 0.5,
+        batch_handlers: dict[str, Callable[[list[dict]], Awaitable[object]]]
+        | None = None,
+        batch_size: int = 1,
+        db_threads: int = 4,
+    ) -> None:
+        """Registra los handlers; el event loop no arranca hasta ``start()``."""
+        self.store = store
+        self.handlers = handlers or {}
+        self.batch_handlers = batch_handlers or {}
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.db_threads = db_threads
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        if self._thread:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=asyncio.run, args=(self._main(),), name="webhook-aio", daemon=True
+        )
+        self._thread.start()
+        logging.info(
+            "[JOBS] Worker asíncrono iniciado (concurrencia=%s)", self.concurrency
+        )
+
+    def stop(self, timeout: float | None = None) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self._thread = None
+
+    async def run_once(self) -> bool:
+        """
+        Reclama y procesa un trabajo (o un lote). Devuelve ``False`` si la cola está vacía.
+        """
+        jobs = await self._claim()
+        if not jobs:
+            return False
+        await self._run(jobs)
+        return True
+
+    async def _claim(self) -> list[Job]:
+        with span("db_claim"):
+            return await asyncio.to_thread(
+                self.store.claim_batch,
+                self.batch_size if self.batch_handlers else 1,
+            )
+
+    async def _run(self, jobs: list[Job]) -> None:
+        kind = jobs[0].kind
+        started = time.perf_counter()
+        error = None
+        try:
+            if kind in self.batch_handlers:
+                await self.batch_handlers[kind]([job.payload for job in jobs])
+            elif kind in self.handlers:
+                for job in jobs:
+                    await self.handlers[kind](job.payload)
+            else:
+                raise LookupError(f"No hay handler para trabajos de tipo '{kind}'")
+        except Exception as e:
+            error = e
+        await asyncio.to_thread(
+            _record_outcome, self.store, jobs, time.perf_counter() - started, error
+        )
+
+    async def _run_logged(self, jobs: list[Job]) -> None:
+        try:
+            await self._run(jobs)
+        except Exception:
+            # Error de infraestructura al marcar el lote: lo retoma el visibility_timeout
+            logging.exception(
+                "[JOBS] Error actualizando trabajos %s", [j.id for j in jobs]
+            )
+
+    async def _purge_loop(self) -> None:
+        """Barrido de la retención de la cola (``SQLJobStore.purge_if_due``)."""
+        while not self._stop.is_set():
+            await asyncio.to_thread(self.store.purge_if_due)
+            await asyncio.sleep(self.store.purge_interval)
+
+    async def _main(self) -> None:
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(
+            max_workers=self.db_threads, thread_name_prefix="webhook-aio-db"
+        )
+        loop.set_default_executor(executor)
+        slots = asyncio.Semaphore(self.concurrency)
+        in_flight: set[asyncio.Task] = set()
+        purge = asyncio.create_task(self._purge_loop())
+
+        try:
+            while not self._stop.is_set():
+                await slots.acquire()
+                try:
+                    jobs = await self._claim()
+                except Exception:
+                    # Error de infraestructura (p. ej. BD caída): esperar y reintentar
+                    logging.exception("[JOBS] Error reclamando trabajos")
+                    jobs = []
+                if not jobs:
+                    slots.release()
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+
+                task = asyncio.create_task(self._run_logged(jobs))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+                task.add_done_callback(lambda _: slots.release())
+        finally:
+            purge.cancel()
+            if in_flight:
+                await asyncio.gather(*in_flight, return_exceptions=True)
+            await aclose_async_client()
@@ -1,11 +1,199 @@
+import hashlib
 import json
+import logging
+import os
+from typing import TYPE_CHECKING
+
+from utils.cache import SessionCache, TTLCache
+from utils.lazy import lazy_imports
+from utils.llm import GEMINI_CLIENT_MAX_RETRIES, get_chat_model
+from utils.ratelimit import call_model
+
+if TYPE_CHECKING:
+    from langchain.chains import ConversationChain
+    from langchain.memory import ConversationSummaryBufferMemory
+    from langchain_core.prompts import PromptTemplate
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+# LangChain y el SDK de Gemini tardan ~1 s en importarse: se cargan en el
+# primer uso y no al arrancar el proceso.
+_load, __getattr__ = lazy_imports(
+    globals(),
+    {
+        "ConversationChain": "langchain.chains:ConversationChain",
+        "ConversationSummaryBufferMemory": (
+            "langchain.memory:ConversationSummaryBufferMemory"
+        ),
+        "PromptTemplate": "langchain_core.prompts:PromptTemplate",
+        "ChatGoogleGenerativeAI": "langchain_google_genai:ChatGoogleGenerativeAI",
+    },
+)
+
+# Sesiones por usuario (cadena + memoria de resumen). Son una caché local del
+# worker acotada a los usuarios activos; la memoria de referencia está en el
+# almacén de estado de conversación (ver ``set_conversation_state_store``).
+SESSION_MAX_USERS = int(os.getenv("SESSION_MAX_USERS", "2000"))
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "1800"))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Modelo de la conversación y de los resúmenes (cuota en utils.ratelimit)
+CONVERSATION_MODEL = "gemini-2.0-flash"
+
+# Tokens del buffer de turnos antes de resumir los más antiguos
+MEMORY_MAX_TOKENS = int(os.getenv("MEMORY_MAX_TOKENS", "1024"))
+# Subclase de la memoria por clase base (la base se importa en el primer uso
+# y los tests la reemplazan por un fake)
+_DEFERRED_MEMORY_CLASSES: dict = {}
+
+# Costo fijo estimado de una sesión (cadena, memoria, prompt) sin mensajes
+_SESSION_BASE_BYTES = 16 * 1024
+
+
+class _UserSession:
+    """Cadena de un usuario, la versión de estado que refleja y la clave de su prompt."""
+
+    __slots__ = ("chain", "version", "prompt_key")
+
+    def __init__(self, chain, version: int = 0, prompt_key=None) -> None:
+        """Asocia la cadena con la versión de estado con la que se cargó."""
+        self.chain = chain
+        self.version = version
+        self.prompt_key = prompt_key
+
+
+def _session_size(session: _UserSession) -> int:
+    """Estimación barata de la memoria de una sesión: base + texto guardado."""
+    memory = getattr(session.chain, "memory", None)
+    size = _SESSION_BASE_BYTES
+    size += len(getattr(memory, "moving_summary_buffer", "") or "")
+    chat_memory = getattr(memory, "chat_memory", None)
+    for message in getattr(chat_memory, "messages", None) or []:
+        content = getattr(message, "content", "")
+        size += len(content) if isinstance(content, str) else 256
+    return size
+
+
+USER_SESSIONS = SessionCache(
+    "user_sessions",
+    maxsize=SESSION_MAX_USERS,
+    idle_ttl=SESSION_IDLE_TTL,
+    max_bytes=SESSION_MAX_BYTES,
+    sizeof=_session_size,
+)
+
+# Prompts ya construidos por (teléfono, versión del perfil, fase); un cambio
+# en UserProfile o en personality_profile cambia la versión y, con ella, la clave.
+PROMPT_CACHE = TTLCache(maxsize=SESSION_MAX_USERS, ttl=SESSION_IDLE_TTL)
+
+_state_store = None
+
+
+def set_conversation_state_store(store) -> None:
+    """
+    Registra el almacén del estado de conversación (ver ``utils.conversation_state``).
+
+    Con un almacén compartido (PostgreSQL) cualquier worker continúa la
+    conversación donde la dejó otro, y un despliegue no borra el contexto.
+    Lo registra ``utils.whatsapp``; con ``None`` solo hay memoria local.
+    """
+    global _state_store
+    _state_store = store
+
+
+def _load_state(user_id: str):
+    if _state_store is None:
+        return None
+    try:
+        return _state_store.load(user_id)
+    except Exception:
+        logging.exception("[LANGCHAIN] Error cargando estado de %s", user_id)
+        return None
+
+
+def _load_newer_state(user_id: str, version: int):
+    """Estado persistido solo si otro worker lo cambió desde ``version``."""
+    if _state_store is None:
+        return None
+    try:
+        return _state_store.load_if_newer(user_id, version)
+    except Exception:
+        logging.exception("[LANGCHAIN] Error comprobando estado de %s", user_id)
+        return None
 
-from langchain.chains import ConversationChain
-from langchain.memory import ConversationSummaryBufferMemory
-from langchain_core.prompts import PromptTemplate
-from langchain_google_genai import ChatGoogleGenerativeAI
 
-USER_SESSIONS = {}
+def session_memory(user_id: str):
+    """Memoria de la sesión local del usuario, o ``None`` si no está en caché."""
+    session = USER_SESSIONS.get(user_id)
+    return getattr(session.chain, "memory", None) if session else None
+
+
+def save_conversation_state(user_id: str) -> None:
+    """
+    Guarda el resumen acumulado y los últimos turnos de la sesión del usuario.
+
+    Se llama después de cada respuesta; un error se registra pero no impide
+    enviar la respuesta (el siguiente turno vuelve a guardar).
+    """
+    if _state_store is None:
+        return
+    session = USER_SESSIONS.get(user_id)
+    memory = getattr(session.chain, "memory", None) if session else None
+    chat_memory = getattr(memory, "chat_memory", None)
+    if chat_memory is None:
+        return
+    turns = [
+        ("in" if message.type == "human" else "out", message.content)
+        for message in chat_memory.messages
+        if isinstance(message.content, str)
+    ]
+    try:
+        session.version = _state_store.save(
+            user_id, memory.moving_summary_buffer, turns
+        )
+    except Exception:
+        logging.exception("[LANGCHAIN] Error guardando estado de %s", user_id)
+
+
+def last_reply(user_id: str) -> str | None:
+    """Último mensaje de Victoria al usuario (sesión local o estado persistido)."""
+    memory = session_memory(user_id)
+    if memory is not None:
+        messages = memory.chat_memory.messages
+        return next((m.content for m in reversed(messages) if m.type == "ai"), None)
+    snapshot = _load_state(user_id)
+    if snapshot is None:
+        return None
+    return next((text for d, text in reversed(snapshot.turns) if d == "out"), None)
+
+
+def remember_turn(user_id: str, user_message: str, reply: str) -> None:
+    """
+    Agrega a la conversación un turno que se respondió sin llamar al LLM.
+
+    Con la sesión en caché se escribe en su memoria y se guarda el estado
+    (como tras ``chain.predict``); sin sesión local se agrega directamente
+    al estado persistido, que la sesión tomará al rehidratarse.
+    """
+    session = USER_SESSIONS.get(user_id)
+    if session is not None:
+        memory = session.chain.memory
+        snapshot = _load_newer_state(user_id, session.version)
+        if snapshot is not None:
+            _restore_memory(memory, snapshot)
+            session.version = snapshot.version
+        memory.save_context({"input": user_message}, {"output": reply})
+        save_conversation_state(user_id)
+        return
+
+    snapshot = _load_state(user_id)
+    if snapshot is None:
+        return
+    turns = [*snapshot.turns, ("in", user_message), ("out", reply)]
+    try:
+        _state_store.save(user_id, snapshot.summary, turns)
+    except Exception:
+        logging.exception("[LANGCHAIN] Error guardando estado de %s", user_id)
+
 
 # --- PROMPT MAESTRO PARA PERFILAMIENTO DE PERSONALIDAD Y HÁBITOS ---
 PROFILE_PROMPT_TEMPLATE = """
@@ -83,32 +271,23 @@ Responde como Victoria con máximo 2–3 frases y termina con UNA sola pregunta
 Victoria:"""
 
 
-def get_user_chain(
-    user_id: str,
-    user_profile: dict | None = None,
-    personality_stage: str = "profiling",
-    personality_profile: dict | None = None,
-) -> ConversationChain:
-    """
-    Devuelve la cadena (LLM + memoria) asociada a un usuario.
-
-    Ahora acepta un `user_profile` opcional con claves como:
-    {
-      "full_name": str,
-      "age": int,
-      "gender": str,
-      "height_cm": int,
-      "weight_kg": int,
-      "diseases": list[str],
-      "allergies": list[str]
-    }
-    """
-    llm = ChatGoogleGenerativeAI(
-        model="gemini-2.0-flash",
+def conversation_llm():
+    """Cliente del modelo conversacional, compartido por todos los usuarios."""
+    _load("ChatGoogleGenerativeAI")
+    return get_chat_model(
+        ChatGoogleGenerativeAI,
+        model=CONVERSATION_MODEL,
         temperature=0.6,
         convert_system_message_to_human=True,
+        max_retries=GEMINI_CLIENT_MAX_RETRIES,
     )
 
+
+def _build_prompt(
+    user_profile: dict | None, personality_stage: str, personality_profile: dict | None
+) -> "PromptTemplate":
+    """Construye el prompt de Victoria con el perfil y la personalidad del usuario."""
+    _load("PromptTemplate")
     # Normalizar perfil
     if user_profile is None:
         user_profile = {}
@@ -165,20 +344,102 @@ def get_user_chain(
             "mood_baseline": mood_baseline,
         },
     )
+    return prompt
+
+
+def profile_version(user_profile: dict | None, personality_profile: dict | None) -> str:
+    """
+    Huella del perfil clínico y de personalidad con que se construye el prompt.
+
+    Cambia exactamente cuando cambia algún dato de ``UserProfile`` o de
+    ``personality_profile`` que llega al prompt; calcularla es mucho más
+    barato que volver a armar el ``PromptTemplate``.
+    """
+    raw = json.dumps(
+        [user_profile or {}, personality_profile or {}],
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.blake2b(raw.encode(), digest_size=12).hexdigest()
+
+
+def _user_prompt(
+    key: tuple,
+    user_profile: dict | None,
+    personality_stage: str,
+    personality_profile: dict | None,
+):
+    prompt = PROMPT_CACHE.get(key)
+    if prompt is None:
+        prompt = _build_prompt(user_profile, personality_stage, personality_profile)
+        PROMPT_CACHE.set(key, prompt)
+    return prompt
+
+
+def get_user_chain(
+    user_id: str,
+    user_profile: dict | None = None,
+    personality_stage: str = "profiling",
+    personality_profile: dict | None = None,
+) -> "ConversationChain":
+    """
+    Devuelve la cadena (LLM + memoria) asociada a un usuario.
+
+    Ahora acepta un `user_profile` opcional con claves como:
+    {
+      "full_name": str,
+      "age": int,
+      "gender": str,
+      "height_cm": int,
+      "weight_kg": int,
+      "diseases": list[str],
+      "allergies": list[str]
+    }
+
+    La memoria se rehidrata con una lectura del almacén de estado al crear
+    la sesión (primera vez, tras ser expulsada o en otro worker). Con la
+    sesión en caché solo se comprueba la versión (``load_if_newer``): el
+    estado viaja únicamente si otro worker avanzó la conversación.
+    """
+    _load()
+
+    prompt_key = (
+        user_id,
+        profile_version(user_profile, personality_profile),
+        personality_stage,
+    )
 
     # Reusar sesión si existe
-    if user_id in USER_SESSIONS:
-        chain = USER_SESSIONS[user_id]
-        # Si mandan nuevo perfil, actualizamos el prompt
-        if user_profile:
-            chain.prompt = prompt
+    session = USER_SESSIONS.get(user_id)
+    if session is not None:
+        chain = session.chain
+        snapshot = _load_newer_state(user_id, session.version)
+        if snapshot is not None:
+            # Otro worker avanzó la conversación: se toma su estado
+            _restore_memory(chain.memory, snapshot)
+            session.version = snapshot.version
+        # Si mandan un perfil distinto (o cambió la fase), actualizamos el prompt
+        if user_profile and session.prompt_key != prompt_key:
+            chain.prompt = _user_prompt(
+                prompt_key, user_profile, personality_stage, personality_profile
+            )
+            session.prompt_key = prompt_key
         return chain
 
-    memory = ConversationSummaryBufferMemory(
+    snapshot = _load_state(user_id)
+    prompt = _user_prompt(
+        prompt_key, user_profile, personality_stage, personality_profile
+    )
+
+    llm = conversation_llm()
+    memory = _deferred_summary_memory(
         llm=llm,
-        max_token_limit=1024,
+        max_token_limit=MEMORY_MAX_TOKENS,
         return_messages=True,
     )
+    if snapshot is not None:
+        _restore_memory(memory, snapshot)
 
     chain = ConversationChain(
         llm=llm,
@@ -187,10 +448,56 @@ def get_user_chain(
         verbose=False,
     )
 
-    USER_SESSIONS[user_id] = chain
+    USER_SESSIONS[user_id] = _UserSession(
+        chain, snapshot.version if snapshot else 0, prompt_key
+    )
     return chain
 
 
+def _skip_prune(self) -> None:
+    """El resumen lo hace ``utils.memory_summary`` después de enviar la respuesta."""
+
+
+def _deferred_summary_memory(**kwargs):
+    """
+    ``ConversationSummaryBufferMemory`` que no resume dentro de ``chain.predict``.
+
+    La memoria original llama a ``prune`` en cada ``save_context``: cuenta
+    tokens con la API de Gemini y, si el buffer pasa de ``max_token_limit``,
+    genera el resumen con otra llamada al LLM antes de devolver la respuesta.
+    Aquí ``prune`` no hace nada y el resumen incremental se programa después
+    del envío (ver ``utils.memory_summary.schedule_summary``).
+    """
+    base = ConversationSummaryBufferMemory
+    cls = _DEFERRED_MEMORY_CLASSES.get(base)
+    if cls is None:
+        cls = _DEFERRED_MEMORY_CLASSES[base] = type(
+            "DeferredSummaryBufferMemory",
+            (base,),
+            {"prune": _skip_prune, "__module__": __name__},
+        )
+    return cls(**kwargs)
+
+
+def _restore_memory(memory, snapshot) -> None:
+    """
+    Reemplaza la memoria de una sesión por el estado persistido.
+
+    Los turnos se agregan directamente al historial (sin ``save_context``)
+    para no disparar el resumen con el LLM al rehidratar; se resumirán en el
+    siguiente turno si superan ``max_token_limit``.
+    """
+    memory.moving_summary_buffer = snapshot.summary
+    memory.chat_memory.clear()
+    for direction, text in snapshot.turns:
+        if not text:
+            continue
+        if direction == "in":
+            memory.chat_memory.add_user_message(text)
+        else:
+            memory.chat_memory.add_ai_message(text)
+
+
 def summarize_personality(history: str, user_profile: dict | None = None) -> dict:
     """
     Genera un resumen estructurado de personalidad/hábitos a partir del historial.
@@ -206,10 +513,13 @@ def summarize_personality(history: str, user_profile: dict | None = None) -> dic
     if user_profile is None:
         user_profile = {}
 
-    llm = ChatGoogleGenerativeAI(
-        model="gemini-2.0-flash",
+    _load("ChatGoogleGenerativeAI")
+    llm = get_chat_model(
+        ChatGoogleGenerativeAI,
+        model=CONVERSATION_MODEL,
         temperature=0.3,
         convert_system_message_to_human=True,
+        max_retries=GEMINI_CLIENT_MAX_RETRIES,
     )
 
     summary_template = """
@@ -261,7 +571,7 @@ Recuerda: responde SOLO el JSON.
         history=history,
     )
 
-    raw = llm.invoke(prompt).content
+    raw = call_model(CONVERSATION_MODEL, "background", llm.invoke, prompt).content
 
     try:
         data = json.loads(raw)
@@ -0,0 +1,41 @@
+import importlib
+
+
+def lazy_imports(module_globals: dict, names: dict[str, str]):
+    """
+    Importaciones diferidas para dependencias pesadas de un módulo.
+
+    ``names`` mapea el nombre global a ``"paquete.modulo"`` o
+    ``"paquete.modulo:atributo"``. Devuelve ``(load, __getattr__)``:
+
+    - ``load(*nombres)`` importa los nombres indicados (o todos) que aún no
+      estén en el módulo; se llama al inicio de las funciones que los usan.
+    - ``__getattr__`` (PEP 562) los resuelve cuando se accede desde fuera,
+      p. ej. ``monkeypatch.setattr(modulo, "ChatGoogleGenerativeAI", Fake)``.
+
+    Un nombre ya presente en el módulo (importado o reemplazado en un test)
+    no se vuelve a importar. Para el linter y el editor, los mismos imports
+    van dentro de ``if TYPE_CHECKING:``.
+    """
+
+    def resolve(name):
+        module, _, attr = names[name].partition(":")
+        value = importlib.import_module(module)
+        if attr:
+            value = getattr(value, attr)
+        module_globals[name] = value
+        return value
+
+    def load(*only):
+        for name in only or names:
+            if name not in module_globals:
+                resolve(name)
+
+    def __getattr__(name):
+        if name not in names:
+            raise AttributeError(
+                f"module {module_globals['__name__']!r} has no attribute {name!r}"
+            )
+        return resolve(name)
+
+    return load, __getattr__
@@ -0,0 +1,73 @@
+import os
+import threading
+
+from utils.metrics import REGISTRY
+
+LLM_CLIENT_LOOKUPS = REGISTRY.counter(
+    "victoria_llm_client_lookups_total",
+    "Búsquedas en el registro de clientes de modelo por resultado (hit, miss).",
+    ("model", "result"),
+)
+LLM_CLIENTS = REGISTRY.gauge(
+    "victoria_llm_clients",
+    "Clientes de modelo vivos en el registro del proceso.",
+)
+
+# Intentos por llamada de los clientes de chat de langchain_google_genai (su
+# ``max_retries`` cuenta intentos, no reintentos). Con el valor por defecto
+# (6, backoff de hasta 60 s ante 429) el turno del limitador queda ocupado
+# mientras tanto y utils.ratelimit.call_model no ve el 429; con 1 lo ve de
+# inmediato y aplica su propia pausa, jitter y prioridades.
+GEMINI_CLIENT_MAX_RETRIES = int(os.getenv("GEMINI_CLIENT_MAX_RETRIES", "1"))
+
+_lock = threading.Lock()
+_models: dict[tuple, object] = {}
+_pid = os.getpid()
+
+
+def _model_key(factory, kwargs: dict) -> tuple:
+    # model, temperature y api_key (y el resto de parámetros) distinguen un
+    # cliente de otro; la clase también, porque los tests la reemplazan.
+    return (factory, tuple(sorted(kwargs.items())))
+
+
+def get_chat_model(factory, **kwargs):
+    """
+    Devuelve el cliente de modelo compartido para ``factory(**kwargs)``.
+
+    Construir un ``ChatGoogleGenerativeAI`` (o un cliente de embeddings)
+    crea su cliente y su canal gRPC/HTTP; aquí se hace una vez por proceso y
+    configuración (modelo, temperatura, api key...) y todas las peticiones y
+    usuarios reutilizan esas conexiones. Es seguro entre hilos; tras un
+    ``fork`` los clientes del proceso padre se descartan. Los aciertos y
+    fallos se cuentan en ``victoria_llm_client_lookups_total``.
+    """
+    global _pid
+    key = _model_key(factory, kwargs)
+    model_name = str(kwargs.get("model", getattr(factory, "__name__", "?")))
+
+    model = _models.get(key)
+    if model is not None and _pid == os.getpid():
+        LLM_CLIENT_LOOKUPS.inc(model=model_name, result="hit")
+        return model
+
+    with _lock:
+        if _pid != os.getpid():
+            _models.clear()
+            _pid = os.getpid()
+        model = _models.get(key)
+        if model is None:
+            model = _models[key] = factory(**kwargs)
+            LLM_CLIENTS.set(len(_models))
+            result = "miss"
+        else:
+            result = "hit"
+    LLM_CLIENT_LOOKUPS.inc(model=model_name, result=result)
+    return model
+
+
+def clear_chat_models() -> None:
+    """Descarta todos los clientes del registro (tests y recarga de credenciales)."""
+    with _lock:
+        _models.clear()
+        LLM_CLIENTS.set(0)
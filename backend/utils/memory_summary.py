@@ -0,0 +1,141 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.langchain import (
+    CONVERSATION_MODEL,
+    save_conversation_state,
+    session_memory,
+)
+from utils.metrics import REGISTRY, span
+from utils.ratelimit import call_model
+
+logging.basicConfig(level=logging.INFO)
+
+# Hilos dedicados a resumir memorias fuera del camino de la respuesta
+MEMORY_SUMMARY_WORKERS = int(os.getenv("MEMORY_SUMMARY_WORKERS", "2"))
+# Estimación local de tokens (evita una llamada a count_tokens por mensaje)
+CHARS_PER_TOKEN = 4
+
+MEMORY_SUMMARIES = REGISTRY.counter(
+    "victoria_memory_summaries_total",
+    "Resúmenes incrementales de memoria por resultado (applied, stale, error).",
+    ("result",),
+)
+MEMORY_SUMMARY_TOKENS = REGISTRY.counter(
+    "victoria_memory_summary_input_tokens_total",
+    "Tokens aproximados de los turnos enviados al LLM para resumir memoria.",
+)
+
+_lock = threading.Lock()
+_pending: set[str] = set()
+_executor: ThreadPoolExecutor | None = None
+
+
+def approx_tokens(messages) -> int:
+    chars = sum(len(m.content) if isinstance(m.content, str) else 256 for m in messages)
+    return chars // CHARS_PER_TOKEN
+
+
+def summarize_memory(memory) -> str:
+    """
+    Resume los turnos más antiguos de ``memory`` hasta dejarla bajo su límite.
+
+    Trabaja sobre una copia: la llamada al LLM ocurre sin tocar la memoria y
+    el resultado se aplica solo si esos turnos siguen al inicio del buffer y
+    el resumen no cambió mientras tanto (si no, devuelve ``"stale"``). La
+    siguiente respuesta usa siempre el último resumen completado. Devuelve
+    ``"applied"``, ``"stale"`` o ``"skipped"`` (no hacía falta).
+    """
+    messages = list(memory.chat_memory.messages)
+    summary = memory.moving_summary_buffer
+    limit = memory.max_token_limit
+
+    cut = 0
+    remaining = approx_tokens(messages)
+    while remaining > limit and cut < len(messages):
+        remaining -= approx_tokens(messages[cut : cut + 1])
+        cut += 1
+    if cut == 0:
+        return "skipped"
+
+    pruned = messages[:cut]
+    MEMORY_SUMMARY_TOKENS.inc(approx_tokens(pruned))
+    new_summary = call_model(
+        CONVERSATION_MODEL, "background", memory.predict_new_summary, pruned, summary
+    )
+
+    buffer = memory.chat_memory.messages
+    if (
+        memory.moving_summary_buffer != summary
+        or len(buffer) < cut
+        or any(a is not b for a, b in zip(buffer[:cut], pruned, strict=True))
+    ):
+        return "stale"
+    # Primero el resumen y luego el recorte: un lector concurrente puede ver
+    # un turno repetido en el resumen, nunca perderlo.
+    memory.moving_summary_buffer = new_summary
+    del buffer[:cut]
+    return "applied"
+
+
+def summarize_session(phone: str) -> str:
+    """Resume la memoria local del teléfono y guarda el estado resultante."""
+    memory = session_memory(phone)
+    if memory is None or not hasattr(memory, "predict_new_summary"):
+        return "skipped"
+    try:
+        with span("memory_summary", msg_type="summary"):
+            result = summarize_memory(memory)
+    except Exception:
+        MEMORY_SUMMARIES.inc(result="error")
+        logging.exception("[MEMORY SUMMARY] Error resumiendo memoria de %s", phone)
+        return "error"
+    if result != "skipped":
+        MEMORY_SUMMARIES.inc(result=result)
+    if result == "applied":
+        save_conversation_state(phone)
+    return result
+
+
+def _needs_summary(memory) -> bool:
+    chat_memory = getattr(memory, "chat_memory", None)
+    limit = getattr(memory, "max_token_limit", None)
+    if chat_memory is None or limit is None:
+        return False
+    return approx_tokens(chat_memory.messages) > limit
+
+
+def _run(phone: str) -> None:
+    try:
+        summarize_session(phone)
+    finally:
+        with _lock:
+            _pending.discard(phone)
+
+
+def schedule_summary(phone: str) -> bool:
+    """
+    Programa el resumen incremental de la memoria del teléfono, si hace falta.
+
+    Se llama después de enviar la respuesta; el trabajo corre en hilos
+    propios, así que ni la respuesta actual ni el worker de la cola esperan
+    al LLM de resumen. Como mucho hay un resumen en curso por teléfono.
+    Devuelve ``True`` si se programó.
+    """
+    global _executor
+    memory = session_memory(phone)
+    if memory is None or not _needs_summary(memory):
+        return False
+    with _lock:
+        if phone in _pending:
+            return False
+        _pending.add(phone)
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=MEMORY_SUMMARY_WORKERS,
+                thread_name_prefix="memory-summary",
+            )
+        _executor.submit(_run, phone)
+    return True
@@ -0,0 +1,420 @@
+import contextvars
+import copy
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Etiquetas heredadas por todos los spans abiertos en el contexto actual
+# (p. ej. ``msg_type`` fijado por el pipeline del webhook).
+_CONTEXT_LABELS: contextvars.ContextVar[dict | None] = contextvars.ContextVar(
+    "metrics_labels", default=None
+)
+
+# Con gunicorn cada worker tiene su propio REGISTRY: si este directorio está
+# definido, cada proceso vuelca ahí su estado y /metrics suma el de todos
+# (ver ``render_prometheus``). Lo fija gunicorn.conf.py.
+METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR", "")
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+
+# Buckets (segundos) pensados para llamadas de red y LLM: de 5 ms a 1 min
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(labelnames, values, strict=True)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=()) -> None:
+        """Crea la métrica con sus nombres de etiqueta fijos."""
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: dict[tuple, object] = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(n, "") for n in self.labelnames)
+
+    def header(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+
+
+class Counter(_Metric):
+    """Contador monótono por combinación de etiquetas."""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> list[str]:
+        lines = self.header()
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value:g}")
+        return lines
+
+
+class Gauge(Counter):
+    """Valor instantáneo (profundidad de cola, tamaño de caché, etc.)."""
+
+    kind = "gauge"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames=(), per_process=True
+    ) -> None:
+        """
+        Crea el gauge. Con ``per_process=False`` el valor no es del proceso
+        sino que se calcula al servir /metrics (p. ej. desde la BD): entre
+        workers solo cuenta el del proceso que responde.
+        """
+        super().__init__(name, documentation, labelnames)
+        self.per_process = per_process
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """Histograma acumulado con buckets fijos, compatible con Prometheus."""
+
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS
+    ) -> None:
+        """Crea el histograma con los límites superiores de ``buckets``."""
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            counts = state[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            state[1] += 1
+            state[2] += value
+
+    def count(self, **labels) -> int:
+        state = self._values.get(self._key(labels))
+        return state[1] if state else 0
+
+    def sum(self, **labels) -> float:
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0.0
+
+    def render(self) -> list[str]:
+        lines = self.header()
+        for key, (counts, total, sum_) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts, strict=True):
+                cumulative += n
+                le = _format_labels(self.labelnames, key, f'le="{bound:g}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {total}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {sum_:g}")
+            lines.append(f"{self.name}_count{labels} {total}")
+        return lines
+
+
+class MetricsRegistry:
+    """Registro de métricas del proceso; ``render()`` produce el formato de texto."""
+
+    def __init__(self) -> None:
+        """Crea un registro vacío."""
+        self._metrics: dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(
+                    name, documentation, labelnames, **kwargs
+                )
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(
+        self, name: str, documentation: str, labelnames=(), per_process=True
+    ) -> Gauge:
+        return self._get_or_create(
+            Gauge, name, documentation, labelnames, per_process=per_process
+        )
+
+    def histogram(
+        self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._get_or_create(
+            Histogram, name, documentation, labelnames, buckets=buckets
+        )
+
+    def render(self) -> str:
+        lines = []
+        for name in sorted(self._metrics):
+            lines.extend(self._metrics[name].render())
+        return "\n".join(lines) + "\n"
+
+    def clear(self) -> None:
+        with self._lock:
+            for metric in self._metrics.values():
+                with metric._lock:
+                    metric._values.clear()
+
+    def snapshot(self, select=None) -> dict:
+        """Estado serializable a JSON de las métricas con valores (``select``)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        data = {}
+        for metric in metrics:
+            if select is not None and not select(metric):
+                continue
+            with metric._lock:
+                values = [
+                    [list(key), copy.deepcopy(value)]
+                    for key, value in metric._values.items()
+                ]
+            if values:
+                data[metric.name] = {
+                    "kind": metric.kind,
+                    "documentation": metric.documentation,
+                    "labelnames": list(metric.labelnames),
+                    "buckets": list(getattr(metric, "buckets", ())),
+                    "per_process": getattr(metric, "per_process", True),
+                    "values": values,
+                }
+        return data
+
+    def merge(self, snapshot: dict, pid: str | None) -> None:
+        """
+        Suma a este registro el ``snapshot`` de otro proceso.
+
+        Contadores e histogramas se suman; los gauges no se pueden sumar sin
+        saber qué miden, así que cada proceso queda como una serie con ``pid``
+        (salvo con ``pid=None``). Los de ``per_process=False`` solo se toman
+        del proceso que responde (``pid=None``).
+        """
+        for name, data in snapshot.items():
+            labelnames = tuple(data["labelnames"])
+            if data["kind"] == "gauge":
+                if not data["per_process"] and pid is not None:
+                    continue
+                if pid is not None:
+                    labelnames += ("pid",)
+                gauge = self.gauge(name, data["documentation"], labelnames)
+                for key, value in data["values"]:
+                    if pid is not None:
+                        key = [*key, pid]
+                    gauge.set(value, **dict(zip(labelnames, key, strict=True)))
+            elif data["kind"] == "counter":
+                counter = self.counter(name, data["documentation"], labelnames)
+                for key, value in data["values"]:
+                    counter.inc(value, **dict(zip(labelnames, key, strict=True)))
+            else:
+                hist = self.histogram(
+                    name, data["documentation"], labelnames, data["buckets"]
+                )
+                for key, (counts, total, sum_) in data["values"]:
+                    with hist._lock:
+                        state = hist._values.setdefault(
+                            tuple(key), [[0] * len(hist.buckets), 0, 0.0]
+                        )
+                        state[0] = [
+                            a + b for a, b in zip(state[0], counts, strict=True)
+                        ]
+                        state[1] += total
+                        state[2] += sum_
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_DURATION = REGISTRY.histogram(
+    "victoria_stage_duration_seconds",
+    "Duración de cada etapa del pipeline (BD, Gemini, Speech-to-Text, GCS, Graph API).",
+    ("stage", "msg_type"),
+)
+STAGE_ERRORS = REGISTRY.counter(
+    "victoria_stage_errors_total",
+    "Etapas del pipeline que terminaron con excepción.",
+    ("stage", "msg_type"),
+)
+
+
+@contextmanager
+def labels(**values):
+    """Fija etiquetas (p. ej. ``msg_type``) para todos los spans del bloque."""
+    token = _CONTEXT_LABELS.set({**(_CONTEXT_LABELS.get() or {}), **values})
+    try:
+        yield
+    finally:
+        _CONTEXT_LABELS.reset(token)
+
+
+class span:  # minúscula: se usa como ``with span("gemini_chat"):``
+    """
+    Mide la duración de una etapa y la registra en ``STAGE_DURATION``.
+
+    Uso: ``with span("gcs_upload") as s: ...``; al salir ``s.elapsed`` tiene
+    los segundos transcurridos. Si el bloque lanza una excepción también se
+    cuenta en ``STAGE_ERRORS``. El costo es un ``perf_counter`` y un lock.
+    """
+
+    __slots__ = ("stage", "msg_type", "started", "elapsed")
+
+    def __init__(self, stage: str, msg_type: str | None = None) -> None:
+        """Prepara el span; ``msg_type`` por defecto sale de ``labels()``."""
+        self.stage = stage
+        self.msg_type = msg_type or (_CONTEXT_LABELS.get() or {}).get("msg_type", "")
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        """Empieza a medir."""
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        """Registra la duración (y el error, si lo hubo)."""
+        self.elapsed = time.perf_counter() - self.started
+        STAGE_DURATION.observe(self.elapsed, stage=self.stage, msg_type=self.msg_type)
+        if exc_type is not None:
+            STAGE_ERRORS.inc(stage=self.stage, msg_type=self.msg_type)
+        return False
+
+
+_snapshot_name: tuple[int, str] | None = None
+
+
+def _snapshot_path(directory: str) -> str:
+    # Un worker nuevo puede reciclar el pid de uno muerto: el nombre lleva
+    # también el instante de arranque para no pisar sus contadores.
+    global _snapshot_name
+    pid = os.getpid()
+    if _snapshot_name is None or _snapshot_name[0] != pid:
+        _snapshot_name = (pid, f"{pid}-{time.time_ns()}")
+    return os.path.join(directory, f"{_snapshot_name[1]}.json")
+
+
+def write_snapshot(directory: str, gauges: bool = True) -> None:
+    """
+    Vuelca el estado de este proceso en ``<directory>/<pid>-<arranque>.json``.
+
+    Se escribe a un temporal y se renombra, así quien lee nunca ve un archivo
+    a medias. Con ``gauges=False`` (al salir el worker) solo quedan contadores
+    e histogramas: lo acumulado no retrocede, pero un valor instantáneo de un
+    proceso muerto no debe seguir expuesto.
+    """
+    path = _snapshot_path(directory)
+    tmp = f"{path}.tmp"
+    snapshot = REGISTRY.snapshot(
+        lambda m: m.kind != "gauge" or (gauges and m.per_process)
+    )
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f)
+    os.replace(tmp, path)
+
+
+def render_multiprocess(directory: str) -> str:
+    """Suma los volcados de todos los procesos de ``directory`` (incluido este)."""
+    write_snapshot(directory)
+    merged = MetricsRegistry()
+    for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+        pid = os.path.basename(path).split("-", 1)[0]
+        try:
+            with open(path, encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            logging.exception("[METRICS] No se pudo leer %s", path)
+            continue
+        merged.merge(snapshot, pid)
+    merged.merge(
+        REGISTRY.snapshot(lambda m: m.kind == "gauge" and not m.per_process), None
+    )
+    return merged.render()
+
+
+def reset_multiprocess_dir(directory: str) -> None:
+    """Borra los volcados de una ejecución anterior (al arrancar el maestro)."""
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, "*.json*")):
+        os.remove(path)
+
+
+def _flush_loop(directory: str, interval: float) -> None:
+    while True:
+        time.sleep(interval)
+        try:
+            write_snapshot(directory)
+        except OSError:
+            logging.exception("[METRICS] Error volcando métricas en %s", directory)
+
+
+def start_metrics_flusher() -> None:
+    """
+    Vuelca periódicamente las métricas del proceso si hay METRICS_MULTIPROC_DIR.
+
+    Lo llama cada worker al arrancar: el worker que atiende /metrics lee el
+    último volcado de los demás (con hasta METRICS_FLUSH_SECONDS de retraso).
+    """
+    if not METRICS_MULTIPROC_DIR:
+        return
+    threading.Thread(
+        target=_flush_loop,
+        args=(METRICS_MULTIPROC_DIR, METRICS_FLUSH_SECONDS),
+        name="metrics-flush",
+        daemon=True,
+    ).start()
+
+
+def render_prometheus() -> str:
+    if METRICS_MULTIPROC_DIR:
+        return render_multiprocess(METRICS_MULTIPROC_DIR)
+    return REGISTRY.render()
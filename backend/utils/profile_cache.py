@@ -0,0 +1,126 @@
+"""
+Caché en proceso de perfiles de usuario por número de WhatsApp.
+
+Los perfiles casi nunca cambian, así que ``build_whatsapp_reply`` los
+resuelve aquí antes de ir a la BD. Los números sin perfil también se
+guardan (caché negativa) con un TTL más corto, para que un registro hecho
+desde otro worker se note pronto. Las escrituras de este proceso (registro
+de clientes, paso a la fase 'daily') invalidan la entrada explícitamente;
+las de otros workers se ven cuando vence el TTL.
+"""
+
+import os
+import threading
+from dataclasses import dataclass
+
+from utils.cache import TTLCache
+from utils.metrics import REGISTRY
+
+PROFILE_CACHE_MAX_ENTRIES = int(os.getenv("PROFILE_CACHE_MAX_ENTRIES", "10000"))
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", "300"))
+PROFILE_CACHE_NEGATIVE_TTL = float(os.getenv("PROFILE_CACHE_NEGATIVE_TTL", "30"))
+
+PROFILE_CACHE_LOOKUPS = REGISTRY.counter(
+    "victoria_profile_cache_lookups_total",
+    "Búsquedas de perfil por número de WhatsApp por resultado "
+    "(hit, negative_hit, miss).",
+    ("result",),
+)
+
+_MISSING = object()
+# Marca de "este número no tiene perfil"
+_UNREGISTERED = object()
+
+
+@dataclass(frozen=True)
+class ProfileSnapshot:
+    """
+    Lo que la respuesta necesita de un ``UserProfile``, sin la sesión de BD.
+
+    Se comparte entre hilos: ``user_profile`` y ``personality_profile`` no
+    deben modificarse.
+    """
+
+    id: int
+    personality_stage: str
+    personality_profile: dict | None
+    user_profile: dict
+
+    @classmethod
+    def from_model(cls, profile) -> "ProfileSnapshot":
+        return cls(
+            id=profile.id,
+            personality_stage=profile.personality_stage or "profiling",
+            personality_profile=profile.personality_profile,
+            user_profile={
+                "full_name": profile.full_name,
+                "age": profile.age,
+                "gender": profile.gender,
+                "height_cm": profile.height_cm,
+                "weight_kg": profile.weight_kg,
+                "diseases": profile.diseases or [],
+                "allergies": profile.allergies or [],
+            },
+        )
+
+
+class ProfileCache:
+    """``TTLCache`` de ``ProfileSnapshot`` con caché negativa e invalidación."""
+
+    def __init__(
+        self,
+        maxsize: int = PROFILE_CACHE_MAX_ENTRIES,
+        ttl: float = PROFILE_CACHE_TTL,
+        negative_ttl: float = PROFILE_CACHE_NEGATIVE_TTL,
+    ) -> None:
+        """Crea una caché vacía; los TTL están en segundos."""
+        self.negative_ttl = negative_ttl
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get_or_load(self, phone: str, load) -> ProfileSnapshot | None:
+        """
+        Devuelve el perfil de ``phone`` o ``None`` si no está registrado.
+
+        En un fallo llama a ``load(phone)`` y guarda el resultado; si ``load``
+        lanza, la excepción se propaga y no se guarda nada.
+        """
+        value = self._cache.get(phone, _MISSING)
+        if value is _UNREGISTERED:
+            PROFILE_CACHE_LOOKUPS.inc(result="negative_hit")
+            return None
+        if value is not _MISSING:
+            PROFILE_CACHE_LOOKUPS.inc(result="hit")
+            return value
+
+        PROFILE_CACHE_LOOKUPS.inc(result="miss")
+        generation = self._generation
+        snapshot = load(phone)
+        with self._lock:
+            # Si se invalidó algo durante la carga, lo leído puede ser viejo
+            if generation == self._generation:
+                if snapshot is None:
+                    self._cache.set(phone, _UNREGISTERED, ttl=self.negative_ttl)
+                else:
+                    self._cache.set(phone, snapshot)
+        return snapshot
+
+    def invalidate(self, *phones: str) -> None:
+        """Olvida los perfiles de ``phones``; la próxima búsqueda va a la BD."""
+        with self._lock:
+            self._generation += 1
+            for phone in phones:
+                self._cache.pop(phone)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._cache.clear()
+
+    def __len__(self) -> int:
+        """Número de entradas guardadas (incluye números sin perfil)."""
+        return len(self._cache)
+
+
+PROFILE_CACHE = ProfileCache()
@@ -0,0 +1,462 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from sqlalchemy import case, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from db.db import LLMRateBucket, SessionLocal
+from utils.metrics import REGISTRY
+
+logging.basicConfig(level=logging.INFO)
+
+# Dónde vive el token bucket: "memory" (por proceso), "sql" (tabla
+# llm_rate_buckets, compartido por todos los workers) o "none".
+LLM_RATE_LIMIT_BACKEND = os.getenv("LLM_RATE_LIMIT_BACKEND", "memory")
+# Cuotas por modelo: "modelo=peticiones_por_minuto:concurrencia,..."
+LLM_RATE_LIMITS = os.getenv(
+    "LLM_RATE_LIMITS",
+    "gemini-2.0-flash=900:16,gemini-2.5-flash=300:8,models/embedding-001=1500:16",
+)
+LLM_DEFAULT_RPM = float(os.getenv("LLM_DEFAULT_RPM", "600"))
+LLM_DEFAULT_CONCURRENCY = int(os.getenv("LLM_DEFAULT_CONCURRENCY", "16"))
+# Ráfaga admitida, en segundos de cuota acumulada
+LLM_RATE_BURST_SECONDS = float(os.getenv("LLM_RATE_BURST_SECONDS", "2"))
+# Espera máxima en cola antes de fallar con LLMQueueTimeout
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "60"))
+# Reintentos ante un 429 (backoff exponencial con jitter completo) y pausa
+# que se impone al bucket para que el resto de llamadas también frene.
+LLM_RATE_LIMIT_RETRIES = int(os.getenv("LLM_RATE_LIMIT_RETRIES", "3"))
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", "1"))
+LLM_RETRY_MAX_SECONDS = float(os.getenv("LLM_RETRY_MAX_SECONDS", "20"))
+LLM_RATE_LIMIT_COOLDOWN = float(os.getenv("LLM_RATE_LIMIT_COOLDOWN", "1"))
+
+# Clases de prioridad: una respuesta al usuario pasa delante de los
+# resúmenes y extracciones en segundo plano del mismo modelo.
+PRIORITIES = {"reply": 0, "background": 1}
+
+# Intervalo de sondeo de las esperas asíncronas (no bloquean el event loop)
+_ASYNC_POLL_SECONDS = 0.02
+
+LLM_QUEUE_DEPTH = REGISTRY.gauge(
+    "victoria_llm_queue_depth",
+    "Llamadas al modelo esperando turno en el limitador del proceso.",
+    ("model", "priority"),
+)
+LLM_QUEUE_WAIT = REGISTRY.histogram(
+    "victoria_llm_queue_wait_seconds",
+    "Espera en el limitador antes de llamar al modelo.",
+    ("model", "priority"),
+)
+LLM_INFLIGHT = REGISTRY.gauge(
+    "victoria_llm_inflight",
+    "Llamadas al modelo en curso en el proceso.",
+    ("model",),
+)
+LLM_RATE_LIMITED = REGISTRY.counter(
+    "victoria_llm_rate_limited_total",
+    "Respuestas 429 / RESOURCE_EXHAUSTED recibidas del modelo.",
+    ("model",),
+)
+
+
+class LLMQueueTimeout(RuntimeError):
+    """La llamada esperó más de ``LLM_QUEUE_TIMEOUT`` sin obtener turno."""
+
+
+def parse_limits(spec: str) -> dict[str, tuple[float, int]]:
+    """``"m1=900:16,m2=300"`` -> ``{"m1": (900.0, 16), "m2": (300.0, default)}``."""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        model, _, quota = item.rpartition("=")
+        rpm, _, concurrency = quota.partition(":")
+        limits[model.strip()] = (
+            float(rpm),
+            int(concurrency) if concurrency else LLM_DEFAULT_CONCURRENCY,
+        )
+    return limits
+
+
+def is_rate_limited(exc: BaseException) -> bool:
+    """Reconoce un 429 de Gemini sin importar ``google.api_core`` al arrancar."""
+    if type(exc).__name__ in ("ResourceExhausted", "TooManyRequests"):
+        return True
+    if getattr(exc, "code", None) == 429 or getattr(exc, "status_code", None) == 429:
+        return True
+    text = str(exc)
+    return text.startswith("429") or "RESOURCE_EXHAUSTED" in text
+
+
+class LocalTokenBucket:
+    """Token bucket en memoria; lo comparten los hilos de un proceso."""
+
+    shared = False
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        """``rate`` en tokens por segundo; arranca lleno."""
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self) -> float:
+        """Toma un token; devuelve 0 o los segundos hasta que haya uno."""
+        with self._lock:
+            now = time.monotonic()
+            elapsed = max(now - self._updated, 0.0)
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def penalize(self, seconds: float) -> None:
+        """Deja el bucket sin tokens durante ``seconds`` (tras un 429)."""
+        with self._lock:
+            self._tokens = min(self._tokens, 0.0) - seconds * self.rate
+            self._updated = time.monotonic()
+
+
+class SQLTokenBucket:
+    """
+    Token bucket en la tabla ``llm_rate_buckets``, compartido entre workers.
+
+    Tomar un token es un único ``UPDATE`` condicional que recarga y descuenta
+    en la misma sentencia, así que dos workers nunca gastan el mismo token.
+    El tiempo es el reloj de pared de cada worker; un desfase entre
+    máquinas solo adelanta o atrasa la recarga.
+    """
+
+    shared = True
+
+    def __init__(
+        self, model: str, rate: float, capacity: float, session_factory=SessionLocal
+    ) -> None:
+        """Configura la fila del modelo; se crea (llena) la primera vez."""
+        self.model = model
+        self.rate = rate
+        self.capacity = capacity
+        self.session_factory = session_factory
+        self._ready = False
+
+    def _ensure_row(self, db) -> None:
+        dialect = postgresql if db.bind.dialect.name == "postgresql" else sqlite
+        stmt = dialect.insert(LLMRateBucket).values(
+            model=self.model, tokens=self.capacity, updated_at=time.time()
+        )
+        db.execute(stmt.on_conflict_do_nothing(index_elements=[LLMRateBucket.model]))
+
+    def _refilled(self, now: float):
+        elapsed = now - LLMRateBucket.updated_at
+        refill = (
+            LLMRateBucket.tokens + case((elapsed > 0, elapsed), else_=0) * self.rate
+        )
+        return case((refill > self.capacity, self.capacity), else_=refill)
+
+    def take(self) -> float:
+        db = self.session_factory()
+        try:
+            if not self._ready:
+                self._ensure_row(db)
+            now = time.time()
+            refilled = self._refilled(now)
+            taken = db.execute(
+                update(LLMRateBucket)
+                .where(LLMRateBucket.model == self.model, refilled >= 1)
+                .values(tokens=refilled - 1, updated_at=now)
+            ).rowcount
+            db.commit()
+            self._ready = True
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        return 0.0 if taken else 1 / self.rate
+
+    def penalize(self, seconds: float) -> None:
+        db = self.session_factory()
+        try:
+            db.execute(
+                update(LLMRateBucket)
+                .where(LLMRateBucket.model == self.model)
+                .values(tokens=-seconds * self.rate, updated_at=time.time())
+            )
+            db.commit()
+        except Exception:
+            db.rollback()
+            logging.exception("[RATE LIMIT] Error penalizando bucket de %s", self.model)
+        finally:
+            db.close()
+
+
+class ModelLimiter:
+    """
+    Cuota de un modelo: token bucket más un máximo de llamadas en curso.
+
+    Las llamadas esperan en una cola con prioridad (``PRIORITIES``, luego
+    orden de llegada) y solo la primera de la cola pide token al bucket, así
+    que una respuesta al usuario nunca queda detrás de un resumen en segundo
+    plano. La concurrencia se limita por proceso; la tasa, según el bucket,
+    por proceso o entre todos los workers. El token se pide sin ``_cond``
+    tomado: con ``SQLTokenBucket`` es un viaje a la BD y el resto de
+    llamadas del proceso no debe esperarlo para encolarse o liberar.
+    """
+
+    def __init__(self, model: str, bucket, max_concurrency: int) -> None:
+        """Crea el limitador de ``model`` sobre ``bucket`` (o ``None``)."""
+        self.model = model
+        self.bucket = bucket
+        self.max_concurrency = max_concurrency
+        self._cond = threading.Condition()
+        self._waiting: list[tuple[int, int]] = []
+        self._seq = itertools.count()
+        self._inflight = 0
+        # La primera de la cola está pidiendo token (fuera de ``_cond``)
+        self._taking = False
+
+    def _enqueue(self, priority: str) -> tuple[int, int]:
+        ticket = (PRIORITIES[priority], next(self._seq))
+        heapq.heappush(self._waiting, ticket)
+        LLM_QUEUE_DEPTH.inc(model=self.model, priority=priority)
+        return ticket
+
+    def _leave(self, ticket: tuple[int, int], priority: str) -> None:
+        if self._waiting and self._waiting[0] == ticket:
+            heapq.heappop(self._waiting)
+        else:
+            self._waiting.remove(ticket)
+            heapq.heapify(self._waiting)
+        LLM_QUEUE_DEPTH.dec(model=self.model, priority=priority)
+        self._cond.notify_all()
+
+    def _try_grant(self, ticket: tuple[int, int], priority: str) -> float | None:
+        """
+        Intenta dar turno a ``ticket`` (con ``_cond`` tomado).
+
+        Devuelve 0 si lo obtuvo, los segundos hasta el próximo token, o
+        ``None`` si debe esperar a que otra llamada avance o termine. Suelta
+        ``_cond`` mientras pide el token; solo una llamada lo pide a la vez,
+        así que ninguna otra puede ocupar el cupo de concurrencia entretanto.
+        """
+        if (
+            self._taking
+            or self._waiting[0] != ticket
+            or self._inflight >= self.max_concurrency
+        ):
+            return None
+        if self.bucket is not None:
+            self._taking = True
+            self._cond.release()
+            try:
+                wait = self.bucket.take()
+            finally:
+                self._cond.acquire()
+                self._taking = False
+                self._cond.notify_all()
+            if wait:
+                return wait
+            # Una llamada asíncrona cancelada sale de la cola sin esperar al
+            # token; si ya no está, el token se pierde y nadie recibe turno.
+            # Si entretanto llegó una de más prioridad, el token ya es de
+            # esta llamada y el turno también.
+            if ticket not in self._waiting:
+                return None
+        self._leave(ticket, priority)
+        self._inflight += 1
+        LLM_INFLIGHT.set(self._inflight, model=self.model)
+        return 0.0
+
+    def acquire(self, priority: str = "reply", timeout: float | None = None) -> None:
+        timeout = LLM_QUEUE_TIMEOUT if timeout is None else timeout
+        started = time.monotonic()
+        with self._cond:
+            ticket = self._enqueue(priority)
+            try:
+                while True:
+                    wait = self._try_grant(ticket, priority)
+                    if wait == 0:
+                        break
+                    remaining = timeout - (time.monotonic() - started)
+                    if remaining <= 0:
+                        raise LLMQueueTimeout(f"Sin turno para {self.model}")
+                    self._cond.wait(remaining if wait is None else min(wait, remaining))
+            except BaseException:
+                # Timeout o error del bucket: la llamada sale de la cola
+                if ticket in self._waiting:
+                    self._leave(ticket, priority)
+                raise
+        LLM_QUEUE_WAIT.observe(
+            time.monotonic() - started, model=self.model, priority=priority
+        )
+
+    async def acquire_async(
+        self, priority: str = "reply", timeout: float | None = None
+    ) -> None:
+        """
+        Versión asíncrona de ``acquire``: sondea sin bloquear el event loop.
+
+        ``_cond`` nunca se retiene durante E/S, así que tomarlo desde el loop
+        es inmediato; el token de un bucket compartido se pide en un hilo.
+        """
+        timeout = LLM_QUEUE_TIMEOUT if timeout is None else timeout
+        started = time.monotonic()
+        with self._cond:
+            ticket = self._enqueue(priority)
+        try:
+            while True:
+                if self.bucket is not None and self.bucket.shared:
+                    wait = await asyncio.to_thread(self._grant_locked, ticket, priority)
+                else:
+                    wait = self._grant_locked(ticket, priority)
+                if wait == 0:
+                    break
+                if time.monotonic() - started >= timeout:
+                    raise LLMQueueTimeout(f"Sin turno para {self.model}")
+                await asyncio.sleep(min(wait or _ASYNC_POLL_SECONDS, 1.0))
+        except BaseException:
+            # Timeout o cancelación: la llamada sale de la cola
+            with self._cond:
+                if ticket in self._waiting:
+                    self._leave(ticket, priority)
+            raise
+        LLM_QUEUE_WAIT.observe(
+            time.monotonic() - started, model=self.model, priority=priority
+        )
+
+    def _grant_locked(self, ticket: tuple[int, int], priority: str) -> float | None:
+        with self._cond:
+            return self._try_grant(ticket, priority)
+
+    def release(self) -> None:
+        with self._cond:
+            self._inflight -= 1
+            LLM_INFLIGHT.set(self._inflight, model=self.model)
+            self._cond.notify_all()
+
+    def penalize(self, seconds: float) -> None:
+        if self.bucket is not None:
+            self.bucket.penalize(seconds)
+
+
+_lock = threading.Lock()
+_limiters: dict[str, ModelLimiter] = {}
+_pid = os.getpid()
+
+
+def _build_limiter(model: str) -> ModelLimiter:
+    rpm, concurrency = parse_limits(LLM_RATE_LIMITS).get(
+        model, (LLM_DEFAULT_RPM, LLM_DEFAULT_CONCURRENCY)
+    )
+    rate = rpm / 60
+    capacity = max(1.0, rate * LLM_RATE_BURST_SECONDS)
+    backend = LLM_RATE_LIMIT_BACKEND.lower()
+    if backend == "sql":
+        bucket = SQLTokenBucket(model, rate, capacity)
+    elif backend == "memory":
+        bucket = LocalTokenBucket(rate, capacity)
+    elif backend == "none":
+        bucket = None
+    else:
+        raise ValueError(f"LLM_RATE_LIMIT_BACKEND desconocido: {backend}")
+    return ModelLimiter(model, bucket, concurrency)
+
+
+def get_limiter(model: str) -> ModelLimiter:
+    """Limitador del modelo en este proceso (se recrea tras un ``fork``)."""
+    global _pid
+    with _lock:
+        if _pid != os.getpid():
+            _limiters.clear()
+            _pid = os.getpid()
+        limiter = _limiters.get(model)
+        if limiter is None:
+            limiter = _limiters[model] = _build_limiter(model)
+        return limiter
+
+
+def clear_limiters() -> None:
+    """Descarta los limitadores (tests y cambio de cuotas)."""
+    with _lock:
+        _limiters.clear()
+
+
+def _backoff(attempt: int) -> float:
+    # Jitter completo: los workers que recibieron el 429 a la vez no
+    # vuelven a chocar en el mismo instante.
+    return random.uniform(
+        0, min(LLM_RETRY_MAX_SECONDS, LLM_RETRY_BASE_SECONDS * 2**attempt)
+    )
+
+
+@contextmanager
+def model_slot(model: str, priority: str = "reply"):
+    """Ocupa un turno del limitador de ``model`` durante el bloque."""
+    limiter = get_limiter(model)
+    limiter.acquire(priority)
+    try:
+        yield limiter
+    finally:
+        limiter.release()
+
+
+@asynccontextmanager
+async def model_slot_async(model: str, priority: str = "reply"):
+    """Versión asíncrona de ``model_slot``."""
+    limiter = get_limiter(model)
+    await limiter.acquire_async(priority)
+    try:
+        yield limiter
+    finally:
+        limiter.release()
+
+
+def call_model(model: str, priority: str, fn, *args, **kwargs):
+    """
+    Ejecuta ``fn(*args, **kwargs)`` (una llamada a Gemini) dentro de la cuota.
+
+    Ante un 429 frena el bucket ``LLM_RATE_LIMIT_COOLDOWN`` segundos para
+    todas las llamadas del modelo y reintenta hasta ``LLM_RATE_LIMIT_RETRIES``
+    veces con backoff exponencial y jitter, fuera del turno. Cualquier otro
+    error se propaga sin reintentar.
+    """
+    for attempt in range(LLM_RATE_LIMIT_RETRIES + 1):
+        with model_slot(model, priority) as limiter:
+            try:
+                return fn(*args, **kwargs)
+            except Exception as exc:
+                if not is_rate_limited(exc) or attempt == LLM_RATE_LIMIT_RETRIES:
+                    raise
+                LLM_RATE_LIMITED.inc(model=model)
+                limiter.penalize(LLM_RATE_LIMIT_COOLDOWN)
+        delay = _backoff(attempt)
+        logging.warning(
+            "[RATE LIMIT] 429 de %s; reintento %s en %.2fs", model, attempt + 1, delay
+        )
+        time.sleep(delay)
+
+
+async def acall_model(model: str, priority: str, fn, *args, **kwargs):
+    """Versión asíncrona de ``call_model``; ``fn`` devuelve un awaitable."""
+    for attempt in range(LLM_RATE_LIMIT_RETRIES + 1):
+        async with model_slot_async(model, priority) as limiter:
+            try:
+                return await fn(*args, **kwargs)
+            except Exception as exc:
+                if not is_rate_limited(exc) or attempt == LLM_RATE_LIMIT_RETRIES:
+                    raise
+                LLM_RATE_LIMITED.inc(model=model)
+                await asyncio.to_thread(limiter.penalize, LLM_RATE_LIMIT_COOLDOWN)
+        delay = _backoff(attempt)
+        logging.warning(
+            "[RATE LIMIT] 429 de %s; reintento %s en %.2fs", model, attempt + 1, delay
+        )
+        await asyncio.sleep(delay)
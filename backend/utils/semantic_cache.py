@@ -0,0 +1,212 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+from utils.lazy import lazy_imports
+from utils.llm import get_chat_model
+from utils.metrics import REGISTRY, span
+from utils.ratelimit import call_model
+
+if TYPE_CHECKING:
+    import numpy as np
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+_load, __getattr__ = lazy_imports(
+    globals(),
+    {
+        # numpy solo hace falta con la caché activa (SEMANTIC_CACHE_ENABLED)
+        "np": "numpy",
+        "GoogleGenerativeAIEmbeddings": (
+            "langchain_google_genai:GoogleGenerativeAIEmbeddings"
+        ),
+    },
+)
+
+EMBEDDING_MODEL = "models/embedding-001"
+
+# Desactivada por defecto: solo responde desde caché si se habilita
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "0") == "1"
+# Similitud coseno mínima para reutilizar una respuesta
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", str(24 * 3600)))
+SEMANTIC_CACHE_MAX_PER_SCOPE = int(os.getenv("SEMANTIC_CACHE_MAX_PER_SCOPE", "500"))
+SEMANTIC_CACHE_MAX_SCOPES = int(os.getenv("SEMANTIC_CACHE_MAX_SCOPES", "1000"))
+# Solo preguntas cortas y generales; un mensaje largo suele ser personal
+SEMANTIC_CACHE_MAX_CHARS = int(os.getenv("SEMANTIC_CACHE_MAX_CHARS", "200"))
+
+SEMANTIC_CACHE_LOOKUPS = REGISTRY.counter(
+    "victoria_semantic_cache_lookups_total",
+    "Consultas a la caché semántica de respuestas por resultado (hit, miss).",
+    ("result",),
+)
+SEMANTIC_CACHE_SAVED_SECONDS = REGISTRY.counter(
+    "victoria_semantic_cache_saved_seconds_total",
+    "Segundos de chain.predict ahorrados por respuestas servidas desde caché.",
+)
+
+_QUESTION_START = re.compile(
+    r"^\W*(qu[eé]|c[oó]mo|cu[aá]nt[oa]s?|cu[aá]l(es)?|cu[aá]ndo|d[oó]nde|"
+    r"puedo|debo|es bueno|es malo|se puede|por qu[eé])\b",
+    re.IGNORECASE,
+)
+
+
+def is_cacheable_question(text: str) -> bool:
+    """Pregunta corta y general (lleva '?' o empieza con un interrogativo)."""
+    text = (text or "").strip()
+    if not text or len(text) > SEMANTIC_CACHE_MAX_CHARS:
+        return False
+    return "?" in text or bool(_QUESTION_START.match(text))
+
+
+def profile_scope(
+    phone: str, user_profile: dict | None, personality_stage: str
+) -> tuple:
+    """
+    Ámbito de la caché: el usuario más las facetas que cambian la respuesta.
+
+    Las respuestas no se comparten entre usuarios: la cadena responde con la
+    memoria y el perfil de cada uno. Enfermedades, alergias y fase también
+    forman parte del ámbito, así que un cambio de perfil no reutiliza
+    respuestas anteriores.
+    """
+    user_profile = user_profile or {}
+
+    def facet(key):
+        return tuple(
+            sorted({str(v).strip().lower() for v in user_profile.get(key) or []})
+        )
+
+    return (phone, facet("diseases"), facet("allergies"), personality_stage)
+
+
+def gemini_embed(text: str) -> "np.ndarray":
+    _load()
+    embeddings = get_chat_model(GoogleGenerativeAIEmbeddings, model=EMBEDDING_MODEL)
+    vector = call_model(EMBEDDING_MODEL, "reply", embeddings.embed_query, text)
+    return np.asarray(vector, dtype=np.float32)
+
+
+@dataclass
+class CacheLookup:
+    """Resultado de ``SemanticCache.lookup``; se pasa a ``store`` en un fallo."""
+
+    scope: tuple
+    question: str
+    vector: "np.ndarray"
+    answer: str | None = None
+    similarity: float = 0.0
+
+    @property
+    def hit(self) -> bool:
+        return self.answer is not None
+
+
+@dataclass
+class _ScopeIndex:
+    answers: list[tuple[str, float, float]] = field(default_factory=list)
+    vectors: list["np.ndarray"] = field(default_factory=list)
+    matrix: "np.ndarray | None" = None
+
+
+class SemanticCache:
+    """
+    Caché de respuestas por similitud de embeddings, separada por ámbito de perfil.
+
+    Cada ámbito (ver ``profile_scope``) tiene su propio índice: una matriz
+    de vectores normalizados contra la que se calcula la similitud coseno
+    con un producto matricial. Las entradas expiran a los ``ttl`` segundos,
+    cada ámbito guarda como mucho ``max_entries`` (se descartan las más
+    antiguas) y los ámbitos menos usados se expulsan pasados ``max_scopes``.
+    """
+
+    def __init__(
+        self,
+        embed=gemini_embed,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        ttl: float = SEMANTIC_CACHE_TTL,
+        max_entries: int = SEMANTIC_CACHE_MAX_PER_SCOPE,
+        max_scopes: int = SEMANTIC_CACHE_MAX_SCOPES,
+    ) -> None:
+        """Configura la función de embeddings, el umbral y los límites."""
+        self.embed = embed
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_scopes = max_scopes
+        self._scopes: OrderedDict[tuple, _ScopeIndex] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, question: str, scope: tuple) -> CacheLookup:
+        _load("np")
+        with span("gemini_embed"):
+            vector = _normalize(self.embed(question))
+        result = CacheLookup(scope, question, vector)
+
+        with self._lock:
+            index = self._scopes.get(scope)
+            if index is not None:
+                self._scopes.move_to_end(scope)
+                self._purge(index)
+                if index.answers:
+                    if index.matrix is None:
+                        index.matrix = np.vstack(index.vectors)
+                    similarities = index.matrix @ vector
+                    best = int(np.argmax(similarities))
+                    if similarities[best] >= self.threshold:
+                        answer, _, latency = index.answers[best]
+                        result.answer = answer
+                        result.similarity = float(similarities[best])
+                        SEMANTIC_CACHE_SAVED_SECONDS.inc(latency)
+
+        SEMANTIC_CACHE_LOOKUPS.inc(result="hit" if result.hit else "miss")
+        return result
+
+    def store(self, lookup: CacheLookup, answer: str, latency: float = 0.0) -> None:
+        """Guarda la respuesta generada para la pregunta de un ``lookup`` fallido."""
+        with self._lock:
+            index = self._scopes.get(lookup.scope)
+            if index is None:
+                index = self._scopes[lookup.scope] = _ScopeIndex()
+                while len(self._scopes) > self.max_scopes:
+                    self._scopes.popitem(last=False)
+            self._scopes.move_to_end(lookup.scope)
+            index.answers.append((answer, time.monotonic() + self.ttl, latency))
+            index.vectors.append(lookup.vector)
+            if len(index.answers) > self.max_entries:
+                del index.answers[0]
+                del index.vectors[0]
+            index.matrix = None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._scopes.clear()
+
+    def __len__(self) -> int:
+        """Número total de respuestas guardadas."""
+        return sum(len(index.answers) for index in self._scopes.values())
+
+    def _purge(self, index: _ScopeIndex) -> None:
+        now = time.monotonic()
+        # Las entradas se agregan en orden, así que las expiradas van primero
+        expired = 0
+        while expired < len(index.answers) and index.answers[expired][1] <= now:
+            expired += 1
+        if expired:
+            del index.answers[:expired]
+            del index.vectors[:expired]
+            index.matrix = None
+
+
+def _normalize(vector) -> "np.ndarray":
+    _load("np")
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else vector
+
+
+SEMANTIC_CACHE = SemanticCache()
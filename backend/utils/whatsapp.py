@@ -1,110 +1,399 @@
+import asyncio
 import logging
 import os
+import tempfile
+import time
 
 import requests
 
-from db.db import SessionLocal, UserProfile, WhatsAppMessage
-from utils.langchain import get_user_chain, summarize_personality
+from db.db import SessionLocal, UserProfile
+from db.session import after_commit, db_session
+from utils.conversation_state import build_state_store
+from utils.conversation_stats import message_count, recent_messages
+from utils.fast_path import fast_reply
+from utils.http_async import get_async_client
+from utils.langchain import (
+    CONVERSATION_MODEL,
+    get_user_chain,
+    last_reply,
+    remember_turn,
+    save_conversation_state,
+    set_conversation_state_store,
+    summarize_personality,
+)
+from utils.metrics import REGISTRY, span
+from utils.profile_cache import PROFILE_CACHE, ProfileSnapshot
+from utils.ratelimit import acall_model, call_model
+from utils.semantic_cache import (
+    SEMANTIC_CACHE,
+    SEMANTIC_CACHE_ENABLED,
+    CacheLookup,
+    is_cacheable_question,
+    profile_scope,
+)
 
 logging.basicConfig(level=logging.INFO)
 
+# Descarga de media en streaming: tamaño de cada bloque leído de la Graph API,
+# bytes que se mantienen en memoria antes de pasar a disco y tamaño máximo.
+MEDIA_CHUNK_BYTES = int(os.getenv("WHATSAPP_MEDIA_CHUNK_BYTES", str(64 * 1024)))
+MEDIA_SPOOL_BYTES = int(os.getenv("WHATSAPP_MEDIA_SPOOL_BYTES", str(1024 * 1024)))
+MEDIA_MAX_BYTES = int(os.getenv("WHATSAPP_MEDIA_MAX_BYTES", str(100 * 1024 * 1024)))
 
-def build_whatsapp_reply(user_message: str, phone: str) -> str:
+REPLY_PATHS = REGISTRY.counter(
+    "victoria_reply_paths_total",
+    "Respuestas generadas por camino (fast_path, semantic_cache, llm).",
+    ("path",),
+)
+
+
+def _query_profile(phone: str) -> ProfileSnapshot | None:
+    with db_session(SessionLocal) as db, span("db_profile_lookup"):
+        profile = (
+            db.query(UserProfile)
+            .filter(UserProfile.whatsapp_number == phone)
+            .order_by(UserProfile.created_at.desc())
+            .first()
+        )
+        return ProfileSnapshot.from_model(profile) if profile else None
+
+
+def _load_reply_context(phone: str):
     """
-    Genera la respuesta nutricional para WhatsApp usando LangChain.
+    Carga el perfil del usuario por número de WhatsApp.
 
-    Ahora intenta recuperar el perfil del usuario desde la BD (UserProfile)
-    usando el número de WhatsApp como clave, para personalizar el prompt
-    de Victoria (condiciones, alergias, etc.).
+    Devuelve ``(profile, user_profile_dict, personality_stage)``; si no hay
+    perfil (o la BD falla) el usuario se trata como nuevo en fase 'profiling'.
+    El perfil sale de ``PROFILE_CACHE`` y solo va a la BD en un fallo.
     """
     user_profile_dict = None
-
     personality_stage = "profiling"
     profile = None
 
-    if phone:
-        db = SessionLocal()
-        try:
-            profile = (
-                db.query(UserProfile)
-                .filter(UserProfile.whatsapp_number == phone)
-                .order_by(UserProfile.created_at.desc())
-                .first()
-            )
+    if not phone:
+        return profile, user_profile_dict, personality_stage
+
+    try:
+        profile = PROFILE_CACHE.get_or_load(phone, _query_profile)
+    except Exception:
+        logging.exception("[WHATSAPP] Error cargando perfil de usuario para %s", phone)
+
+    if profile:
+        personality_stage = profile.personality_stage
+        user_profile_dict = profile.user_profile
+
+    return profile, user_profile_dict, personality_stage
+
+
+# Memoria de conversación compartida entre workers (CONVERSATION_STATE_BACKEND)
+set_conversation_state_store(build_state_store())
 
-            if profile:
-                personality_stage = profile.personality_stage or "profiling"
-                user_profile_dict = {
-                    "full_name": profile.full_name,
-                    "age": profile.age,
-                    "gender": profile.gender,
-                    "height_cm": profile.height_cm,
-                    "weight_kg": profile.weight_kg,
-                    "diseases": profile.diseases or [],
-                    "allergies": profile.allergies or [],
-                }
-        except Exception:
-            logging.exception(
-                "[WHATSAPP] Error cargando perfil de usuario para %s", phone
-            )
-        finally:
-            db.close()
 
-    chain = get_user_chain(
+def _reply_chain(phone: str, profile, user_profile_dict, personality_stage: str):
+    return get_user_chain(
         phone,
         user_profile=user_profile_dict,
         personality_stage=personality_stage,
         personality_profile=(profile.personality_profile if profile else None),
     )
-    response = chain.predict(input=user_message).strip()
-
-    # Si estamos en fase de perfilamiento, contar mensajes y decidir si cambiamos a 'daily'
-    if phone and profile and personality_stage == "profiling":
-        db = SessionLocal()
-        try:
-            total_msgs = (
-                db.query(WhatsAppMessage).filter(WhatsAppMessage.phone == phone).count()
+
+
+def _fast_path_reply(user_message: str, phone: str, chain=None) -> str | None:
+    """
+    Responde con plantilla los mensajes triviales ("gracias", "ok", 👍).
+
+    No carga el perfil ni la cadena: el turno se agrega a la memoria con
+    ``remember_turn`` para que la conversación siga coherente. Si ``chain``
+    ya está cargada (``WhatsAppTurn.load``) se agrega a su memoria y lo
+    guarda ``WhatsAppTurn.save`` con el resto del turno.
+    """
+    with span("fast_path"):
+        reply = fast_reply(user_message, lambda: last_reply(phone) if phone else None)
+    if reply is None:
+        return None
+    REPLY_PATHS.inc(path="fast_path")
+    if chain is not None:
+        _remember_cached_turn(chain, user_message, reply)
+    elif phone:
+        remember_turn(phone, user_message, reply)
+    return reply
+
+
+def _cached_reply(
+    user_message: str, phone: str, user_profile_dict, personality_stage: str
+) -> CacheLookup | None:
+    """
+    Busca una respuesta previa a una pregunta parecida (SEMANTIC_CACHE_ENABLED).
+
+    Solo aplica a preguntas cortas de usuarios con perfil, y solo reutiliza
+    respuestas del mismo usuario con las mismas enfermedades, alergias y fase
+    (ver ``profile_scope``). En 'profiling' no aplica: la
+    respuesta es la siguiente pregunta de la entrevista de cada usuario.
+    Devuelve ``None`` si no aplica (y entonces ``_cache_reply`` tampoco
+    guarda) o si falla el embedding (se sigue con el LLM).
+    """
+    if (
+        not SEMANTIC_CACHE_ENABLED
+        or user_profile_dict is None
+        or personality_stage == "profiling"
+        or not is_cacheable_question(user_message)
+    ):
+        return None
+    try:
+        with span("semantic_cache_lookup"):
+            return SEMANTIC_CACHE.lookup(
+                user_message,
+                profile_scope(phone, user_profile_dict, personality_stage),
+            )
+    except Exception:
+        logging.exception("[WHATSAPP] Error consultando la caché semántica")
+        return None
+
+
+def _remember_cached_turn(chain, user_message: str, response: str) -> None:
+    """Agrega a la memoria el turno respondido desde caché, como haría predict."""
+    memory = getattr(chain, "memory", None)
+    if memory is not None:
+        memory.save_context({"input": user_message}, {"output": response})
+
+
+def _cache_reply(lookup: CacheLookup | None, response: str, latency: float) -> None:
+    if lookup is None or lookup.hit or not response:
+        return
+    SEMANTIC_CACHE.store(lookup, response, latency)
+
+
+def _personality_history(phone: str, profile: ProfileSnapshot) -> str | None:
+    """
+    Lecturas de ``_update_personality_stage``: el historial a resumir, o
+    ``None`` si todavía no toca (o si otro worker ya pasó el perfil a 'daily').
+    """
+    with db_session(SessionLocal) as db:
+        with span("db_message_count"):
+            total_msgs = message_count(db, phone)
+
+        # Umbral simple: si ya hubo suficientes turnos, generamos resumen
+        if total_msgs < 12 or profile.personality_profile is not None:
+            return None
+
+        # El perfil en caché puede ser de antes de que otro worker lo pasara
+        # a 'daily': se confirma en la BD antes de pagar el resumen
+        with span("db_stage_check"):
+            row = (
+                db.query(UserProfile.personality_stage)
+                .filter(UserProfile.id == profile.id)
+                .first()
+            )
+        if row is None or (row.personality_stage or "profiling") != "profiling":
+            PROFILE_CACHE.invalidate(phone)
+            return None
+
+        # Historial simple usuario/Victoria con los últimos 40 mensajes
+        with span("db_history"):
+            msgs = recent_messages(db, phone, limit=40)
+
+    history_lines = []
+    for m in msgs:
+        prefix = "Usuario" if m.direction == "in" else "Victoria"
+        history_lines.append(f"{prefix}: {m.message}")
+
+    return "\n".join(history_lines)
+
+
+def _summarize_personality_stage(
+    phone: str, profile: ProfileSnapshot, user_profile_dict, history_text: str
+) -> None:
+    """Genera el resumen de personalidad con Gemini y pasa el perfil a 'daily'."""
+    try:
+        with span("gemini_summary"):
+            summary = summarize_personality(history_text, user_profile_dict or {})
+        with db_session(SessionLocal) as db, span("db_commit"):
+            # Otro worker pudo pasarlo a 'daily' mientras tanto
+            db.query(UserProfile).filter(
+                UserProfile.id == profile.id,
+                UserProfile.personality_stage == "profiling",
+            ).update(
+                {"personality_profile": summary, "personality_stage": "daily"},
+                synchronize_session=False,
+            )
+            # Tras el commit: antes, otro hilo podría volver a guardar en
+            # caché la fila vieja
+            after_commit(db, lambda: PROFILE_CACHE.invalidate(phone))
+    except Exception:
+        logging.exception(
+            "[WHATSAPP] Error generando resumen de personalidad para %s", phone
+        )
+        return
+    logging.info("[WHATSAPP] Perfil de personalidad generado para %s", phone)
+
+
+def _update_personality_stage(
+    phone: str, profile: ProfileSnapshot, user_profile_dict
+) -> None:
+    """
+    Cuenta los mensajes del usuario en fase de perfilamiento y, si ya hubo
+    suficientes turnos, genera el resumen de personalidad y pasa a 'daily'.
+
+    El conteo sale de ``conversation_stats`` y el historial es solo la cola
+    de los últimos 40 mensajes, así que el costo no crece con el historial.
+    Antes de llamar a Gemini se relee la fase en la BD: la caché de perfiles
+    es por proceso y puede seguir en 'profiling' tras el cambio en otro worker.
+    """
+    history_text = _personality_history(phone, profile)
+    if history_text is not None:
+        _summarize_personality_stage(phone, profile, user_profile_dict, history_text)
+
+
+class WhatsAppTurn:
+    """
+    Un turno de conversación con sus accesos a la BD separados de Gemini.
+
+    - ``load``: lecturas (perfil desde ``PROFILE_CACHE`` y la comprobación
+      de versión de la sesión de conversación).
+    - ``reply``/``areply``: camino rápido, caché semántica o Gemini; no toca
+      la BD si ``load`` ya corrió.
+    - ``save``: escrituras (estado de conversación) y el conteo de la fase
+      de perfilamiento.
+    - ``summarize``: el resumen de personalidad, si ``save`` vio que tocaba.
+
+    El pipeline corre ``load`` y ``save`` dentro de sus dos unidades de
+    trabajo cortas (con la deduplicación y con el guardado de mensajes), así
+    que un turno usa dos conexiones del pool y ninguna queda tomada durante
+    las llamadas externas; ``summarize`` llama a Gemini y va después.
+    """
+
+    def __init__(self, phone: str) -> None:
+        """Turno del teléfono ``phone``, todavía sin cargar."""
+        self.phone = phone
+        self.profile = None
+        self.user_profile = None
+        self.personality_stage = "profiling"
+        self.chain = None
+        self._history = None
+
+    def load(self) -> None:
+        self.profile, self.user_profile, self.personality_stage = _load_reply_context(
+            self.phone
+        )
+        self.chain = _reply_chain(
+            self.phone, self.profile, self.user_profile, self.personality_stage
+        )
+
+    def reply(self, user_message: str) -> str:
+        reply = _fast_path_reply(user_message, self.phone, self.chain)
+        if reply is not None:
+            return reply
+        if self.chain is None:
+            self.load()
+
+        cached = _cached_reply(
+            user_message, self.phone, self.user_profile, self.personality_stage
+        )
+        if cached is not None and cached.hit:
+            REPLY_PATHS.inc(path="semantic_cache")
+            _remember_cached_turn(self.chain, user_message, cached.answer)
+            return cached.answer
+
+        REPLY_PATHS.inc(path="llm")
+        started = time.perf_counter()
+        with span("gemini_chat"):
+            response = call_model(
+                CONVERSATION_MODEL, "reply", self.chain.predict, input=user_message
+            ).strip()
+        _cache_reply(cached, response, time.perf_counter() - started)
+        return response
+
+    async def areply(self, user_message: str) -> str:
+        """
+        Versión asíncrona de ``reply``: Gemini con ``chain.apredict`` y lo
+        que pueda tocar la BD (o cargar la sesión) en un hilo.
+        """
+        reply = await asyncio.to_thread(
+            _fast_path_reply, user_message, self.phone, self.chain
+        )
+        if reply is not None:
+            return reply
+        if self.chain is None:
+            await asyncio.to_thread(self.load)
+
+        cached = await asyncio.to_thread(
+            _cached_reply,
+            user_message,
+            self.phone,
+            self.user_profile,
+            self.personality_stage,
+        )
+        if cached is not None and cached.hit:
+            REPLY_PATHS.inc(path="semantic_cache")
+            await asyncio.to_thread(
+                _remember_cached_turn, self.chain, user_message, cached.answer
             )
+            return cached.answer
 
-            # Umbral simple: si ya hubo suficientes turnos, generamos resumen
-            if total_msgs >= 12 and profile.personality_profile is None:
-                # Construir historial simple usuario/Victoria
-                msgs = (
-                    db.query(WhatsAppMessage)
-                    .filter(WhatsAppMessage.phone == phone)
-                    .order_by(WhatsAppMessage.created_at.asc())
-                    .all()
+        REPLY_PATHS.inc(path="llm")
+        started = time.perf_counter()
+        with span("gemini_chat"):
+            response = (
+                await acall_model(
+                    CONVERSATION_MODEL, "reply", self.chain.apredict, input=user_message
                 )
+            ).strip()
+        _cache_reply(cached, response, time.perf_counter() - started)
+        return response
 
-                history_lines = []
-                for m in msgs:
-                    prefix = "Usuario" if m.direction == "in" else "Victoria"
-                    history_lines.append(f"{prefix}: {m.message}")
-
-                history_text = "\n".join(
-                    history_lines[-40:]
-                )  # últimos 40 mensajes como contexto
-
-                try:
-                    summary = summarize_personality(
-                        history_text, user_profile_dict or {}
-                    )
-                    profile.personality_profile = summary
-                    profile.personality_stage = "daily"
-                    db.add(profile)
-                    db.commit()
-                    logging.info(
-                        "[WHATSAPP] Perfil de personalidad generado para %s", phone
-                    )
-                except Exception:
-                    db.rollback()
-                    logging.exception(
-                        "[WHATSAPP] Error generando resumen de personalidad para %s",
-                        phone,
-                    )
-        finally:
-            db.close()
+    def save(self) -> None:
+        # Sin cadena el turno fue del camino rápido y remember_turn ya guardó
+        if not self.phone or self.chain is None:
+            return
+        save_conversation_state(self.phone)
+        # Si estamos en fase de perfilamiento, contar mensajes y decidir si
+        # cambiamos a 'daily'. Un error aquí no debe deshacer el guardado
+        # de los mensajes que comparte la unidad.
+        if self.profile and self.personality_stage == "profiling":
+            try:
+                self._history = _personality_history(self.phone, self.profile)
+            except Exception:
+                logging.exception(
+                    "[WHATSAPP] Error revisando la fase de perfilamiento de %s",
+                    self.phone,
+                )
+
+    def summarize(self) -> None:
+        if self._history is not None:
+            _summarize_personality_stage(
+                self.phone, self.profile, self.user_profile, self._history
+            )
+            self._history = None
 
+
+def build_whatsapp_reply(user_message: str, phone: str) -> str:
+    """
+    Genera la respuesta nutricional para WhatsApp usando LangChain.
+
+    Ahora intenta recuperar el perfil del usuario desde la BD (UserProfile)
+    usando el número de WhatsApp como clave, para personalizar el prompt
+    de Victoria (condiciones, alergias, etc.). Es un ``WhatsAppTurn``
+    completo; el pipeline usa el turno directamente para agrupar sus
+    accesos a la BD.
+    """
+    turn = WhatsAppTurn(phone)
+    response = turn.reply(user_message)
+    turn.save()
+    turn.summarize()
+    return response
+
+
+async def build_whatsapp_reply_async(user_message: str, phone: str) -> str:
+    """
+    Versión asíncrona de ``build_whatsapp_reply``.
+
+    La llamada a Gemini usa ``chain.apredict`` y no bloquea el event loop; las
+    consultas a la BD (SQLAlchemy síncrono) van a un hilo con ``asyncio.to_thread``.
+    """
+    turn = WhatsAppTurn(phone)
+    response = await turn.areply(user_message)
+    await asyncio.to_thread(turn.save)
+    await asyncio.to_thread(turn.summarize)
     return response
 
 
@@ -116,11 +405,43 @@ def send_whatsapp_message(phone: str, text: str) -> dict:
     - WHATSAPP_ACCESS_TOKEN
     - WHATSAPP_PHONE_NUMBER_ID
     """
+    request = _send_request(phone, text)
+    if request is None:
+        return {"error": "Faltan WHATSAPP_ACCESS_TOKEN o WHATSAPP_PHONE_NUMBER_ID"}
+    url, headers, payload = request
+
+    try:
+        with span("graph_send"):
+            resp = requests.post(url, headers=headers, json=payload, timeout=10)
+        return {"status_code": resp.status_code, "response": resp.json()}
+    except Exception as e:
+        return {"error": str(e)}
+
+
+async def send_whatsapp_message_async(phone: str, text: str) -> dict:
+    """Versión asíncrona de ``send_whatsapp_message`` con el cliente httpx compartido."""
+    request = _send_request(phone, text)
+    if request is None:
+        return {"error": "Faltan WHATSAPP_ACCESS_TOKEN o WHATSAPP_PHONE_NUMBER_ID"}
+    url, headers, payload = request
+
+    try:
+        with span("graph_send"):
+            resp = await get_async_client().post(
+                url, headers=headers, json=payload, timeout=10
+            )
+        return {"status_code": resp.status_code, "response": resp.json()}
+    except Exception as e:
+        return {"error": str(e)}
+
+
+def _send_request(phone: str, text: str):
+    """``(url, headers, payload)`` del envío de texto, o ``None`` si falta configuración."""
     access_token = os.getenv("WHATSAPP_ACCESS_TOKEN")
     phone_number_id = os.getenv("WHATSAPP_PHONE_NUMBER_ID")
 
     if not access_token or not phone_number_id:
-        return {"error": "Faltan WHATSAPP_ACCESS_TOKEN o WHATSAPP_PHONE_NUMBER_ID"}
+        return None
 
     url = f"https://graph.facebook.com/v17.0/{phone_number_id}/messages"
 
@@ -135,21 +456,101 @@ def send_whatsapp_message(phone: str, text: str) -> dict:
         "type": "text",
         "text": {"body": text},
     }
+    return url, headers, payload
+
+
+def download_whatsapp_media_stream(
+    media_id: str,
+    chunk_size: int | None = None,
+    spool_bytes: int | None = None,
+    max_bytes: int | None = None,
+):
+    """
+    Descarga un media de WhatsApp en streaming a un archivo temporal.
+
+    Nunca mantiene el archivo completo en memoria: los bloques se copian a
+    un ``SpooledTemporaryFile`` que vive en RAM hasta ``spool_bytes`` y
+    luego pasa a disco.
+
+    Devuelve ``(archivo, tamaño)`` con el archivo rebobinado al inicio, o
+    ``None`` si la descarga falla o supera ``max_bytes``. El llamador debe
+    cerrar el archivo.
+    """
+    chunk_size = chunk_size or MEDIA_CHUNK_BYTES
+    spool_bytes = spool_bytes or MEDIA_SPOOL_BYTES
+    max_bytes = max_bytes or MEDIA_MAX_BYTES
+
+    access_token = os.getenv("WHATSAPP_ACCESS_TOKEN")
+    if not access_token:
+        logging.error(
+            "[WHATSAPP MEDIA] Falta WHATSAPP_ACCESS_TOKEN para descargar media"
+        )
+        return None
 
+    meta_url = f"https://graph.facebook.com/v17.0/{media_id}"
+    headers = {"Authorization": f"Bearer {access_token}"}
+
+    spool = tempfile.SpooledTemporaryFile(max_size=spool_bytes)
     try:
-        resp = requests.post(url, headers=headers, json=payload, timeout=10)
-        return {"status_code": resp.status_code, "response": resp.json()}
+        with span("graph_media_download"):
+            meta_resp = requests.get(meta_url, headers=headers, timeout=10)
+            meta_resp.raise_for_status()
+            meta_data = meta_resp.json()
+            media_url = meta_data.get("url")
+            if not media_url:
+                logging.error(
+                    "[WHATSAPP MEDIA] Respuesta sin URL para media_id=%s: %s",
+                    media_id,
+                    meta_data,
+                )
+                spool.close()
+                return None
+
+            size = 0
+            with requests.get(
+                media_url, headers=headers, timeout=20, stream=True
+            ) as resp:
+                resp.raise_for_status()
+                for chunk in resp.iter_content(chunk_size=chunk_size):
+                    size += len(chunk)
+                    if size > max_bytes:
+                        logging.error(
+                            "[WHATSAPP MEDIA] Media %s supera el máximo de %s bytes",
+                            media_id,
+                            max_bytes,
+                        )
+                        spool.close()
+                        return None
+                    spool.write(chunk)
+
+        spool.seek(0)
+        return spool, size
     except Exception as e:
-        return {"error": str(e)}
+        spool.close()
+        logging.exception(
+            "[WHATSAPP MEDIA] Error descargando media %s: %s", media_id, e
+        )
+        return None
 
 
-def download_whatsapp_media(media_id: str) -> bytes | None:
+async def download_whatsapp_media_stream_async(
+    media_id: str,
+    chunk_size: int | None = None,
+    spool_bytes: int | None = None,
+    max_bytes: int | None = None,
+):
     """
-    Descarga el binario de un media de WhatsApp Cloud API usando su media_id.
+    Versión asíncrona de ``download_whatsapp_media_stream``.
 
-    1) GET https://graph.facebook.com/v17.0/{media_id} para obtener la URL.
-    2) GET a esa URL con el mismo Bearer token para obtener los bytes.
+    Usa el cliente httpx compartido del event loop; mismo contrato: devuelve
+    ``(archivo, tamaño)`` rebobinado o ``None`` si falla o supera ``max_bytes``.
+    Pasados ``spool_bytes`` el archivo vive en disco y las escrituras van a un
+    hilo para no bloquear el event loop.
     """
+    chunk_size = chunk_size or MEDIA_CHUNK_BYTES
+    spool_bytes = spool_bytes or MEDIA_SPOOL_BYTES
+    max_bytes = max_bytes or MEDIA_MAX_BYTES
+
     access_token = os.getenv("WHATSAPP_ACCESS_TOKEN")
     if not access_token:
         logging.error(
@@ -159,24 +560,50 @@ def download_whatsapp_media(media_id: str) -> bytes | None:
 
     meta_url = f"https://graph.facebook.com/v17.0/{media_id}"
     headers = {"Authorization": f"Bearer {access_token}"}
+    client = get_async_client()
 
+    spool = tempfile.SpooledTemporaryFile(max_size=spool_bytes)
     try:
-        meta_resp = requests.get(meta_url, headers=headers, timeout=10)
-        meta_resp.raise_for_status()
-        meta_data = meta_resp.json()
-        media_url = meta_data.get("url")
-        if not media_url:
-            logging.error(
-                "[WHATSAPP MEDIA] Respuesta sin URL para media_id=%s: %s",
-                media_id,
-                meta_data,
-            )
-            return None
+        with span("graph_media_download"):
+            meta_resp = await client.get(meta_url, headers=headers, timeout=10)
+            meta_resp.raise_for_status()
+            meta_data = meta_resp.json()
+            media_url = meta_data.get("url")
+            if not media_url:
+                logging.error(
+                    "[WHATSAPP MEDIA] Respuesta sin URL para media_id=%s: %s",
+                    media_id,
+                    meta_data,
+                )
+                spool.close()
+                return None
+
+            size = 0
+            # requests sigue redirecciones por defecto; httpx no.
+            async with client.stream(
+                "GET", media_url, headers=headers, timeout=20, follow_redirects=True
+            ) as resp:
+                resp.raise_for_status()
+                async for chunk in resp.aiter_bytes(chunk_size):
+                    size += len(chunk)
+                    if size > max_bytes:
+                        logging.error(
+                            "[WHATSAPP MEDIA] Media %s supera el máximo de %s bytes",
+                            media_id,
+                            max_bytes,
+                        )
+                        spool.close()
+                        return None
+                    if size > spool_bytes:
+                        # Volcado a disco (o ya en disco): E/S bloqueante
+                        await asyncio.to_thread(spool.write, chunk)
+                    else:
+                        spool.write(chunk)
 
-        bin_resp = requests.get(media_url, headers=headers, timeout=20)
-        bin_resp.raise_for_status()
-        return bin_resp.content
+        spool.seek(0)
+        return spool, size
     except Exception as e:
+        spool.close()
         logging.exception(
             "[WHATSAPP MEDIA] Error descargando media %s: %s", media_id, e
         )
@@ -0,0 +1,45 @@
+import logging
+import os
+import signal
+
+from dotenv import load_dotenv
+
+from services.whatsapp_pipeline import build_worker_pool
+from utils.jobs import SQLJobStore
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+
+
+def main():
+    """
+    Ejecuta los workers de la cola del webhook en un proceso independiente.
+
+    Útil para escalar el procesamiento por separado de la API:
+    ``WHATSAPP_WORKERS=0 gunicorn -c gunicorn.conf.py app:app`` +
+    ``python worker.py``. El esquema debe estar migrado antes
+    (``python -m db.migrations``).
+    """
+    pool = build_worker_pool(
+        SQLJobStore(), int(os.getenv("WHATSAPP_WORKER_THREADS", "4"))
+    )
+    pool.start()
+
+    stop = {"flag": False}
+
+    def _handle(signum, frame):
+        stop["flag"] = True
+
+    signal.signal(signal.SIGTERM, _handle)
+    signal.signal(signal.SIGINT, _handle)
+
+    while not stop["flag"]:
+        signal.pause()
+
+    logging.info("[WORKER] Deteniendo workers...")
+    pool.stop(timeout=30)
+
+
+if __name__ == "__main__":
+    main()